@@ -2,12 +2,30 @@ import os
 import json
 import time
 import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 import streamlit as st
 import streamlit.components.v1 as components
-from gemini_api import GeminiAPI
+from gemini_api import GeminiAPI, PROFILE_TRANSFORM_DESCRIPTION, PROFILE_VALIDATION_RETRY
 from utils import create_static_directories, get_localstorage_component, save_base64_image, cleanup_temp_files, save_uploaded_image
+from retry_stats import RetryStats, build_prompt_variant, PROMPT_VARIANT_BASE, PROMPT_VARIANT_ENHANCED
+from semantic_cache import SemanticCache
+from image_hash import PerceptualIndex
+from image_styles import get_style_registry, scale_ops
+from style_fanout import fan_out_styles, load_source_image, GRID_COLUMNS
+from style_graph import get_style_graph, image_key
+from transform_cache import TransformCache
+from image_decode import DISPLAY_MAX_SIZE, display_image, open_sequential
+from image_encoder import FLAT_IMAGE_SAMPLE_SIZE, FORMAT_AUTO, available_formats, extension_for, get_encoder_settings, mime_type_for_path, settings_key
+from image_tiling import should_tile
+from strip_parallel import create_process_pool, render_parallel_to_file
+from image_pool import get_image_pool, gil_disabled
+from image_animation import is_animated, render_animation_to_file
+from image_backend import available_backends, get_image_backend
+from pixel_art import materialize_pixel_art, pixel_art_html, pixel_art_size, render_pixel_art, split_deferred_upscale
 
 # 環境変数の読み込み
 load_dotenv()
@@ -323,6 +341,52 @@ def startup():
     if "image_mode" not in st.session_state:
         st.session_state.image_mode = False
 
+# スタイル別のリトライ統計を取得する関数（全セッションで共有）
+@st.cache_resource
+def get_retry_stats():
+    """
+    スタイル別のリトライ統計を返す
+    
+    統計はプロセス内で共有され、ファイルに永続化されるため再起動後も引き継がれます。
+    
+    Returns:
+        RetryStats: リトライ統計インスタンス
+    """
+    return RetryStats()
+
+# チャット用の類似質問キャッシュを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_semantic_cache():
+    """
+    チャット用の類似質問キャッシュを返す
+    
+    Returns:
+        SemanticCache: 類似質問キャッシュインスタンス
+    """
+    return SemanticCache()
+
+# 変換画像キャッシュを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_transform_cache():
+    """
+    変換画像キャッシュを返す
+    
+    Returns:
+        TransformCache: 変換画像キャッシュ
+    """
+    return TransformCache()
+
+# 類似画像の結果を再利用するための知覚ハッシュインデックスを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_perceptual_index():
+    """
+    知覚ハッシュインデックスを返す
+    
+    Returns:
+        PerceptualIndex: 知覚ハッシュインデックス
+    """
+    return PerceptualIndex()
+
 # APIキーを確認して有効なGeminiインスタンスを取得する関数
 def get_valid_gemini_instance():
     """
@@ -340,7 +404,7 @@ def get_valid_gemini_instance():
     
     # Geminiインスタンスが存在するか、または保存されているAPIキーが変更されたか確認
     if gemini_instance is None or gemini_instance.api_key != current_api_key:
-        # Geminiインスタンスを再作成
+        # Geminiインスタンスを再作成（スタイル別の生成設定はスタイル定義から取得）
         gemini_instance = GeminiAPI()
         st.session_state["gemini_instance"] = gemini_instance
         
@@ -355,14 +419,18 @@ def get_valid_gemini_instance():
     return gemini_instance, None
 
 # メッセージを処理する関数
-def process_message(user_input, image_data=None, image_path=None):
+def process_message(user_input, image_data=None, image_path=None, use_cache=True):
     """
     ユーザー入力を処理してGeminiからの応答を取得
     
+    画像を含まない質問は類似質問キャッシュを参照し、ほぼ同一の質問への回答が
+    あればAPIを呼び出さずにその回答を返します。
+    
     Args:
         user_input (str): ユーザーの入力テキスト
         image_data (bytes, optional): 画像データ（バイナリ）
         image_path (str, optional): 画像ファイルのパス
+        use_cache (bool, optional): 類似質問キャッシュを使用するかどうか
         
     Returns:
         dict: 処理結果（レスポンスまたはエラー情報）
@@ -386,6 +454,19 @@ def process_message(user_input, image_data=None, image_path=None):
         
         st.session_state.messages.append(new_user_message)
         
+        # 画像を含まない質問は類似質問キャッシュを確認
+        semantic_cache = get_semantic_cache() if use_cache and not image_data else None
+        if semantic_cache is not None:
+            cached_response = semantic_cache.get(user_input)
+            if cached_response is not None:
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": cached_response,
+                    "timestamp": datetime.now().strftime("%H:%M:%S"),
+                    "cached": True,
+                })
+                return {"success": True}
+        
         # ローディング表示
         with st.spinner("Geminiが考え中..."):
             # Gemini APIでレスポンスを生成
@@ -398,11 +479,15 @@ def process_message(user_input, image_data=None, image_path=None):
         if isinstance(response, dict) and "error" in response:
             return response
         
-        # 成功した場合は応答を追加
+        # 成功した場合は応答をキャッシュに登録して追加
+        if semantic_cache is not None:
+            semantic_cache.put(user_input, response)
+        
         st.session_state.messages.append({
             "role": "assistant",
             "content": response,
             "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "model": getattr(response, "model_name", None),
         })
         
         return {"success": True}
@@ -410,6 +495,29 @@ def process_message(user_input, image_data=None, image_path=None):
     except Exception as e:
         return {"error": f"メッセージ処理中にエラーが発生しました: {str(e)}"}
 
+# 変換画像を表示する関数
+def show_transformed_image(target, path, caption=None, max_size=None):
+    """
+    変換画像を表示する（アニメーションはそのまま、縮小保存したピクセルアートはブラウザ側でドットを保ったまま拡大する）
+    
+    Args:
+        target: 表示先（st、カラム、プレースホルダーなど）
+        path (str): 変換画像のパス
+        caption (str, optional): 画像の説明
+        max_size (int, optional): 表示用に縮小する長辺サイズ（省略時は既定値）
+    """
+    max_size = max_size or DISPLAY_MAX_SIZE
+    if mime_type_for_path(path) == "image/gif":
+        # アニメーションは再エンコードせずにそのまま渡す（先頭フレームだけにならないように）
+        target.image(get_transform_cache().read(path), caption=caption, use_column_width=True)
+        return
+    if pixel_art_size(path) is not None:
+        html = pixel_art_html(get_transform_cache().read(path), caption, max_size)
+        if html is not None:
+            target.markdown(html, unsafe_allow_html=True)
+            return
+    target.image(display_image(path, max_size), caption=caption, use_column_width=True)
+
 # 会話履歴を表示する関数
 def display_conversation():
     """会話履歴を表示する"""
@@ -425,7 +533,7 @@ def display_conversation():
                     try:
                         # 画像コンテナを表示
                         st.markdown('<div class="thumbnail-container">', unsafe_allow_html=True)
-                        st.image(message["image_path"], use_column_width=True)
+                        st.image(display_image(message["image_path"]), use_column_width=True)
                         st.markdown(f'<div class="thumbnail-caption">アップロードされた画像</div>', unsafe_allow_html=True)
                         st.markdown('</div>', unsafe_allow_html=True)
                     except Exception as e:
@@ -435,6 +543,12 @@ def display_conversation():
             with st.chat_message("assistant", avatar="🤖"):
                 st.markdown(f"**{message['timestamp']}**")
                 st.markdown(message["content"])
+                
+                # 応答を生成したモデルを表示
+                if message.get("cached"):
+                    st.caption("類似質問のキャッシュから回答しました")
+                elif message.get("model"):
+                    st.caption(f"モデル: {message['model']}")
         
         elif message["role"] == "system":
             st.markdown(f"<div style='background-color: #f0f2f6; padding: 10px; border-radius: 5px; margin-bottom: 10px;'>{message['content']}</div>", unsafe_allow_html=True)
@@ -451,25 +565,7 @@ def get_transformation_prompt(style, custom_instruction=None):
     Returns:
         str: 画像変換のためのプロンプト
     """
-    prompts = {
-        "指定なし": "この画像に対して、一般的な分析と説明を行ってください。画像の内容、特徴、主要な要素について詳しく説明してください。必ず画像の詳細な説明を含めてください。",
-        "アニメ風": "この画像をアニメーションスタイルに変換してください。明るい色彩と特徴的な線画を使用して、日本のアニメのような見た目にしてください。必ず変換後のイメージを詳しく説明してください。",
-        "水彩画風": "この画像を水彩画風に変換してください。柔らかいブラシストローク、淡い色合い、そして水彩特有の滲みを表現してください。必ず変換後のイメージを詳しく説明してください。",
-        "油絵風": "この画像をクラシックな油絵のスタイルに変換してください。豊かな色彩と厚塗りの質感を持つ、印象派の画家が描いたような印象にしてください。必ず変換後のイメージを詳しく説明してください。",
-        "ピクセルアート": "この画像をレトロなピクセルアートスタイルに変換してください。限られた色数と明確なピクセルの境界線を持つ、80年代のビデオゲームのような見た目にしてください。必ず変換後のイメージを詳しく説明してください。",
-        "ネオン風": "この画像をネオン効果のある未来的なスタイルに変換してください。暗い背景に鮮やかな光の要素を加え、サイバーパンクのような雰囲気にしてください。必ず変換後のイメージを詳しく説明してください。",
-        "モノクロ": "この画像をモノクロームのスタイルに変換してください。強いコントラストと深みのある黒を使って、ドラマチックな白黒写真のような仕上がりにしてください。必ず変換後のイメージを詳しく説明してください。",
-        "ポップアート": "この画像をポップアートスタイルに変換してください。明るく大胆な色使い、はっきりとした輪郭線、そしてハーフトーンパターンを使って、アンディ・ウォーホルのような仕上がりにしてください。必ず変換後のイメージを詳しく説明してください。",
-        "スケッチ風": "この画像を鉛筆スケッチのスタイルに変換してください。細かい線と繊細な陰影を使った、手描きのドローイングのような印象にしてください。必ず変換後のイメージを詳しく説明してください。",
-        "リアル風": "この画像をフォトリアリズムのスタイルに変換してください。写真のような精密さと現実的なディテール、自然な光と影の表現を施し、より鮮明で現実感のある印象に仕上げてください。必ず変換後のイメージを詳しく説明してください。",
-    }
-    
-    base_prompt = prompts.get(style, "この画像を変換してください。必ず変換後のイメージを詳しく説明してください。")
-    
-    if custom_instruction:
-        return f"{base_prompt} 追加指示: {custom_instruction}"
-    
-    return base_prompt
+    return get_style_registry().get(style).build_prompt(custom_instruction)
 
 # レスポンスが適切な画像変換の説明を含んでいるかを確認する関数
 def is_valid_transformation_response(response, style):
@@ -483,63 +579,121 @@ def is_valid_transformation_response(response, style):
     Returns:
         bool: 応答が適切な画像変換の説明を含んでいる場合はTrue
     """
-    # 応答がない場合は無効
-    if not response or len(response) < 50:
-        return False
+    return get_style_registry().validate(response, style)
+
+# PILを使用してスタイルに応じた画像変換を行う関数
+def apply_style_transform(image_data, style, encoder_settings=None):
+    """
+    PILを使用して画像を指定スタイルに変換し、変換画像キャッシュに保存する
     
-    # 「指定なし」の場合は画像の説明が含まれているかを確認
-    if style == "指定なし":
-        # 画像の説明に関するキーワード
-        description_keywords = [
-            "画像", "写真", "映像", "表示", "見える", "映っている", 
-            "特徴", "要素", "背景", "前景", "色彩", "構図"
-        ]
+    Args:
+        image_data (bytes): 画像データ
+        style (str): 変換スタイル
+        encoder_settings (dict, optional): 出力画像のエンコード設定（省略時は既定値）
+        
+    Returns:
+        str: 変換後の画像パス（失敗した場合はNone）
+    """
+    transformed_image_path = None
+    
+    try:
+        # 同じ画像・スタイル定義・パラメータの変換結果があれば再利用
+        recipe = get_style_registry().get(style)
+        transform_cache = get_transform_cache()
+        cache_key = transform_cache.make_key(image_data, recipe, encoder_settings=encoder_settings)
+        transformed_image_path = transform_cache.get(cache_key)
+        if transformed_image_path is not None:
+            return transformed_image_path
         
-        # キーワードのうち少なくとも3つが含まれているか確認
-        keyword_count = sum(1 for keyword in description_keywords if keyword in response)
-        if keyword_count < 3:
-            return False
+        # アニメーション（GIF・WebP・APNG）はフレームごとに変換し、逐次アニメーションGIFに書き込む
+        if is_animated(image_data):
+            transformed_image_path = render_animation_to_file(
+                image_data,
+                recipe.ops,
+                transform_cache.base_path(cache_key),
+                executor=get_parallel_executor(),
+                workers=os.cpu_count() or 1
+            )
+            transform_cache.add_file(cache_key)
+            return transformed_image_path
         
-        # 詳細な説明が含まれているか（文の数で判断）
-        sentences = re.split(r'[。.!?]', response)
-        if len(sentences) < 3:
-            return False
+        # 最後がピクセル化のスタイルは縮小画像のまま保存し、拡大は表示・ダウンロード時に行う
+        if split_deferred_upscale(recipe.ops)[1] is not None:
+            transformed_image_path = render_pixel_art(
+                load_source_image(image_data),
+                recipe.ops,
+                transform_cache.base_path(cache_key)
+            )
+            transform_cache.add_file(cache_key)
+            return transformed_image_path
         
-        return True
-    
-    # それ以外のスタイルの場合
-    # スタイル名が含まれているか確認（リアル風の場合は「リアル」も許容）
-    style_keywords = [style.lower()]
-    if style == "リアル風":
-        style_keywords.extend(["リアル", "フォトリアリズム", "写実的"])
-    
-    style_mentioned = any(keyword in response.lower() for keyword in style_keywords)
-    if not style_mentioned:
-        return False
+        # 大きな画像は帯状分割で処理し、画像全体の中間画像を作らずにエンコーダーへ流す
+        # （入力は先頭から順にデコードしてデコード済み画像キャッシュに載せず、
+        #   複数コアがある場合は帯をプロセスプールで並列に処理する）
+        if should_tile(image_data, recipe.ops):
+            transformed_image_path = render_parallel_to_file(
+                open_sequential(image_data),
+                recipe.ops,
+                transform_cache.base_path(cache_key),
+                executor=get_parallel_executor(),
+                encoder_settings=encoder_settings,
+                format_hint=render_style_preview(image_data, style, FLAT_IMAGE_SAMPLE_SIZE)
+            )
+            transform_cache.add_file(cache_key)
+            return transformed_image_path
+        
+        # スタイル定義のパイプラインをスタイルグラフで実行（計算済みの中間画像は再利用）
+        transformed_img = get_style_graph().run(
+            image_key(image_data),
+            partial(load_source_image, image_data),
+            recipe.ops
+        )
+        
+        # 変換した画像をキャッシュに保存
+        transformed_image_path = transform_cache.put(cache_key, transformed_img, encoder_settings)
+        
+    except Exception as e:
+        print(f"画像変換中にエラーが発生しました: {e}")
+        # エラーが発生しても処理を継続（テキスト生成は行う）
     
-    # 画像の特徴や変換結果の説明を含んでいるか確認するキーワード
-    description_keywords = [
-        "変換", "スタイル", "色彩", "質感", "特徴", "表現", "画像", 
-        "効果", "線", "色合い", "テクスチャ", "陰影", "印象"
-    ]
+    return transformed_image_path
+
+# プレビュー用の縮小画像の長辺サイズ
+PREVIEW_MAX_SIZE = 512
+
+# 縮小画像でスタイルのプレビューを作成する関数
+def render_style_preview(image_data, style, max_size=PREVIEW_MAX_SIZE):
+    """
+    縮小デコードした代理画像にスタイルを適用し、プレビュー画像を返す
     
-    # キーワードのうち少なくとも3つが含まれているか確認
-    keyword_count = sum(1 for keyword in description_keywords if keyword in response)
-    if keyword_count < 3:
-        return False
+    JPEGはdraft()で縮小デコードし、さらにreduce()を使った縮小で長辺をmax_sizeに揃えます。
+    ぼかしの半径などサイズに比例するパラメータは縮小率に合わせて調整します。
     
-    # 段落や詳細な説明が含まれているか（改行や文の数で判断）
-    sentences = re.split(r'[。.!?]', response)
-    if len(sentences) < 3:
-        return False
+    Args:
+        image_data (bytes): 画像データ
+        style (str): 変換スタイル
+        max_size (int): 代理画像の長辺の最大サイズ
+        
+    Returns:
+        PIL.Image: プレビュー画像（失敗した場合はNone）
+    """
+    from PIL import Image
+    import io
     
-    return True
+    try:
+        with Image.open(io.BytesIO(image_data)) as original:
+            full_size = max(original.size)
+        proxy = load_source_image(image_data, max_size)
+        ops = scale_ops(get_style_registry().get(style).ops, max(proxy.size) / full_size)
+        return get_style_graph().run(f"{image_key(image_data)}:{max_size}", proxy, ops)
+    except Exception as e:
+        print(f"プレビューの作成中にエラーが発生しました: {e}")
+        return None
 
-# Geminiでの画像変換を実行する関数（リトライ機能付き）
-def transform_image_with_retry(gemini_instance, prompt, image_data, style, max_retries=5):
+# Geminiで変換説明を生成する関数（リトライ機能付き）
+def describe_transformation_with_retry(gemini_instance, prompt, image_data, style, max_retries=5, retry_stats=None):
     """
-    Geminiで画像変換を実行し、適切な結果が得られるまでリトライする。
-    また、PILを使用して実際に画像変換も行います。
+    Geminiで画像変換の説明を生成し、適切な結果が得られるまでリトライする
     
     Args:
         gemini_instance (GeminiAPI): Gemini APIインスタンス
@@ -547,127 +701,223 @@ def transform_image_with_retry(gemini_instance, prompt, image_data, style, max_r
         image_data (bytes): 画像データ
         style (str): 変換スタイル
         max_retries (int, optional): 最大リトライ回数
+        retry_stats (RetryStats, optional): スタイル別の成功率統計（指定時はリトライ回数と開始プロンプトを自動調整）
         
     Returns:
         str: 変換結果のレスポンス
         int: リトライ回数
-        str: 変換後の画像パス
     """
-    from PIL import Image, ImageOps, ImageEnhance, ImageFilter
-    import io
-    import os
-    from datetime import datetime
-    import hashlib
-    
     retry_count = 0
-    transformed_image_path = None
     
-    # 元の画像をPILで読み込む
-    try:
-        img = Image.open(io.BytesIO(image_data))
-        
-        # スタイルに応じた画像変換処理
-        if style == "指定なし":
-            # 元の画像のままで微調整のみ
-            transformed_img = img.copy()
-            # 少し彩度を上げる程度
-            enhancer = ImageEnhance.Color(transformed_img)
-            transformed_img = enhancer.enhance(1.1)
-        elif style == "モノクロ":
-            # モノクロ変換
-            transformed_img = ImageOps.grayscale(img)
-            # コントラスト強調
-            enhancer = ImageEnhance.Contrast(transformed_img)
-            transformed_img = enhancer.enhance(1.2)
-        elif style == "スケッチ風":
-            # エッジ検出してスケッチ風に
-            transformed_img = img.convert("L")
-            transformed_img = ImageOps.invert(transformed_img)
-            transformed_img = transformed_img.filter(ImageFilter.FIND_EDGES)
-            transformed_img = ImageOps.invert(transformed_img)
-        elif style == "アニメ風":
-            # 色彩強調とエッジ検出の組み合わせ
-            # 色の彩度を上げる
-            color_img = ImageEnhance.Color(img).enhance(1.5)
-            # エッジを検出
-            edges = img.convert("L").filter(ImageFilter.FIND_EDGES)
-            # 元の色彩強調画像にエッジをブレンド
-            transformed_img = color_img
-        elif style == "水彩画風":
-            # ぼかしを適用して水彩風に
-            transformed_img = img.filter(ImageFilter.GaussianBlur(radius=1))
-            # 彩度を少し下げる
-            transformed_img = ImageEnhance.Color(transformed_img).enhance(0.8)
-        elif style == "油絵風":
-            # コントラストと彩度を高めて油絵風に
-            transformed_img = ImageEnhance.Contrast(img).enhance(1.3)
-            transformed_img = ImageEnhance.Color(transformed_img).enhance(1.4)
-            # テクスチャ感を出すために少しぼかす
-            transformed_img = transformed_img.filter(ImageFilter.GaussianBlur(radius=0.5))
-        elif style == "ピクセルアート":
-            # 画像サイズを縮小してからリサイズして荒くする
-            small_size = (img.width // 10, img.height // 10)
-            transformed_img = img.resize(small_size, Image.NEAREST)
-            transformed_img = transformed_img.resize((img.width, img.height), Image.NEAREST)
-        elif style == "ネオン風":
-            # エッジを検出して明るい色に
-            edges = img.filter(ImageFilter.FIND_EDGES)
-            # 彩度と明るさを上げる
-            transformed_img = ImageEnhance.Color(edges).enhance(2.0)
-            transformed_img = ImageEnhance.Brightness(transformed_img).enhance(1.5)
-        elif style == "ポップアート":
-            # 彩度を大幅に上げてポップアートっぽく
-            transformed_img = ImageEnhance.Color(img).enhance(2.0)
-            transformed_img = ImageEnhance.Contrast(transformed_img).enhance(1.5)
-        elif style == "リアル風":
-            # シャープネスとコントラストを上げてリアル感を出す
-            transformed_img = ImageEnhance.Sharpness(img).enhance(1.5)
-            transformed_img = ImageEnhance.Contrast(transformed_img).enhance(1.2)
-            # 色の自然さを保ちつつ、ディテールを強調
-            transformed_img = ImageEnhance.Color(transformed_img).enhance(1.1)
-        else:
-            # デフォルトはモノクロ
-            transformed_img = ImageOps.grayscale(img)
-        
-        # 変換した画像を一時ファイルに保存
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename_hash = hashlib.md5(image_data).hexdigest()[:8]  # 画像データのハッシュ値を使用
-        temp_dir = "temp_images"
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        transformed_image_path = os.path.join(temp_dir, f"{timestamp}_{filename_hash}_{style}.png")
-        transformed_img.save(transformed_image_path)
-        
-    except Exception as e:
-        print(f"画像変換中にエラーが発生しました: {e}")
-        # エラーが発生しても処理を継続（テキスト生成は行う）
+    # 過去の成功率から開始プロンプトとリトライ回数を決定
+    variant = PROMPT_VARIANT_BASE
+    if retry_stats is not None:
+        variant = retry_stats.best_variant(style)
+        max_retries = retry_stats.retry_budget(style, variant, PROMPT_VARIANT_ENHANCED, max_retries)
     
     while retry_count < max_retries:
         # リトライカウントを増やす
         retry_count += 1
         
         # Gemini APIで画像変換を実行
-        response = gemini_instance.generate_content(prompt, image_data=image_data)
+        profile = PROFILE_VALIDATION_RETRY if variant == PROMPT_VARIANT_ENHANCED else PROFILE_TRANSFORM_DESCRIPTION
+        response = gemini_instance.generate_content(
+            build_prompt_variant(prompt, style, variant),
+            image_data=image_data,
+            profile=profile,
+            style=style
+        )
         
         # エラーチェック
         if isinstance(response, dict) and "error" in response:
-            return response, retry_count, transformed_image_path
+            return response, retry_count
         
         # 応答が適切な画像変換の説明を含んでいるか確認
-        if is_valid_transformation_response(response, style):
-            return response, retry_count, transformed_image_path
+        is_valid = is_valid_transformation_response(response, style)
+        if retry_stats is not None:
+            retry_stats.record(style, variant, is_valid, first_attempt=(retry_count == 1))
+        
+        if is_valid:
+            return response, retry_count
         
         # 適切な応答が得られなかった場合、プロンプトを強化してリトライ
         if retry_count < max_retries:
-            # プロンプトを強化
-            enhanced_prompt = f"{prompt}\n\n重要: この画像の{style}への変換について、具体的かつ詳細に説明してください。画像の特徴、色彩、構図、質感などの変化を詳しく述べてください。少なくとも3段落、200文字以上の詳細な説明を提供してください。"
-            prompt = enhanced_prompt
+            variant = PROMPT_VARIANT_ENHANCED
             
             # 一時停止して再試行（API制限対策）
             time.sleep(1)
     
     # 最大リトライ回数に達しても適切な応答が得られなかった場合
-    return response, retry_count, transformed_image_path
+    return response, retry_count
+
+# Gemini API呼び出し用のスレッドプールを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_api_executor():
+    """
+    Gemini APIの呼び出しをローカル変換と並行して実行するスレッドプールを返す
+    
+    API呼び出しは応答待ちが大半のため、CPUコア数で制限した画像処理プールとは分けて実行します。
+    
+    Returns:
+        ThreadPoolExecutor: API呼び出し用のスレッドプール
+    """
+    return ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="api")
+
+# 全スタイル比較で使用する代理画像の長辺サイズ
+STYLE_GRID_PROXY_SIZE = 1024
+
+# 全スタイル比較のグリッドに表示する画像の長辺サイズ
+GRID_DISPLAY_SIZE = 512
+
+# 大きな画像の帯やアニメーションのフレームを処理するプロセスプールを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_style_process_pool():
+    """
+    大きな画像の帯やアニメーションのフレームの処理を並列実行するプロセスプールを返す
+    
+    Returns:
+        ProcessPoolExecutor: プロセスプール（CPUが1コアの場合やGILが無効の場合はNone）
+    """
+    workers = os.cpu_count() or 1
+    if workers < 2 or gil_disabled():
+        return None
+    return create_process_pool(max_workers=workers)
+
+# 画像を分割して並列処理するExecutorを取得する関数
+def get_parallel_executor():
+    """
+    大きな画像の帯やアニメーションのフレームの処理を並列実行するExecutorを返す
+    
+    GILが無効のPythonではスレッドでPythonコードも並列に動くため、
+    プロセス間の受け渡しが不要な画像処理プールを使います。
+    
+    Returns:
+        Executor: 並列処理に使うExecutor（並列化しない場合はNone）
+    """
+    if gil_disabled():
+        return get_image_pool()
+    return get_style_process_pool()
+
+# 先読み変換の1セッションあたりの上限回数
+SPECULATIVE_LOCAL_BUDGET = 20
+SPECULATIVE_API_BUDGET = 3
+
+# 先読み変換用のスレッドプールを取得する関数（全セッションで共有）
+@st.cache_resource
+def get_speculative_executor():
+    """
+    Gemini APIの先読み呼び出しを実行するスレッドプールを返す（ローカル変換は画像処理プールで実行）
+    
+    Returns:
+        ThreadPoolExecutor: 先読み変換用のスレッドプール
+    """
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculative")
+
+# 画像とスタイルが選択された時点で変換を先行して開始する関数
+def start_speculative_transform(image_data, style, prompt, include_api=False, encoder_settings=None):
+    """
+    選択中の画像とスタイルで変換をバックグラウンドで開始する
+    
+    ローカルのPIL変換は常に、Gemini APIの呼び出しは include_api が True の場合のみ先行実行します。
+    いずれもセッションごとの上限回数を超えた場合は開始しません。
+    ローカル変換は画像処理プールが混み合っている場合も開始しません（実際の変換を優先するため）。
+    
+    Args:
+        image_data (bytes): 画像データ
+        style (str): 変換スタイル
+        prompt (str): 変換プロンプト
+        include_api (bool): Gemini APIの呼び出しも先行実行するかどうか
+        encoder_settings (dict, optional): 出力画像のエンコード設定（省略時は既定値）
+    """
+    state = st.session_state.setdefault("speculative", {
+        "image_hash": None,
+        "results": {},
+        "consumed": set(),
+        "local_spent": 0,
+        "api_spent": 0,
+    })
+    
+    # 画像が変わったら以前の先読み結果を破棄
+    image_hash = hashlib.md5(image_data).hexdigest()
+    if state["image_hash"] != image_hash:
+        for future in state["results"].values():
+            future.cancel()
+        state["image_hash"] = image_hash
+        state["results"] = {}
+        state["consumed"] = set()
+    
+    executor = get_speculative_executor()
+    results = state["results"]
+    
+    local_key = ("local", style, settings_key(encoder_settings or get_encoder_settings()))
+    if local_key not in results and state["local_spent"] < SPECULATIVE_LOCAL_BUDGET:
+        local_future = get_image_pool().submit(apply_style_transform, image_data, style, encoder_settings, block=False)
+        if local_future is not None:
+            results[local_key] = local_future
+            state["local_spent"] += 1
+    
+    api_key = ("api", style, prompt)
+    if (include_api and api_key not in results and api_key not in state["consumed"]
+            and state["api_spent"] < SPECULATIVE_API_BUDGET):
+        gemini_instance, error_message = get_valid_gemini_instance()
+        if gemini_instance is not None:
+            results[api_key] = executor.submit(
+                describe_transformation_with_retry,
+                gemini_instance, prompt, image_data, style,
+                retry_stats=get_retry_stats()
+            )
+            state["api_spent"] += 1
+
+# 先読み変換の結果を取り出す関数
+def take_speculative_futures(image_data, style, prompt, encoder_settings=None):
+    """
+    先読み変換のFutureを取り出す
+    
+    Gemini APIの先読み結果は一度だけ利用し、同じ条件で再度先読みしないよう記録します。
+    
+    Args:
+        image_data (bytes): 画像データ
+        style (str): 変換スタイル
+        prompt (str): 変換プロンプト
+        encoder_settings (dict, optional): 出力画像のエンコード設定（省略時は既定値）
+        
+    Returns:
+        Future: ローカル変換のFuture（先読みしていない場合はNone）
+        Future: Gemini API呼び出しのFuture（先読みしていない場合はNone）
+    """
+    state = st.session_state.get("speculative")
+    if not state or state["image_hash"] != hashlib.md5(image_data).hexdigest():
+        return None, None
+    
+    local_future = state["results"].get(("local", style, settings_key(encoder_settings or get_encoder_settings())))
+    api_key = ("api", style, prompt)
+    api_future = state["results"].pop(api_key, None)
+    if api_future is not None:
+        state["consumed"].add(api_key)
+    return local_future, api_future
+
+# 出力形式の選択肢（表示名: 形式）
+OUTPUT_FORMAT_LABELS = {
+    "自動（写真はJPEG、イラストはPNG）": FORMAT_AUTO,
+    "WebP": "webp",
+    "AVIF": "avif",
+    "JPEG": "jpeg",
+    "PNG": "png",
+}
+
+# サイドバーの出力設定からエンコード設定を作成する関数
+def get_output_encoder_settings():
+    """
+    サイドバーで選択された出力形式・画質からエンコード設定を返す
+    
+    Returns:
+        dict: エンコード設定
+    """
+    label = st.session_state.get("output_format")
+    return get_encoder_settings(
+        format=OUTPUT_FORMAT_LABELS.get(label),
+        quality=st.session_state.get("output_quality")
+    )
 
 # メイン関数
 def main():
@@ -694,6 +944,65 @@ def main():
         # モードの状態を更新
         st.session_state.image_mode = (app_mode == "画像変換モード")
         
+        # 先読み変換の設定
+        if st.session_state.image_mode:
+            speculative_mode = st.checkbox(
+                "先読み変換",
+                key="speculative_mode",
+                help="画像とスタイルを選択した時点で変換を開始し、「変換を実行」を押したときにすぐ結果を表示します"
+            )
+            st.checkbox(
+                "先読みでGemini APIも呼び出す",
+                key="speculative_api",
+                disabled=not speculative_mode,
+                help=f"Gemini APIの先読み呼び出しは1セッションあたり{SPECULATIVE_API_BUDGET}回までです"
+            )
+            st.checkbox(
+                "全スタイル比較は縮小画像で作成",
+                key="style_grid_proxy",
+                help=f"長辺{STYLE_GRID_PROXY_SIZE}pxに縮小した画像で全スタイルを変換し、比較を素早く表示します"
+            )
+            
+            # 出力形式の設定（このPIL環境で保存できる形式のみ表示）
+            formats = available_formats()
+            st.selectbox(
+                "出力形式",
+                [label for label, fmt in OUTPUT_FORMAT_LABELS.items() if fmt == FORMAT_AUTO or fmt in formats],
+                key="output_format",
+                help="自動では、色数の少ない画像や透過のある画像はPNG、写真のような画像はJPEGで保存します"
+            )
+            st.slider(
+                "画質",
+                min_value=50,
+                max_value=100,
+                value=get_encoder_settings()["quality"],
+                key="output_quality",
+                help="JPEG・WebP・AVIFの画質です（PNGは可逆圧縮のため影響しません）"
+            )
+            
+            # 画像処理プールの状態（全セッション共通）
+            with st.expander("画像処理の状況"):
+                pool_stats = get_image_pool().stats()
+                st.caption(
+                    f"ワーカー: {pool_stats['workers']}（実行中 {pool_stats['running']}・待機 {pool_stats['queued']}）"
+                    + ("・GIL無効" if pool_stats["gil_disabled"] else "")
+                )
+                st.caption(
+                    f"実行待ち時間: 中央値 {pool_stats['wait_p50']:.2f}秒 / "
+                    f"95% {pool_stats['wait_p95']:.2f}秒 / 最大 {pool_stats['wait_max']:.2f}秒"
+                )
+                st.caption(
+                    f"画像処理バックエンド: {get_image_backend().name}"
+                    f"（利用可能: {', '.join(available_backends())}）"
+                )
+        else:
+            st.checkbox(
+                "類似質問のキャッシュを使用",
+                value=True,
+                key="semantic_cache_enabled",
+                help="ほぼ同じ質問には過去の回答を再利用して、API呼び出しを省略します"
+            )
+        
         # APIキー入力（初期値は.envから）
         api_key = os.getenv("GEMINI_API_KEY", "")
         st.markdown("### Gemini APIキー設定")
@@ -796,6 +1105,7 @@ def main():
             st.markdown("2. 変換スタイルを選択")
             st.markdown("3. 必要に応じてカスタム指示を入力")
             st.markdown("4. 「変換を実行」ボタンを押して処理を開始")
+            st.markdown("5. 「全スタイルで比較」ですべてのスタイルを一覧で比較")
         else:
             st.subheader("チャットの使い方")
             st.markdown("1. テキスト入力欄に質問や指示を入力")
@@ -815,7 +1125,7 @@ def main():
         # 画像アップロードUIの横幅を広げる
         uploaded_image = st.file_uploader(
             "📷 画像をアップロード", 
-            type=["jpg", "jpeg", "png"],
+            type=["jpg", "jpeg", "png", "gif", "webp"],
             help="画像をアップロードして変換または分析を行います"
         )
         
@@ -827,7 +1137,7 @@ def main():
             st.markdown("<div class='style-option-label'>変換スタイルを選択：</div>", unsafe_allow_html=True)
             transformation_style = st.selectbox(
                 "変換スタイル",
-                ["指定なし", "アニメ風", "水彩画風", "油絵風", "ピクセルアート", "ネオン風", "モノクロ", "ポップアート", "スケッチ風", "リアル風"],
+                get_style_registry().style_names(),
                 label_visibility="collapsed"
             )
             
@@ -837,6 +1147,16 @@ def main():
                 placeholder="例：より明るい色合いで、背景を夕焼けにしてください"
             )
             
+            # 先読み変換の開始
+            if st.session_state.get("speculative_mode"):
+                start_speculative_transform(
+                    uploaded_image.getvalue(),
+                    transformation_style,
+                    get_transformation_prompt(transformation_style, custom_instruction),
+                    include_api=st.session_state.get("speculative_api", False),
+                    encoder_settings=get_output_encoder_settings()
+                )
+            
             # 変換実行ボタン
             if st.button("変換を実行", type="primary", use_container_width=True):
                 # 有効なGeminiインスタンスを取得
@@ -864,14 +1184,77 @@ def main():
                         }
                         st.session_state.messages.append(user_message)
                         
-                        # 画像変換処理（リトライ機能付き）
+                        # 画像変換処理（リトライ機能付き、先読み結果や類似画像の結果があれば再利用）
+                        perceptual_index = get_perceptual_index()
+                        image_phash = perceptual_index.hash_image(image_data)
+                        encoder_settings = get_output_encoder_settings()
+                        transform_namespace = f"transform:{transformation_style}:" + TransformCache.params_key(
+                            get_style_registry().get(transformation_style), encoder_settings=encoder_settings
+                        )
+                        description_namespace = f"description:{transformation_style}:{prompt}"
+                        local_future, api_future = take_speculative_futures(
+                            image_data, transformation_style, prompt, encoder_settings
+                        )
+                        preview_placeholder = st.empty()
                         with st.spinner(f"{transformation_style}スタイルに変換中..."):
-                            response, retry_count, transformed_image_path = transform_image_with_retry(
-                                gemini_instance, 
-                                prompt, 
-                                image_data, 
-                                transformation_style
-                            )
+                            transformed_image_path = None
+                            if local_future is None:
+                                transformed_image_path = perceptual_index.lookup(image_phash, transform_namespace)
+                                if transformed_image_path and not os.path.exists(transformed_image_path):
+                                    perceptual_index.discard(image_phash, transform_namespace)
+                                    transformed_image_path = None
+                                if transformed_image_path is None:
+                                    # ローカル変換は画像処理プールで実行し、Gemini APIの呼び出しと重ねる
+                                    local_future = get_image_pool().submit(
+                                        apply_style_transform, image_data, transformation_style, encoder_settings
+                                    )
+                            
+                            # 先読み結果や類似画像の説明がなければ、Gemini APIもワーカーで呼び出す
+                            cached_description = perceptual_index.lookup(image_phash, description_namespace)
+                            from_speculation = api_future is not None
+                            if api_future is None and cached_description is None:
+                                api_future = get_api_executor().submit(
+                                    describe_transformation_with_retry,
+                                    gemini_instance,
+                                    prompt,
+                                    image_data,
+                                    transformation_style,
+                                    retry_stats=get_retry_stats()
+                                )
+                            
+                            # フル解像度の変換を待つ間、縮小画像のプレビューを表示
+                            if local_future is not None and not local_future.done():
+                                preview = render_style_preview(image_data, transformation_style)
+                                if preview is not None:
+                                    preview_placeholder.image(preview, caption="プレビュー（縮小画像）", use_column_width=True)
+                            
+                            # ローカル変換の完了を待ち、フル解像度の結果に差し替える
+                            if local_future is not None:
+                                transformed_image_path = local_future.result()
+                            perceptual_index.store(image_phash, transform_namespace, transformed_image_path)
+                            if transformed_image_path:
+                                show_transformed_image(preview_placeholder, transformed_image_path, caption="変換結果")
+                            
+                            api_result = api_future.result() if api_future is not None else None
+                            if api_result is not None and not isinstance(api_result[0], dict):
+                                response, retry_count = api_result
+                            elif cached_description is not None:
+                                response, retry_count = cached_description
+                            elif from_speculation:
+                                # 先読みの呼び出しが失敗した場合はあらためて呼び出す
+                                response, retry_count = describe_transformation_with_retry(
+                                    gemini_instance,
+                                    prompt,
+                                    image_data,
+                                    transformation_style,
+                                    retry_stats=get_retry_stats()
+                                )
+                            else:
+                                response, retry_count = api_result
+                            
+                            # 検証を通過した説明のみ類似画像向けに登録
+                            if not isinstance(response, dict) and is_valid_transformation_response(response, transformation_style):
+                                perceptual_index.store(image_phash, description_namespace, (response, retry_count))
                         
                         if isinstance(response, dict) and "error" in response:
                             st.error(f"⚠️ エラーが発生しました: {response['error']}")
@@ -889,12 +1272,44 @@ def main():
                                 "timestamp": datetime.now().strftime("%H:%M:%S"),
                                 "transformation_style": transformation_style,
                                 "retry_count": retry_count,
-                                "transformed_image_path": transformed_image_path
+                                "transformed_image_path": transformed_image_path,
+                                "model": getattr(response, "model_name", None)
                             }
                             
                             st.session_state.messages.append(ai_message)
                             st.rerun()
             
+            # 全スタイル比較ボタン（デコードは1回のみで、全スタイルを画像処理プールのスレッドで並列に変換）
+            if st.button("全スタイルで比較", use_container_width=True):
+                image_data = uploaded_image.getvalue()
+                max_size = STYLE_GRID_PROXY_SIZE if st.session_state.get("style_grid_proxy") else None
+                with st.spinner("全スタイルに変換中..."):
+                    style_paths = fan_out_styles(
+                        image_data,
+                        executor=get_image_pool(),
+                        max_size=max_size,
+                        cache=get_transform_cache(),
+                        encoder_settings=get_output_encoder_settings()
+                    )
+                st.session_state.style_grid = {
+                    "image_hash": hashlib.md5(image_data).hexdigest(),
+                    "style_paths": style_paths,
+                }
+            
+            # 全スタイル比較の結果をグリッドで表示
+            style_grid = st.session_state.get("style_grid")
+            if style_grid and style_grid["image_hash"] == hashlib.md5(uploaded_image.getvalue()).hexdigest():
+                st.markdown("<h3>全スタイル比較</h3>", unsafe_allow_html=True)
+                items = list(style_grid["style_paths"].items())
+                for start in range(0, len(items), GRID_COLUMNS):
+                    columns = st.columns(GRID_COLUMNS)
+                    for column, (style, path) in zip(columns, items[start:start + GRID_COLUMNS]):
+                        with column:
+                            if path and os.path.exists(path):
+                                show_transformed_image(st, path, caption=style, max_size=GRID_DISPLAY_SIZE)
+                            else:
+                                st.warning(f"{style}: 変換に失敗しました")
+            
             st.markdown('</div>', unsafe_allow_html=True)
         
         # 会話履歴用コンテナ
@@ -931,7 +1346,7 @@ def main():
                     st.markdown('<div class="image-card">', unsafe_allow_html=True)
                     st.markdown('<div class="image-card-header">元の画像</div>', unsafe_allow_html=True)
                     st.markdown('<div class="image-card-body">', unsafe_allow_html=True)
-                    st.image(latest_user_image["image_path"], use_column_width=True)
+                    st.image(display_image(latest_user_image["image_path"]), use_column_width=True)
                     st.markdown('</div></div>', unsafe_allow_html=True)
                     
                     # 変換後の画像と説明
@@ -942,18 +1357,33 @@ def main():
                     # 変換された画像があれば表示
                     if "transformed_image_path" in latest_response and latest_response["transformed_image_path"]:
                         try:
-                            st.image(latest_response["transformed_image_path"], use_column_width=True)
+                            transformed_path = latest_response["transformed_image_path"]
+                            show_transformed_image(st, transformed_path)
                             
                             # ダウンロードボタンを追加
-                            with open(latest_response["transformed_image_path"], "rb") as f:
-                                img_bytes = f.read()
-                                style_name = latest_user_image.get("transformation_style", "変換済み")
-                                file_extension = latest_response["transformed_image_path"].split(".")[-1]
+                            img_bytes = get_transform_cache().read(transformed_path)
+                            style_name = latest_user_image.get("transformation_style", "変換済み")
+                            file_extension = os.path.splitext(transformed_path)[1]
+                            download_ready = True
+                            if pixel_art_size(transformed_path) is not None:
+                                # 縮小保存したピクセルアートは、ダウンロードする場合にだけ元のサイズに拡大する
+                                prepared = st.session_state.get("pixel_art_download")
+                                if prepared is None or prepared["path"] != transformed_path:
+                                    prepared = None
+                                    if st.button(f"{style_name}画像（元のサイズ）を作成", key="prepare_pixel_art_download"):
+                                        data, fmt = materialize_pixel_art(img_bytes, get_output_encoder_settings())
+                                        prepared = {"path": transformed_path, "data": data, "extension": extension_for(fmt)}
+                                        st.session_state.pixel_art_download = prepared
+                                download_ready = prepared is not None
+                                if download_ready:
+                                    img_bytes, file_extension = prepared["data"], prepared["extension"]
+                            if download_ready:
+                                file_name = f"gemini_{style_name}_image{file_extension}"
                                 st.download_button(
                                     label=f"{style_name}画像をダウンロード",
                                     data=img_bytes,
-                                    file_name=f"gemini_{style_name}_image.{file_extension}",
-                                    mime=f"image/{file_extension}"
+                                    file_name=file_name,
+                                    mime=mime_type_for_path(file_name)
                                 )
                         except Exception as e:
                             st.error(f"変換画像の表示に失敗しました: {str(e)}")
@@ -1017,7 +1447,10 @@ def main():
                             st.error("画像の保存に失敗しました。別の画像を試してください。")
                     
                     # メッセージを処理
-                    result = process_message(user_input, image_data, image_path)
+                    result = process_message(
+                        user_input, image_data, image_path,
+                        use_cache=st.session_state.get("semantic_cache_enabled", True)
+                    )
                     
                     # エラーチェック
                     if "error" in result:
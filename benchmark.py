@@ -0,0 +1,617 @@
+import os
+import io
+import time
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+
+def print_table(headers, rows):
+    """
+    ベンチマーク結果を表形式で出力する
+
+    Args:
+        headers (list): 列見出し
+        rows (list): 行データのリスト
+    """
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(cell).ljust(w) for cell, w in zip(row, widths)))
+
+
+def peak_rss_mb():
+    """
+    プロセスの最大RSS（MB）を返す
+
+    Linuxでは /proc/self/status の VmHWM を使います（getrusageの最大RSSは
+    execをまたいで親プロセスの値を引き継ぐため、子プロセスでの計測に使えません）。
+
+    Returns:
+        float: 最大RSS（MB）
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_sample_image(path=None, size=(1600, 1200)):
+    """
+    ベンチマーク用の画像データを読み込む（指定がなければ合成画像を生成する）
+
+    Args:
+        path (str, optional): 画像ファイルのパス
+        size (tuple): 合成画像のサイズ
+
+    Returns:
+        bytes: 画像データ（JPEG）
+    """
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+
+    from PIL import Image
+    import numpy as np
+
+    # グラデーションとノイズを重ねた写真に近い合成画像
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(0)
+    base = np.stack([
+        255 * x / width,
+        255 * y / height,
+        127 + 127 * np.sin((x + y) / 40.0),
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def bench_generation(args):
+    """
+    生成プロファイルごとのレイテンシを従来の8192トークン設定と比較する
+
+    実際のGemini APIを呼び出すため、GEMINI_API_KEYの設定が必要です。
+    """
+    from gemini_api import (
+        GeminiAPI, GENERATION_PROFILES, PROFILE_CHAT,
+        PROFILE_TRANSFORM_DESCRIPTION, PROFILE_VALIDATION_RETRY,
+    )
+    from image_styles import get_style_registry
+    from retry_stats import build_prompt_variant, PROMPT_VARIANT_ENHANCED
+
+    legacy_profile = dict(GENERATION_PROFILES[PROFILE_CHAT], max_output_tokens=8192)
+    registry = get_style_registry()
+    gemini = GeminiAPI(generation_profiles={"legacy": legacy_profile})
+    image_data = load_sample_image(args.image)
+    style = args.style
+    prompt = registry.get(style).build_prompt()
+
+    cases = [
+        ("chat", "この画像変換アプリで何ができますか？", None, PROFILE_CHAT),
+        ("transform", prompt, image_data, PROFILE_TRANSFORM_DESCRIPTION),
+        ("retry", build_prompt_variant(prompt, style, PROMPT_VARIANT_ENHANCED), image_data, PROFILE_VALIDATION_RETRY),
+    ]
+
+    rows = []
+    for name, text, data, profile in cases:
+        for label, profile_name in [("legacy", "legacy"), ("profile", profile)]:
+            latencies, lengths = [], []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                response = gemini.generate_content(text, image_data=data, profile=profile_name, style=style)
+                latencies.append(time.perf_counter() - started_at)
+                if isinstance(response, dict):
+                    print(f"{name}/{label}: {response['error']}")
+                    return
+                lengths.append(len(response))
+            rows.append([
+                name, label,
+                gemini.generation_profiles[profile_name]["max_output_tokens"],
+                f"{statistics.median(latencies):.2f}s",
+                f"{max(latencies):.2f}s",
+                int(statistics.mean(lengths)),
+            ])
+
+    print_table(["mode", "config", "max_tokens", "p50", "max", "chars"], rows)
+
+
+def bench_kernels(args):
+    """
+    スタイルごとにPILエンジンと他の画像処理エンジンのスループットと出力の一致を比較する
+
+    出力が許容誤差を超えて一致しないスタイルがあれば終了コード1で終了します。
+    """
+    import numpy as np
+    from PIL import Image
+    from image_styles import get_style_registry
+
+    registry = get_style_registry()
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    img = Image.open(io.BytesIO(load_sample_image(args.image, size=(width, height))))
+    img.load()
+    megapixels = img.width * img.height / 1_000_000
+    engines = ["pil"] + [e for e in args.engines.split(",") if e and e != "pil"]
+
+    rows = []
+    failures = []
+    for name in registry.style_names():
+        recipe = registry.get(name)
+        timings = {}
+        outputs = {}
+        for engine in engines:
+            samples = []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                outputs[engine] = recipe.apply(img, engine=engine)
+                samples.append(time.perf_counter() - started_at)
+            timings[engine] = statistics.median(samples)
+
+        row = [name, f"{timings['pil']:.3f}s"]
+        expected = np.asarray(outputs["pil"], dtype=np.int16)
+        for engine in engines[1:]:
+            actual = np.asarray(outputs[engine], dtype=np.int16)
+            max_diff = int(np.abs(expected - actual).max()) if expected.shape == actual.shape else -1
+            if max_diff < 0 or max_diff > args.tolerance:
+                failures.append(f"{name}({engine})")
+            row += [f"{timings[engine]:.3f}s", f"x{timings['pil'] / timings[engine]:.2f}", max_diff]
+        rows.append(row)
+
+    headers = ["style", "pil"]
+    for engine in engines[1:]:
+        headers += [engine, "speedup", "max diff"]
+    print(f"{img.width}x{img.height} ({megapixels:.1f} MP), repeat={args.repeat}")
+    print_table(headers, rows)
+    if failures:
+        print(f"出力が一致しないスタイル: {', '.join(failures)}")
+        raise SystemExit(1)
+
+
+def bench_pool(args):
+    """
+    複数セッションからの同時変換を画像処理プールで実行し、スループットと実行待ち時間を計測する
+
+    ワーカー数ごとに、セッション数分のスレッドから同時に変換を投入します。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from image_pool import ImagePool, gil_disabled
+    from image_styles import get_style_registry
+
+    recipe = get_style_registry().get(args.style)
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    img = Image.open(io.BytesIO(load_sample_image(args.image, size=(width, width * 3 // 4))))
+    img.load()
+
+    def session(pool):
+        latencies = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            pool.submit(recipe.apply, img).result()
+            latencies.append(time.perf_counter() - started_at)
+        return latencies
+
+    worker_counts = sorted({1, os.cpu_count() or 1, *(int(w) for w in args.workers.split(",") if w)})
+    rows = []
+    for workers in worker_counts:
+        pool = ImagePool(workers=workers)
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as sessions:
+            latencies = sorted(sum(sessions.map(lambda _: session(pool), range(args.sessions)), []))
+        elapsed = time.perf_counter() - started_at
+        stats = pool.stats()
+        pool.shutdown()
+        rows.append([
+            workers,
+            f"{len(latencies) / elapsed:.2f}/s",
+            f"{statistics.median(latencies):.3f}s",
+            f"{latencies[int(len(latencies) * 0.95) - 1]:.3f}s",
+            f"{stats['wait_p50']:.3f}s",
+            f"{stats['wait_p95']:.3f}s",
+        ])
+
+    print(f"{args.style}, {img.width}x{img.height}, sessions={args.sessions}, "
+          f"cpu={os.cpu_count()}, gil={'off' if gil_disabled() else 'on'}")
+    print_table(["workers", "throughput", "p50", "p95", "wait p50", "wait p95"], rows)
+
+
+def bench_cartoon(args):
+    """
+    アニメ風スタイルについて、以前の彩度調整のみの処理と減色・輪郭線を含む処理の処理時間を比較する
+    """
+    from PIL import Image
+    from image_styles import compile_pipeline, get_style_registry
+
+    recipe = get_style_registry().get(args.style)
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    img = Image.open(io.BytesIO(load_sample_image(args.image, size=(width, width * 3 // 4))))
+    img.load()
+    megapixels = img.width * img.height / 1_000_000
+
+    def measure(steps):
+        samples = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            result = img
+            for step in steps:
+                result = step(result)
+            samples.append(time.perf_counter() - started_at)
+        return statistics.median(samples)
+
+    cases = [
+        ("color only", compile_pipeline([{"op": "color", "factor": 1.5}])),
+        ("cartoon", recipe.pipeline),
+    ]
+    rows = []
+    for label, steps in cases:
+        elapsed = measure(steps)
+        rows.append([label, f"{elapsed:.3f}s", f"{megapixels / elapsed:.1f} MP/s"])
+
+    print(f"{args.style}, {img.width}x{img.height} ({megapixels:.1f} MP), repeat={args.repeat}")
+    print_table(["pipeline", "time", "throughput"], rows)
+
+
+def bench_blur(args):
+    """
+    半径ごとにPILのガウスぼかしとぼかしエンジン（半径に応じて方式を選択）の処理時間と誤差を比較する
+    """
+    import numpy as np
+    from PIL import Image, ImageFilter
+    from image_blur import choose_blur_method, fast_blur, glow
+
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    img = Image.open(io.BytesIO(load_sample_image(args.image, size=(width, width * 3 // 4))))
+    img.load()
+
+    def measure(fn):
+        samples = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            result = fn()
+            samples.append(time.perf_counter() - started_at)
+        return statistics.median(samples), result
+
+    rows = []
+    for radius in (float(r) for r in args.radii.split(",") if r):
+        method, factor = choose_blur_method(radius)
+        pil_time, expected = measure(lambda: img.filter(ImageFilter.GaussianBlur(radius)))
+        fast_time, actual = measure(lambda: fast_blur(img, radius))
+        diff = np.abs(np.asarray(expected, dtype=np.int16) - np.asarray(actual, dtype=np.int16))
+        glow_time, _ = measure(lambda: glow(img, radius))
+        rows.append([
+            radius,
+            method if factor == 1 else f"{method} 1/{factor}",
+            f"{pil_time:.3f}s",
+            f"{fast_time:.3f}s",
+            f"x{pil_time / fast_time:.2f}",
+            int(diff.max()),
+            f"{diff.mean():.2f}",
+            f"{glow_time:.3f}s",
+        ])
+
+    print(f"{img.width}x{img.height}, repeat={args.repeat}")
+    print_table(["radius", "method", "pil", "engine", "speedup", "max diff", "mean diff", "glow"], rows)
+
+
+def bench_kuwahara(args):
+    """
+    桑原フィルタの半径ごとの処理時間を計測する（累積和を使うため半径によらずほぼ一定になる）
+    """
+    from PIL import Image
+    from image_kuwahara import kuwahara
+
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    img = Image.open(io.BytesIO(load_sample_image(args.image, size=(width, width * 3 // 4))))
+    img.load()
+    megapixels = img.width * img.height / 1_000_000
+
+    rows = []
+    for radius in (int(r) for r in args.radii.split(",") if r):
+        for sharpness in (0.0, args.sharpness):
+            samples = []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                kuwahara(img, radius, sharpness)
+                samples.append(time.perf_counter() - started_at)
+            elapsed = statistics.median(samples)
+            rows.append([radius, sharpness, f"{elapsed:.3f}s", f"{megapixels / elapsed:.1f} MP/s"])
+
+    print(f"{img.width}x{img.height} ({megapixels:.1f} MP), repeat={args.repeat}")
+    print_table(["radius", "sharpness", "time", "throughput"], rows)
+
+
+def bench_animation(args):
+    """
+    アニメーションの変換について、フレームを逐次処理する方式と全フレームを展開する方式の
+    処理時間とピークメモリ（最大RSSの増加量）を比較する
+
+    最大RSSはプロセス内で単調に増えるため、--mode で方式を1つずつ指定して別々に実行すると正確に比較できます。
+    """
+    import tempfile
+    import numpy as np
+    from PIL import Image, ImageSequence
+    from image_animation import render_animation_to_file
+    from image_styles import get_style_registry
+
+    recipe = get_style_registry().get(args.style)
+    width, height = (int(v) for v in args.size.split("x"))
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        # 横に流れるグラデーションの合成アニメーション
+        x = np.arange(width)[np.newaxis, :]
+        y = np.arange(height)[:, np.newaxis]
+        frames = [
+            Image.fromarray(np.stack([
+                (x + 8 * i) % 256 + 0 * y,
+                (y + 4 * i) % 256 + 0 * x,
+                np.full((height, width), (16 * i) % 256),
+            ], axis=-1).astype(np.uint8))
+            for i in range(args.frames)
+        ]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=80, loop=0)
+        data = buffer.getvalue()
+        del frames
+
+    def streaming(output_base):
+        return render_animation_to_file(data, recipe.ops, output_base)
+
+    def naive(output_base):
+        # 全フレームをデコード・変換してからまとめて保存する
+        with Image.open(io.BytesIO(data)) as source:
+            frames = [recipe.apply(frame.convert("RGB")) for frame in ImageSequence.Iterator(source)]
+        frames[0].save(output_base + ".gif", save_all=True, append_images=frames[1:], duration=80, loop=0)
+        return output_base + ".gif"
+
+    modes = {"streaming": streaming, "naive": naive}
+    selected = list(modes) if args.mode == "both" else [args.mode]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in selected:
+            before = peak_rss_mb()
+            started_at = time.perf_counter()
+            path = modes[mode](os.path.join(directory, mode))
+            elapsed = time.perf_counter() - started_at
+            rows.append([mode, f"{elapsed:.2f}s", f"+{peak_rss_mb() - before:.0f} MB", f"{os.path.getsize(path) / 1024:.0f} KB"])
+
+    with Image.open(io.BytesIO(data)) as source:
+        print(f"{args.style}, {source.width}x{source.height}, {source.n_frames} frames")
+    print_table(["mode", "time", "peak rss", "size"], rows)
+
+
+def _run_backend_style(backend_name, style, image_data, repeat):
+    """
+    1つのバックエンドとスタイルの組み合わせで、デコード・変換・表示用の縮小・エンコードを実行する
+
+    ピークメモリを組み合わせごとに計測するため、新しい子プロセスで実行します。
+
+    Returns:
+        tuple: (処理時間の中央値, 最大RSSの増加量（MB）, エンコード後のサイズ, 変換結果, 表示用の縮小画像)
+    """
+    from image_backend import create_backend, fit_size
+    from image_decode import DISPLAY_MAX_SIZE
+    from image_encoder import DEFAULT_ENCODER_SETTINGS, save_options
+    from image_styles import get_style_registry
+
+    backend = create_backend(backend_name)
+    recipe = get_style_registry().get(style)
+    options = save_options("jpeg", DEFAULT_ENCODER_SETTINGS)
+    baseline = peak_rss_mb()
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = recipe.apply(backend.decode(image_data))
+        preview = backend.resize(result, fit_size(result.size, DISPLAY_MAX_SIZE))
+        encoded = backend.encode(result, "JPEG", options)
+        samples.append(time.perf_counter() - started_at)
+    peak_mb = peak_rss_mb() - baseline
+    return statistics.median(samples), peak_mb, len(encoded), result, preview
+
+
+def bench_backends(args):
+    """
+    スタイルごとに画像処理バックエンドのスループット・ピークメモリ・出力の一致を比較する
+
+    各バックエンドでデコード・変換・表示用の縮小・エンコード（JPEG）を実行し、
+    変換結果と縮小画像をそれぞれPillowバックエンドの出力とPSNRで比較します。
+    PSNRが下限を下回るスタイルがあれば終了コード1で終了します。
+    """
+    import math
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy as np
+    from image_backend import available_backends
+    from image_styles import get_style_registry
+
+    def psnr(expected, actual):
+        if expected.size != actual.size or expected.mode != actual.mode:
+            return -1.0
+        diff = np.asarray(expected, dtype=np.float32) - np.asarray(actual, dtype=np.float32)
+        mse = float(np.mean(diff * diff))
+        return math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+    width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    image_data = load_sample_image(args.image, size=(width, width * 3 // 4))
+    installed = available_backends()
+    requested = [b for b in args.backends.split(",") if b] or installed
+    backends = ["pil"] + [b for b in requested if b != "pil" and b in installed]
+    skipped = [b for b in requested if b not in installed]
+    styles = [s for s in args.styles.split(",") if s] or get_style_registry().style_names()
+
+    rows = []
+    failures = []
+    # 計測ごとに新しいプロセスを使い、最大RSSが前の計測の影響を受けないようにする
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as executor:
+        for style in styles:
+            outputs = {
+                backend: executor.submit(_run_backend_style, backend, style, image_data, args.repeat).result()
+                for backend in backends
+            }
+            elapsed, peak_mb, size, expected, expected_preview = outputs["pil"]
+            row = [style, f"{elapsed:.3f}s", f"+{peak_mb:.0f} MB", f"{size / 1024:.0f} KB"]
+            for backend in backends[1:]:
+                elapsed_b, peak_b, size_b, result, preview = outputs[backend]
+                quality = psnr(expected, result)
+                preview_quality = psnr(expected_preview, preview)
+                if quality < args.min_psnr or preview_quality < args.min_preview_psnr:
+                    failures.append(f"{style}({backend})")
+                row += [
+                    f"{elapsed_b:.3f}s", f"x{elapsed / elapsed_b:.2f}", f"+{peak_b:.0f} MB",
+                    f"{quality:.1f} dB", f"{preview_quality:.1f} dB"
+                ]
+            rows.append(row)
+
+    headers = ["style", "pil", "pil rss", "pil size"]
+    for backend in backends[1:]:
+        headers += [backend, "speedup", "rss", "psnr", "preview psnr"]
+    print(f"{width}x{width * 3 // 4}, repeat={args.repeat}, backends={','.join(backends)}")
+    if skipped:
+        print(f"インストールされていないバックエンド: {', '.join(skipped)}")
+    print_table(headers, rows)
+    if failures:
+        print(f"出力が一致しないスタイル: {', '.join(failures)}")
+        raise SystemExit(1)
+
+
+# 別の質問として扱うべき、文字列が似た質問の組
+SEMANTIC_CACHE_NEAR_MISSES = [
+    ("Pythonでリストを昇順に並べ替える方法は？", "Pythonでリストを降順に並べ替える方法は？"),
+    ("What is the capital of Australia?", "What is the capital of Austria?"),
+    ("2024年の日本の人口は？", "2023年の日本の人口は？"),
+    ("水彩画風の特徴を教えて", "油絵風の特徴を教えて"),
+    ("この関数は例外を投げますか？", "この関数は例外を投げませんか？"),
+    ("Is this setting safe?", "Is this setting not safe?"),
+]
+
+# 同じ質問として扱うべき、表記だけが異なる質問の組
+SEMANTIC_CACHE_PARAPHRASES = [
+    ("Pythonでリストを昇順に並べ替える方法は？", "pythonで リストを 昇順に並べ替える方法は?"),
+    ("What is the capital of Australia?", "what is the capital of australia"),
+    ("ＡＩとは何ですか", "AIとは何ですか？"),
+]
+
+
+def bench_semantic_cache(args):
+    """
+    類似質問キャッシュが、似ているが異なる質問を取り違えないことを確認する
+
+    別の質問の組がヒットした場合、または表記ゆれだけの組がヒットしなかった場合は終了コード1で終了します。
+    """
+    from semantic_cache import SemanticCache
+
+    cache = SemanticCache(threshold=args.threshold) if args.threshold else SemanticCache()
+    rows = []
+    failures = []
+    for expected_hit, pairs in ((False, SEMANTIC_CACHE_NEAR_MISSES), (True, SEMANTIC_CACHE_PARAPHRASES)):
+        for stored, query in pairs:
+            cache.clear()
+            cache.put(stored, "answer")
+            similarity = float(cache.embed(stored) @ cache.embed(query))
+            hit = cache.get(query) is not None
+            if hit != expected_hit:
+                failures.append(f"{stored} / {query}")
+            rows.append([stored, query, f"{similarity:.3f}", "hit" if hit else "miss", "hit" if expected_hit else "miss"])
+
+    print(f"threshold={cache.threshold}")
+    print_table(["stored", "query", "similarity", "result", "expected"], rows)
+    if failures:
+        print(f"判定が誤っている質問: {', '.join(failures)}")
+        raise SystemExit(1)
+
+
+def main():
+    """ベンチマークのエントリーポイント"""
+    parser = argparse.ArgumentParser(description="Gemini AI イメージ変換アプリのベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generation = subparsers.add_parser("generation", help="生成プロファイル別のAPIレイテンシを計測")
+    generation.add_argument("--style", default="水彩画風")
+    generation.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    generation.add_argument("--repeat", type=int, default=3)
+    generation.set_defaults(func=bench_generation)
+
+    kernels = subparsers.add_parser("kernels", help="PILと他の画像処理エンジンを比較")
+    kernels.add_argument("--megapixels", type=float, default=12.0)
+    kernels.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    kernels.add_argument("--repeat", type=int, default=3)
+    kernels.add_argument("--engines", default="lut,numpy", help="PILと比較するエンジン（カンマ区切り）")
+    kernels.add_argument("--tolerance", type=int, default=0, help="許容する画素値の最大差")
+    kernels.set_defaults(func=bench_kernels)
+
+    pool = subparsers.add_parser("pool", help="同時セッション数に対する画像処理プールのスループットと待ち時間を計測")
+    pool.add_argument("--style", default="油絵風")
+    pool.add_argument("--megapixels", type=float, default=4.0)
+    pool.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    pool.add_argument("--sessions", type=int, default=8, help="同時に変換を投入するセッション数")
+    pool.add_argument("--repeat", type=int, default=3, help="セッションごとの変換回数")
+    pool.add_argument("--workers", default="", help="追加で計測するワーカー数（カンマ区切り）")
+    pool.set_defaults(func=bench_pool)
+
+    cartoon = subparsers.add_parser("cartoon", help="アニメ風スタイルの減色・輪郭線処理の処理時間を計測")
+    cartoon.add_argument("--style", default="アニメ風")
+    cartoon.add_argument("--megapixels", type=float, default=12.0)
+    cartoon.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    cartoon.add_argument("--repeat", type=int, default=3)
+    cartoon.set_defaults(func=bench_cartoon)
+
+    blur = subparsers.add_parser("blur", help="半径ごとのぼかしとグローの処理時間を計測")
+    blur.add_argument("--megapixels", type=float, default=12.0)
+    blur.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    blur.add_argument("--repeat", type=int, default=3)
+    blur.add_argument("--radii", default="1,4,8,16,32,64,128", help="計測するぼかしの半径（カンマ区切り）")
+    blur.set_defaults(func=bench_blur)
+
+    kuwahara = subparsers.add_parser("kuwahara", help="桑原フィルタの半径ごとの処理時間を計測")
+    kuwahara.add_argument("--megapixels", type=float, default=12.0)
+    kuwahara.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    kuwahara.add_argument("--repeat", type=int, default=3)
+    kuwahara.add_argument("--radii", default="2,4,8,16", help="計測する領域の半径（カンマ区切り）")
+    kuwahara.add_argument("--sharpness", type=float, default=8.0, help="重み付けの鋭さ（0の場合と比較）")
+    kuwahara.set_defaults(func=bench_kuwahara)
+
+    animation = subparsers.add_parser("animation", help="アニメーションの逐次変換の処理時間とピークメモリを計測")
+    animation.add_argument("--style", default="油絵風")
+    animation.add_argument("--image", default=None, help="計測に使用するアニメーション画像ファイル")
+    animation.add_argument("--size", default="960x540", help="合成アニメーションのサイズ（幅x高さ）")
+    animation.add_argument("--frames", type=int, default=60, help="合成アニメーションのフレーム数")
+    animation.add_argument("--mode", choices=["both", "streaming", "naive"], default="both")
+    animation.set_defaults(func=bench_animation)
+
+    backends = subparsers.add_parser("backends", help="画像処理バックエンドごとのスループット・ピークメモリ・出力の一致を比較")
+    backends.add_argument("--megapixels", type=float, default=12.0)
+    backends.add_argument("--image", default=None, help="計測に使用する画像ファイル")
+    backends.add_argument("--repeat", type=int, default=3)
+    backends.add_argument("--backends", default="", help="比較するバックエンド（カンマ区切り。省略時はインストール済みのすべて）")
+    backends.add_argument("--styles", default="", help="計測するスタイル（カンマ区切り。省略時はすべて）")
+    backends.add_argument("--min-psnr", type=float, default=40.0, help="Pillowバックエンドの変換結果に対するPSNRの下限（dB）")
+    backends.add_argument(
+        "--min-preview-psnr", type=float, default=30.0,
+        help="表示用の縮小画像のPSNRの下限（dB。縮小の補間方法がバックエンドごとに異なるため低めにする）"
+    )
+    backends.set_defaults(func=bench_backends)
+
+    semantic_cache = subparsers.add_parser("semantic-cache", help="類似質問キャッシュが似ているが異なる質問を取り違えないか確認")
+    semantic_cache.add_argument("--threshold", type=float, default=None, help="コサイン類似度の閾値（省略時は既定値）")
+    semantic_cache.set_defaults(func=bench_semantic_cache)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
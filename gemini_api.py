@@ -10,9 +10,14 @@ from PIL import Image
 from io import BytesIO
 import re
 import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple, Union
 import pathlib
 
+from image_backend import get_image_backend
+from image_decode import sniff_mime_type
+from image_styles import get_style_registry
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
@@ -36,6 +41,275 @@ else:
 # Gemini APIの設定
 genai.configure(api_key=api_key)
 
+# リクエストの種類
+REQUEST_CLASS_CHAT = "chat"
+REQUEST_CLASS_IMAGE_DESCRIPTION = "image_description"
+
+# リクエストの種類ごとのモデル候補（先頭が第一候補、以降がフォールバック）
+DEFAULT_MODEL_ROUTES = {
+    REQUEST_CLASS_CHAT: ["gemini-2.0-flash-exp", "gemini-2.0-flash-lite"],
+    REQUEST_CLASS_IMAGE_DESCRIPTION: ["gemini-2.0-flash-exp", "gemini-2.0-flash", "gemini-1.5-flash"],
+}
+
+# リクエストの種類ごとの許容レイテンシ（秒）。これを超えたモデルは過負荷とみなす
+DEFAULT_LATENCY_SLO = {
+    REQUEST_CLASS_CHAT: 8.0,
+    REQUEST_CLASS_IMAGE_DESCRIPTION: 20.0,
+}
+
+# 過負荷を示すエラーの識別子
+OVERLOAD_ERROR_MARKERS = ["RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED"]
+
+class ModelRouter:
+    """
+    リクエストの種類ごとに使用するGeminiモデルを選択するクラス
+    
+    モデルごとのレイテンシとエラー率を指数移動平均で記録し、
+    第一候補のモデルが過負荷の場合はフォールバックモデルを選択します。
+    過負荷とみなしたモデルにはリクエストが送られず統計が更新されないため、
+    エラー率は時間とともに減衰させ、一定時間ごとに1件だけ試しのリクエストを送って
+    （ハーフオープン）回復したかどうかを確かめます。
+    
+    Attributes:
+        routes (dict): リクエストの種類ごとのモデル候補リスト
+        latency_slo (dict): リクエストの種類ごとの許容レイテンシ（秒）
+        error_threshold (float): 過負荷とみなすエラー率の閾値
+        cooldown (float): 過負荷エラー後にモデルを避ける時間（秒）
+        decay_half_life (float): エラー率が半分に減衰するまでの時間（秒）
+        probe_interval (float): 過負荷とみなしたモデルに試しのリクエストを送る間隔（秒）
+    """
+    
+    def __init__(self, routes=None, latency_slo=None, error_threshold=0.5, cooldown=30.0, alpha=0.3,
+                 decay_half_life=60.0, probe_interval=30.0):
+        """
+        ModelRouterクラスの初期化
+        
+        Args:
+            routes (dict, optional): リクエストの種類ごとのモデル候補リスト
+            latency_slo (dict, optional): リクエストの種類ごとの許容レイテンシ（秒）
+            error_threshold (float): 過負荷とみなすエラー率の閾値
+            cooldown (float): 過負荷エラー後にモデルを避ける時間（秒）
+            alpha (float): 指数移動平均の平滑化係数
+            decay_half_life (float): エラー率が半分に減衰するまでの時間（秒）
+            probe_interval (float): 過負荷とみなしたモデルに試しのリクエストを送る間隔（秒）
+        """
+        self.routes = routes or DEFAULT_MODEL_ROUTES
+        self.latency_slo = latency_slo or DEFAULT_LATENCY_SLO
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.decay_half_life = decay_half_life
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    def _model_stats(self, model_name):
+        """モデルの統計エントリを取得（存在しなければ作成）する"""
+        return self._stats.setdefault(model_name, {
+            "latency": None,
+            "error_rate": 0.0,
+            "requests": 0,
+            "overloaded_until": 0.0,
+            "updated_at": time.time(),
+            "last_attempt": 0.0,
+        })
+    
+    def _decay(self, stats, now):
+        """最後の更新からの経過時間に応じてエラー率を減衰させる（ロック取得済みの状態で呼び出す）"""
+        elapsed = now - stats["updated_at"]
+        if elapsed > 0:
+            stats["error_rate"] *= 0.5 ** (elapsed / self.decay_half_life)
+            stats["updated_at"] = now
+    
+    def _is_overloaded(self, stats, request_class, now):
+        """統計から過負荷かどうかを判定する（ロック取得済みの状態で呼び出す）"""
+        if now < stats["overloaded_until"]:
+            return True
+        self._decay(stats, now)
+        if stats["error_rate"] > self.error_threshold:
+            return True
+        slo = self.latency_slo.get(request_class)
+        return bool(slo and stats["latency"] is not None and stats["latency"] > slo)
+    
+    def candidates(self, request_class, primary=None):
+        """
+        リクエストの種類に対するモデル候補を返す
+        
+        Args:
+            request_class (str): リクエストの種類
+            primary (str, optional): 第一候補として優先するモデル名
+            
+        Returns:
+            list: モデル名のリスト（優先順）
+        """
+        models = list(self.routes.get(request_class, self.routes[REQUEST_CLASS_CHAT]))
+        if primary:
+            models = [primary] + [m for m in models if m != primary]
+        return models
+    
+    def is_overloaded(self, model_name, request_class):
+        """
+        モデルが過負荷状態かどうかを判定する
+        
+        Args:
+            model_name (str): モデル名
+            request_class (str): リクエストの種類
+            
+        Returns:
+            bool: 過負荷とみなす場合はTrue
+        """
+        with self._lock:
+            return self._is_overloaded(self._model_stats(model_name), request_class, time.time())
+    
+    def select(self, request_class, primary=None, exclude=None):
+        """
+        リクエストに使用するモデルを選択する
+        
+        候補を優先順に調べ、過負荷でない最初のモデルを返します。
+        過負荷とみなしたモデルでも、クールダウン中でなく probe_interval 秒以上
+        リクエストを送っていなければ、回復を確かめるために選択します。
+        すべての候補が過負荷の場合は、最も早く回復する見込みのモデルを返します。
+        
+        Args:
+            request_class (str): リクエストの種類
+            primary (str, optional): 第一候補として優先するモデル名
+            exclude (iterable, optional): 選択から除外するモデル名
+            
+        Returns:
+            str: 選択されたモデル名（候補がない場合はNone）
+        """
+        exclude = set(exclude or [])
+        models = [m for m in self.candidates(request_class, primary) if m not in exclude]
+        if not models:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            for model_name in models:
+                stats = self._model_stats(model_name)
+                if not self._is_overloaded(stats, request_class, now):
+                    return model_name
+                if now >= stats["overloaded_until"] and now - stats["last_attempt"] >= self.probe_interval:
+                    # 試しのリクエストは probe_interval ごとに1件だけ送る
+                    stats["last_attempt"] = now
+                    logger.info(f"{model_name} の回復を確かめるため試しにリクエストを送ります（{request_class}）")
+                    return model_name
+            return min(models, key=lambda m: self._model_stats(m)["overloaded_until"])
+    
+    def record_success(self, model_name, latency):
+        """
+        成功したリクエストのレイテンシを記録する
+        
+        Args:
+            model_name (str): モデル名
+            latency (float): レイテンシ（秒）
+        """
+        with self._lock:
+            now = time.time()
+            stats = self._model_stats(model_name)
+            self._decay(stats, now)
+            stats["requests"] += 1
+            stats["last_attempt"] = now
+            if stats["latency"] is None:
+                stats["latency"] = latency
+            else:
+                stats["latency"] = self.alpha * latency + (1 - self.alpha) * stats["latency"]
+            stats["error_rate"] = (1 - self.alpha) * stats["error_rate"]
+    
+    def record_failure(self, model_name, overloaded=False):
+        """
+        失敗したリクエストを記録する
+        
+        Args:
+            model_name (str): モデル名
+            overloaded (bool): 過負荷によるエラーかどうか
+        """
+        with self._lock:
+            now = time.time()
+            stats = self._model_stats(model_name)
+            self._decay(stats, now)
+            stats["requests"] += 1
+            stats["last_attempt"] = now
+            stats["error_rate"] = self.alpha + (1 - self.alpha) * stats["error_rate"]
+            if overloaded:
+                stats["overloaded_until"] = now + self.cooldown
+
+class GeneratedText(str):
+    """
+    生成したテキスト（応答したモデルの名前を持つ文字列）
+    
+    同じGeminiAPIインスタンスを複数のスレッドから呼び出しても取り違えないよう、
+    応答したモデルの名前はインスタンスではなく応答ごとに持たせます。
+    
+    Attributes:
+        model_name (str): 応答を生成したモデルの名前
+    """
+    
+    def __new__(cls, text, model_name=None):
+        obj = super().__new__(cls, text)
+        obj.model_name = model_name
+        return obj
+
+# 全セッションで共有するモデルルーター
+default_router = ModelRouter()
+
+# 生成プロファイル名
+PROFILE_CHAT = "chat"
+PROFILE_TRANSFORM_DESCRIPTION = "transform_description"
+PROFILE_VALIDATION_RETRY = "validation_retry"
+PROFILE_KEY_CHECK = "key_check"
+
+# モード別の生成設定。出力トークン数が生成レイテンシの大部分を占めるため、
+# 用途ごとに必要十分な上限を設定する
+GENERATION_PROFILES = {
+    PROFILE_CHAT: {
+        "temperature": 0.9,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 1024,
+    },
+    PROFILE_TRANSFORM_DESCRIPTION: {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 512,
+        "stop_sequences": ["\n\n---\n\n"],
+    },
+    PROFILE_VALIDATION_RETRY: {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 40,
+        # 「3段落・200文字以上」を要求するため説明用より少し余裕を持たせる
+        "max_output_tokens": 768,
+        "stop_sequences": ["\n\n---\n\n"],
+    },
+    PROFILE_KEY_CHECK: {
+        "temperature": 0.0,
+        "max_output_tokens": 16,
+    },
+}
+
+def get_generation_config(profile=PROFILE_CHAT, style=None, profiles=None, style_overrides=None):
+    """
+    生成プロファイルとスタイルから生成設定を組み立てる
+    
+    Args:
+        profile (str): 生成プロファイル名
+        style (str, optional): 変換スタイル
+        profiles (dict, optional): 生成プロファイルの定義（省略時はGENERATION_PROFILES）
+        style_overrides (dict, optional): スタイル別の上書き設定（省略時は上書きなし）
+        
+    Returns:
+        dict: generate_contentに渡す生成設定
+    """
+    profiles = profiles or GENERATION_PROFILES
+    style_overrides = style_overrides or {}
+    
+    config = dict(profiles.get(profile, profiles[PROFILE_CHAT]))
+    if style:
+        config.update(style_overrides.get(style, {}).get(profile, {}))
+    return config
+
 class GeminiAPI:
     """
     Gemini APIを利用するためのクラス
@@ -44,17 +318,25 @@ class GeminiAPI:
     画像と文章を含むマルチモーダルなプロンプトを処理できます。
     
     Attributes:
-        model_name (str): 使用するGeminiモデルの名前
+        model_name (str): 第一候補として使用するGeminiモデルの名前
         generation_config (dict): レスポンス生成の設定
         safety_settings (dict): コンテンツ安全性のフィルタリング設定
+        router (ModelRouter): リクエストごとにモデルを選択するルーター
+        generation_profiles (dict): モード別の生成設定
+        style_overrides (dict): スタイル・プロファイル別の上書き設定
     """
     
-    def __init__(self, model_name: str = "gemini-2.0-flash-exp"):
+    def __init__(self, model_name: str = "gemini-2.0-flash-exp", router: Optional[ModelRouter] = None,
+                 generation_profiles: Optional[Dict[str, Dict[str, Any]]] = None,
+                 style_overrides: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None):
         """
         GeminiAPIクラスの初期化
         
         Args:
-            model_name (str): 使用するGeminiモデルの名前（デフォルト: "gemini-2.0-flash-exp"）
+            model_name (str): 第一候補として使用するGeminiモデルの名前（デフォルト: "gemini-2.0-flash-exp"）
+            router (ModelRouter, optional): モデルルーター（省略時は全セッション共有のルーター）
+            generation_profiles (dict, optional): 既定の生成プロファイルを上書きする設定
+            style_overrides (dict, optional): スタイル・プロファイル別の上書き設定（省略時はスタイル定義の "generation"）
         """
         # APIキーを環境変数から取得
         self.api_key = os.getenv("GEMINI_API_KEY", "")
@@ -77,15 +359,15 @@ class GeminiAPI:
         genai.configure(api_key=self.api_key)
         
         # モデル設定
-        self.model_name = "gemini-2.0-flash-exp"  # モデル名を固定
+        self.model_name = model_name
+        self.router = router or default_router
+        self._models = {}
         
         # 生成設定
-        self.generation_config = {
-            "temperature": 0.9,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192,
-        }
+        self.generation_profiles = {**GENERATION_PROFILES, **(generation_profiles or {})}
+        # スタイル別の上書き設定はスタイル定義（style_recipes.json）だけで管理する
+        self.style_overrides = style_overrides if style_overrides is not None else get_style_registry().generation_overrides()
+        self.generation_config = get_generation_config(PROFILE_CHAT, profiles=self.generation_profiles)
         
         # 安全性設定
         self.safety_settings = {
@@ -102,11 +384,7 @@ class GeminiAPI:
         
         for attempt in range(max_retries):
             try:
-                self.model = genai.GenerativeModel(
-                    model_name=self.model_name,
-                    generation_config=self.generation_config,
-                    safety_settings=self.safety_settings
-                )
+                self.model = self._get_model(self.model_name)
                 break
             except Exception as e:
                 logger.error(f"モデル初期化エラー（試行 {attempt+1}/{max_retries}）: {str(e)}")
@@ -116,19 +394,45 @@ class GeminiAPI:
                 else:
                     logger.error(f"Geminiモデルの初期化に失敗しました: {str(e)}")
                     print(f"⚠️ Geminiモデルの初期化に失敗しました: {str(e)}")
+    
+    def _get_model(self, model_name):
+        """
+        モデル名に対応するGenerativeModelを返す（生成済みのものは再利用）
         
-    def generate_content(self, prompt, response_modalities=None, image_data=None, mime_type=None):
+        Args:
+            model_name (str): モデル名
+            
+        Returns:
+            genai.GenerativeModel: モデルインスタンス
+        """
+        if model_name not in self._models:
+            self._models[model_name] = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings
+            )
+        return self._models[model_name]
+        
+    def generate_content(self, prompt, response_modalities=None, image_data=None, mime_type=None, request_class=None,
+                         profile=PROFILE_CHAT, style=None):
         """
         Gemini APIを使用してコンテンツを生成する
         
+        リクエストの種類に応じてモデルルーターがモデルを選択し、
+        過負荷エラーの場合はフォールバックモデルで再試行します。
+        応答を生成したモデルの名前は、返すテキストの model_name に設定されます。
+        
         Args:
             prompt (str): 生成のための入力テキスト
             response_modalities (list, optional): 応答のモダリティリスト
             image_data (bytes, optional): 画像データ（画像を含む場合）
             mime_type (str, optional): 画像のMIMEタイプ
+            request_class (str, optional): リクエストの種類（省略時は画像の有無から判定）
+            profile (str): 生成プロファイル名（出力トークン上限や停止シーケンスを決定）
+            style (str, optional): 変換スタイル（スタイル別の上書き設定に使用）
             
         Returns:
-            str: 生成されたテキスト
+            GeneratedText: 生成されたテキスト（model_name に応答したモデルの名前を持つ）
             
         Raises:
             Exception: API呼び出し中にエラーが発生した場合
@@ -145,19 +449,29 @@ class GeminiAPI:
             logger.error(error_msg)
             return {"error": error_msg}
         
-        generation_config = {
-            "temperature": 0.9,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192,
-        }
+        generation_config = get_generation_config(
+            profile, style, profiles=self.generation_profiles, style_overrides=self.style_overrides
+        )
+        
+        if request_class is None:
+            request_class = REQUEST_CLASS_IMAGE_DESCRIPTION if image_data else REQUEST_CLASS_CHAT
         
         retry_count = 0
         max_retries = 3
         retry_delay = 1  # 初期リトライ待機時間（秒）
+        failed_models = set()
         
         while retry_count < max_retries:
+            # ルーターでモデルを選択（過負荷で失敗したモデルは可能な限り避ける）
+            model_name = self.router.select(request_class, primary=self.model_name, exclude=failed_models)
+            if model_name is None:
+                failed_models.clear()
+                model_name = self.router.select(request_class, primary=self.model_name)
+            
             try:
+                model = self._get_model(model_name)
+                started_at = time.time()
+                
                 if image_data:
                     # MIMEタイプが指定されていなければ、推測を試みる
                     if not mime_type:
@@ -175,22 +489,37 @@ class GeminiAPI:
                         }
                     ]
                     
-                    response = self.model.generate_content(
+                    response = model.generate_content(
                         contents=multimodal_prompt,
                         generation_config=generation_config
                     )
                 else:
                     # テキストのみのプロンプト
-                    response = self.model.generate_content(
+                    response = model.generate_content(
                         contents=prompt,
                         generation_config=generation_config
                     )
                 
-                return response.text
+                text = response.text
+                self.router.record_success(model_name, time.time() - started_at)
+                if model_name != self.model_name:
+                    logger.info(f"フォールバックモデル {model_name} が応答しました（{request_class}）")
+                return GeneratedText(text, model_name)
                 
             except Exception as e:
                 error_str = str(e)
-                logger.error(f"Gemini API呼び出しエラー: {error_str}")
+                logger.error(f"Gemini API呼び出しエラー（{model_name}）: {error_str}")
+                
+                # 過負荷エラーの場合、未使用のフォールバックモデルがあれば待たずに再試行
+                overloaded = any(marker in error_str for marker in OVERLOAD_ERROR_MARKERS)
+                self.router.record_failure(model_name, overloaded=overloaded)
+                if overloaded:
+                    failed_models.add(model_name)
+                    fallback = self.router.select(request_class, primary=self.model_name, exclude=failed_models)
+                    if fallback is not None and retry_count + 1 < max_retries:
+                        retry_count += 1
+                        logger.info(f"{model_name} が過負荷のため {fallback} にフォールバックします（{retry_count}/{max_retries}）")
+                        continue
                 
                 # エラーの種類に基づいた処理
                 if "API_KEY_INVALID" in error_str:
@@ -240,6 +569,11 @@ class GeminiAPI:
         Returns:
             str: 検出されたMIMEタイプ、または検出できない場合はNone
         """
+        # 先頭バイトのシグネチャで判定できればPILで開かない
+        mime_type = sniff_mime_type(image_data)
+        if mime_type:
+            return mime_type
+        
         try:
             # PILを使用して画像フォーマットを検出
             image = Image.open(BytesIO(image_data))
@@ -302,7 +636,7 @@ class GeminiAPI:
             
         try:
             # 簡単なテストリクエストを送信
-            response = self.generate_content("こんにちは")
+            response = self.generate_content("こんにちは", profile=PROFILE_KEY_CHECK)
             return not isinstance(response, dict) or not response.get("error")
         except Exception as e:
             logger.error(f"APIキー検証エラー: {str(e)}")
@@ -323,16 +657,16 @@ class GeminiAPI:
     
     def base64_to_image(self, base64_data):
         """
-        Base64エンコードされたデータをPIL Imageに変換する
+        Base64エンコードされたデータを画像処理バックエンドでデコードし、PIL Imageに変換する
         
         Args:
             base64_data (str): Base64エンコードされた画像データ
         
         Returns:
-            PIL.Image: 画像オブジェクト
+            PIL.Image: 画像オブジェクト（EXIFの向きとモードを正規化済み）
         """
         image_data = base64.b64decode(base64_data)
-        return Image.open(BytesIO(image_data))
+        return get_image_backend().decode(image_data)
     
     def save_image(self, base64_data, output_path):
         """
@@ -0,0 +1,234 @@
+import io
+import os
+import json
+import math
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple
+
+from PIL import GifImagePlugin, Image
+
+from image_backend import normalize_image
+from image_encoder import extension_for
+from image_styles import compile_pipeline, scale_ops
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_animation")
+
+# パレットの作成に使う最大フレーム数（これより多い場合はアニメーション全体から等間隔に選ぶ）
+PALETTE_SAMPLE_FRAMES = 32
+
+# パレットの作成に使う縮小フレームの合計画素数（フレーム数が少ないほど各フレームを大きく縮小する）
+# （縮小しすぎると細部の鮮やかな色がパレットから漏れる）
+PALETTE_SAMPLE_PIXELS = 1024 * 1024
+
+# 透過に使うパレットの番号（残りの255色を画像の色に使う）
+TRANSPARENT_INDEX = 255
+
+# フレームの表示時間の既定値（ミリ秒）
+DEFAULT_FRAME_DURATION = 100
+
+# 並列に処理するフレーム数（ワーカー数に対する倍率。先読みするフレームの数を制限してメモリを抑える）
+FRAME_WINDOW_FACTOR = 2
+
+
+def is_animated(image_data) -> bool:
+    """
+    画像データが複数フレームのアニメーション（GIF・WebP・APNG）かどうかを判定する（ヘッダーのみ読み込む）
+
+    Args:
+        image_data (bytes): 画像データ
+
+    Returns:
+        bool: アニメーションの場合はTrue
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return bool(getattr(img, "is_animated", False))
+    except (OSError, ValueError):
+        return False
+
+
+def iter_frames(source) -> Iterator[Tuple[Image.Image, int]]:
+    """
+    アニメーションのフレームを1枚ずつデコードして返す（全フレームを同時にメモリに置かない）
+
+    Args:
+        source (PIL.Image): 開いたアニメーション画像
+
+    Yields:
+        PIL.Image: 正規化したフレーム（RGBまたはRGBA、合成済みの画面全体）
+        int: フレームの表示時間（ミリ秒）
+    """
+    for index in range(getattr(source, "n_frames", 1)):
+        source.seek(index)
+        frame = normalize_image(source)
+        if frame is source:
+            # 次のフレームをデコードすると書き換えられるため、独立した画像にする
+            frame = frame.copy()
+        yield frame, int(source.info.get("duration") or DEFAULT_FRAME_DURATION)
+
+
+@lru_cache(maxsize=16)
+def _frame_pipeline(ops_json):
+    """処理関数を一度だけ組み立ててフレーム間で再利用する（LUTの作成などを繰り返さない）"""
+    return compile_pipeline(json.loads(ops_json))
+
+
+def _palette_image(palette, transparent):
+    """パレットの色だけを持つPモードの画像を作る（quantizeの対応先とGIFの色表に使う）"""
+    entries = list(palette[:TRANSPARENT_INDEX * 3 if transparent else 256 * 3])
+    # 余った枠は先頭の色で埋める（同じ距離の色は番号の小さい方が選ばれるため、透過の番号は使われない）
+    entries += entries[:3] * (256 - len(entries) // 3)
+    image = Image.new("P", (1, 1))
+    image.putpalette(entries)
+    return image
+
+
+def build_animation_palette(source, ops, transparent) -> Image.Image:
+    """
+    アニメーション全体で共有するパレットを作成する
+
+    フレームの縮小画像にスタイルを適用して並べ、まとめて減色します。
+    フレーム数が PALETTE_SAMPLE_FRAMES 以下の場合は全フレームを、それより多い場合は等間隔に選んだフレームを使い、
+    縮小画像の合計画素数が PALETTE_SAMPLE_PIXELS 程度になるよう縮小サイズを決めます。
+    全フレームで同じパレットを使うため、フレームごとの減色が不要になり、色のちらつきも起きません。
+
+    Args:
+        source (PIL.Image): 開いたアニメーション画像
+        ops (list): オペレーション定義のリスト
+        transparent (bool): 透過用の番号を確保するかどうか
+
+    Returns:
+        PIL.Image: パレットを持つPモードの画像
+    """
+    frame_count = getattr(source, "n_frames", 1)
+    sample_count = min(frame_count, PALETTE_SAMPLE_FRAMES)
+    samples = sorted({index * frame_count // sample_count for index in range(sample_count)})
+    sample_size = max(1, math.isqrt(PALETTE_SAMPLE_PIXELS * max(source.size) // (sample_count * min(source.size))))
+    scale = min(1.0, sample_size / max(source.size))
+    steps = compile_pipeline(scale_ops(ops, scale))
+
+    thumbnails = []
+    for index in samples:
+        source.seek(index)
+        thumbnail = normalize_image(source).convert("RGB")
+        thumbnail.thumbnail((sample_size, sample_size))
+        for step in steps:
+            thumbnail = step(thumbnail)
+        thumbnails.append(thumbnail.convert("RGB"))
+
+    montage = Image.new("RGB", (sum(t.width for t in thumbnails), max(t.height for t in thumbnails)))
+    x = 0
+    for thumbnail in thumbnails:
+        montage.paste(thumbnail, (x, 0))
+        x += thumbnail.width
+    colors = TRANSPARENT_INDEX if transparent else 256
+    quantized = montage.quantize(colors, method=Image.Quantize.MEDIANCUT)
+    return _palette_image(quantized.getpalette(), transparent)
+
+
+def render_frame(frame, ops_json, palette_data, transparent) -> Image.Image:
+    """
+    1フレームにスタイルを適用し、共有パレットで減色する（並列処理のワーカーでも実行）
+
+    共有パレットはフレームごとの最適なパレットより色数が少ないため、
+    Floyd–Steinberg法で誤差を拡散して色の段差を目立たなくします。
+
+    Args:
+        frame (PIL.Image): 正規化したフレーム
+        ops_json (str): オペレーション定義のリスト（JSON）
+        palette_data (list): 共有パレット（768要素）
+        transparent (bool): 半透明より透明な画素を透過の番号にするかどうか
+
+    Returns:
+        PIL.Image: 減色したPモードのフレーム
+    """
+    img = frame
+    for step in _frame_pipeline(ops_json):
+        img = step(img)
+    alpha = img.getchannel("A") if img.mode == "RGBA" else (frame.getchannel("A") if frame.mode == "RGBA" else None)
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(palette_data)
+    result = img.convert("RGB").quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+    if transparent and alpha is not None:
+        result.paste(TRANSPARENT_INDEX, mask=alpha.point([255 if value < 128 else 0 for value in range(256)]))
+    return result
+
+
+def _ordered_results(frames, submit, window):
+    """フレームを先読み数 window まで投入し、完了したものから元の順番で返す"""
+    pending = deque()
+    for frame, duration in frames:
+        pending.append((submit(frame), duration))
+        if len(pending) >= window:
+            future, duration = pending.popleft()
+            yield future.result(), duration
+    while pending:
+        future, duration = pending.popleft()
+        yield future.result(), duration
+
+
+def render_animation_to_file(image_data, ops, output_base, executor=None, workers=1) -> Optional[str]:
+    """
+    アニメーションの各フレームにスタイルを適用し、アニメーションGIFとして保存する
+
+    フレームは1枚ずつデコード・変換・減色・エンコードしてファイルに書き込むため、
+    メモリ上に置くフレームは先読み分だけです（フレーム数によらず一定）。
+    処理関数とパレットは最初に一度だけ作成し、全フレームで再利用します。
+
+    Args:
+        image_data (bytes): 画像データ
+        ops (list): オペレーション定義のリスト
+        output_base (str): 保存先のパス（拡張子なし）
+        executor (Executor, optional): フレームを並列に処理するExecutor（省略時は逐次処理）
+        workers (int): Executorのワーカー数（先読みするフレーム数の目安）
+
+    Returns:
+        str: 保存先のパス（アニメーションでない場合はNone）
+    """
+    ops_json = json.dumps(ops)
+    with Image.open(io.BytesIO(image_data)) as source:
+        if not getattr(source, "is_animated", False):
+            return None
+        loop = source.info.get("loop", 0)
+        transparent = normalize_image(source).mode == "RGBA"
+        palette = build_animation_palette(source, ops, transparent)
+        palette_data = palette.getpalette()
+
+    # APNGなどは先頭に戻るシークに対応しないため、開き直して先頭から順にデコードする
+    with Image.open(io.BytesIO(image_data)) as source:
+        if executor is None:
+            results = (
+                (render_frame(frame, ops_json, palette_data, transparent), duration)
+                for frame, duration in iter_frames(source)
+            )
+        else:
+            results = _ordered_results(
+                iter_frames(source),
+                lambda frame: executor.submit(render_frame, frame, ops_json, palette_data, transparent),
+                max(2, workers * FRAME_WINDOW_FACTOR)
+            )
+
+        output_path = output_base + extension_for("gif")
+        # 書き込み途中のファイルを読まれないよう一時ファイルに保存してから置き換える
+        temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        frame_count = 0
+        with open(temp_path, "wb") as f:
+            header, _ = GifImagePlugin.getheader(palette.resize(source.size), info={"loop": loop})
+            f.write(b"".join(header))
+            for frame, duration in results:
+                params = {"duration": duration}
+                if transparent:
+                    # 透過した部分に前のフレームが残らないよう、表示後に背景に戻す
+                    params.update(transparency=TRANSPARENT_INDEX, disposal=2)
+                f.write(b"".join(GifImagePlugin.getdata(frame, **params)))
+                frame_count += 1
+            f.write(b";")
+        os.replace(temp_path, output_path)
+
+    logger.info(f"アニメーションを変換しました: {source.size[0]}x{source.size[1]}（{frame_count}フレーム）")
+    return output_path
@@ -0,0 +1,563 @@
+import io
+import os
+import math
+import mmap
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import ExifTags, Image, ImageFile, ImageMode, ImageOps
+
+# OpenCVとlibvipsは任意の依存関係（インストールされている場合のみ対応するバックエンドを使用）
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # pyvipsはlibvips本体が見つからない場合にOSErrorを送出する
+    pyvips = None
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_backend")
+# libvipsは読み込みのたびにINFOを記録するため、警告以上のみ表示する
+logging.getLogger("pyvips").setLevel(logging.WARNING)
+
+# 使用する画像処理バックエンド（"auto" の場合はインストール済みのものから優先順に選ぶ）
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "auto")
+
+# 自動選択の優先順位（libvipsは逐次処理でメモリが少なく、OpenCVはJPEGの縮小デコードと縮小が速い）
+BACKEND_PREFERENCE = ("vips", "opencv", "pil")
+
+# 逐次デコードで一度に読み込む行数
+SEQUENTIAL_BLOCK_ROWS = 256
+
+# 画像処理バックエンドのクラス（バックエンド名 -> クラス）
+BACKENDS: Dict[str, type] = {}
+
+
+def register_backend(name):
+    """
+    画像処理バックエンドを登録するデコレーター
+
+    Args:
+        name (str): バックエンド名（環境変数 IMAGE_BACKEND で指定する名前）
+
+    Returns:
+        callable: デコレーター
+    """
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def normalize_image(img):
+    """
+    EXIFの向きを反映し、画像モードをパイプラインで扱う形式に揃える
+
+    Args:
+        img (PIL.Image): デコードした画像
+
+    Returns:
+        PIL.Image: 正規化した画像（RGB、L、または透過がある場合はRGBA）
+    """
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGB", "L", "RGBA"):
+        return img
+    if img.mode in ("LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        return img.convert("RGBA")
+    return img.convert("RGB")
+
+
+def fit_size(size, max_size) -> Tuple[int, int]:
+    """
+    長辺が max_size に収まるよう縦横比を保って縮小したサイズを返す（PILのthumbnailと同じ丸め）
+
+    Args:
+        size (tuple): 元の (幅, 高さ)
+        max_size (int): 長辺の最大サイズ
+
+    Returns:
+        tuple: 縮小後の (幅, 高さ)（収まっている場合は元のサイズ）
+    """
+    width, height = size
+    if max_size >= width and max_size >= height:
+        return width, height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if aspect <= 1:
+        return round_aspect(max_size * aspect, key=lambda n: abs(aspect - n / max_size)), max_size
+    return max_size, round_aspect(max_size / aspect, key=lambda n: 0 if n == 0 else abs(aspect - max_size / n))
+
+
+class SequentialImage:
+    """
+    先頭から順に行をデコードする画像（帯状分割の入力用）
+
+    帯状分割は帯ごとに近傍フィルタの余白を含む行範囲を上から順に切り出すため、
+    直前に切り出した範囲以降の行だけを保持し、画像全体をメモリに持ちません。
+    それより前の行が必要になった場合（コントラストの平均輝度を求めるために
+    画像を複数回読む場合など）は、先頭からデコードし直します。
+
+    Attributes:
+        size (tuple): 画像サイズ (幅, 高さ)
+        mode (str): 画像モード
+    """
+
+    def __init__(self, open_blocks, size, mode):
+        """
+        SequentialImageクラスの初期化
+
+        Args:
+            open_blocks (callable): 先頭から順に行のブロック（uint8配列）を返すイテレーターを作る関数
+            size (tuple): 画像サイズ (幅, 高さ)
+            mode (str): 画像モード
+        """
+        self._open_blocks = open_blocks
+        self.size = tuple(size)
+        self.mode = mode
+        self._blocks = None
+        # 保持している行（self._start 行目から）
+        bands = Image.getmodebands(mode)
+        self._empty = np.empty((0, size[0]) if bands == 1 else (0, size[0], bands), dtype=np.uint8)
+        self._rows = self._empty
+        self._start = 0
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def getbands(self):
+        return ImageMode.getmode(self.mode).bands
+
+    def crop(self, box):
+        """
+        行範囲を切り出す（PIL.Image.cropと同じ引数）
+
+        Args:
+            box (tuple): (左, 上, 右, 下)
+
+        Returns:
+            PIL.Image: 切り出した画像
+        """
+        left, top, right, bottom = box
+        if self._blocks is None or top < self._start:
+            if self._blocks is not None:
+                self._blocks.close()
+            self._blocks = self._open_blocks()
+            self._rows = self._empty
+            self._start = 0
+
+        # 切り出す範囲より前の行を捨て、足りない行をデコードする
+        drop = min(max(0, top - self._start), len(self._rows))
+        self._rows = self._rows[drop:]
+        self._start += drop
+        blocks = [self._rows]
+        end = self._start + len(self._rows)
+        while end < bottom:
+            block = next(self._blocks)
+            blocks.append(block)
+            end += len(block)
+        if len(blocks) > 1:
+            self._rows = np.concatenate(blocks)
+        return Image.fromarray(self._rows[top - self._start:bottom - self._start, left:right], self.mode)
+
+
+def _jpeg_row_blocks(image_data):
+    """
+    ベースラインのRGB JPEGを先頭から順にデコードし、行のブロックを返す
+
+    Pillowは行範囲を指定したデコードに対応しないため、画像全体の大きさの匿名メモリマップを
+    デコード先とし、データを少しずつデコーダーに渡します。デコード先はRGBXで、
+    デコード済みの行は未使用のバイトが255になる（未デコードの行は0のまま）ため、
+    それを目印に揃った行を取り出し、取り出し済みの行のページはOSに返却します。
+
+    Args:
+        image_data (bytes): 画像データ
+
+    Yields:
+        numpy.ndarray: 行のブロック（高さ×幅×3のuint8配列）
+    """
+    img = Image.open(io.BytesIO(image_data))
+    (decoder_name, extents, offset, args), = img.tile
+    width, height = img.size
+    stride = width * 4
+    buffer = mmap.mmap(-1, stride * height)
+    target = Image.frombuffer("RGBX", img.size, buffer, "raw", "RGBX", 0, 1)
+    pixels = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 4)
+    decoder = Image._getdecoder(img.mode, decoder_name, args, img.decoderconfig)
+    decoder.setimage(target.im, extents)
+
+    data = memoryview(image_data)[offset:]
+    position = 0
+    pending = b""
+    finished = False
+    top = decoded = released = 0
+    try:
+        while top < height:
+            while decoded < height and pixels[decoded, -1, 3] == 255:
+                decoded += 1
+            if decoded - top >= SEQUENTIAL_BLOCK_ROWS or (decoded > top and (finished or decoded == height)):
+                bottom = min(decoded, top + SEQUENTIAL_BLOCK_ROWS)
+                yield pixels[top:bottom, :, :3].copy()
+                top = bottom
+                end = top * stride // mmap.PAGESIZE * mmap.PAGESIZE
+                if hasattr(mmap, "MADV_DONTNEED") and end > released:
+                    buffer.madvise(mmap.MADV_DONTNEED, released, end - released)
+                    released = end
+                continue
+            if finished or position >= len(data):
+                raise OSError("image file is truncated")
+
+            # ImageFile.load と同じ手順でデータを渡す（消費されなかった分は次のデータの前に残す）
+            chunk = bytes(data[position:position + ImageFile.MAXBLOCK])
+            position += len(chunk)
+            pending += chunk
+            consumed, error = decoder.decode(pending)
+            if consumed < 0:
+                finished = True
+            else:
+                pending = pending[consumed:]
+            if error < 0:
+                raise OSError(f"JPEGのデコードに失敗しました（エラーコード {error}）")
+    finally:
+        decoder.cleanup()
+
+
+@register_backend("pil")
+class PillowBackend:
+    """
+    Pillowによる画像処理バックエンド（常に利用可能で、他のバックエンドの基準と代替処理を兼ねる）
+
+    バックエンドはPIL画像を受け渡しの形式とし、デコード・縮小・エンコードを担当します。
+    他のバックエンドが対応しない画像形式やモードは、このクラスの処理に任せます。
+    スタイルの画像処理オペレーションは帯状分割や変換キャッシュで同じ結果を保つため、
+    バックエンドに関わらず image_styles の処理エンジンで実行します。
+    """
+
+    name = "pil"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """バックエンドの依存関係がインストールされているかどうかを返す"""
+        return True
+
+    def decode(self, image_data, max_size=None):
+        """
+        画像データをデコード・正規化する
+
+        Args:
+            image_data (bytes): 画像データ
+            max_size (int, optional): 長辺の最大サイズ（省略時はフルサイズ）
+
+        Returns:
+            PIL.Image: 正規化済みの画像（読み込み済み）
+        """
+        img = Image.open(io.BytesIO(image_data))
+        if max_size:
+            # JPEGは縮小デコードで読み込みを高速化（縦横比を保った目標サイズを指定する）
+            scale = min(1.0, max_size / max(img.size))
+            img.draft(img.mode, (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+        img = normalize_image(img)
+        if max_size:
+            img.thumbnail((max_size, max_size))
+        img.load()
+        return img
+
+    def open_sequential(self, image_data):
+        """
+        帯状分割の入力用に、画像を先頭から順に読み込める形で開く
+
+        ベースラインのRGB JPEGは行のブロックごとにデコードします。
+        それ以外の画像（回転が必要な画像、プログレッシブJPEGなど）は画像全体をデコードします。
+
+        Args:
+            image_data (bytes): 画像データ
+
+        Returns:
+            PIL.Image or SequentialImage: 正規化済みの画像（cropで行範囲を切り出せる）
+        """
+        img = Image.open(io.BytesIO(image_data))
+        # プログレッシブJPEGはlibjpegが画像全体の係数を保持するため、逐次デコードしても省メモリにならない
+        if (img.format != "JPEG" or img.mode != "RGB" or len(img.tile) != 1 or "progression" in img.info
+                or img.getexif().get(ExifTags.Base.Orientation, 1) not in (0, 1)):
+            return self.decode(image_data)
+        return SequentialImage(lambda: _jpeg_row_blocks(image_data), img.size, "RGB")
+
+    def resize(self, img, size):
+        """
+        画像を指定サイズに変更する
+
+        Args:
+            img (PIL.Image): 画像
+            size (tuple): 変更後の (幅, 高さ)
+
+        Returns:
+            PIL.Image: サイズを変更した画像
+        """
+        if img.size == tuple(size):
+            return img.copy()
+        # thumbnailと同じ補間方法（段階的に縮小してから補間する）
+        return img.resize(size, Image.BICUBIC, reducing_gap=2.0)
+
+    def encode(self, img, pil_format, options=None) -> bytes:
+        """
+        画像をエンコードする
+
+        Args:
+            img (PIL.Image): 画像
+            pil_format (str): PILの形式名（"JPEG"、"PNG"、"WEBP" など）
+            options (dict, optional): PILの保存オプション（image_encoder.save_options の形式）
+
+        Returns:
+            bytes: エンコード済みの画像データ
+        """
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, **(options or {}))
+        return buffer.getvalue()
+
+
+@register_backend("opencv")
+class OpenCVBackend(PillowBackend):
+    """
+    OpenCVによる画像処理バックエンド
+
+    JPEGはデコード時に1/2・1/4・1/8に縮小して読み込み、縮小には面積平均法を使います。
+    JPEG以外のデコード、RGB・L・RGBA以外のモード、OpenCVが保存できない形式はPillowで処理します。
+    """
+
+    # OpenCVで保存する形式（PILの形式名 -> 拡張子）
+    ENCODE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return cv2 is not None
+
+    def decode(self, image_data, max_size=None):
+        with Image.open(io.BytesIO(image_data)) as header:
+            fmt, mode, size = header.format, header.mode, header.size
+        if fmt != "JPEG" or mode not in ("RGB", "L"):
+            return super().decode(image_data, max_size)
+
+        # 縮小後も目標サイズを下回らない最大の倍率で縮小デコードする（EXIFの向きはOpenCVが反映する）
+        reduction = 1
+        if max_size:
+            reduction = next((f for f in (8, 4, 2) if max(size) // f >= max_size), 1)
+        flags = {
+            ("RGB", 1): cv2.IMREAD_COLOR, ("RGB", 2): cv2.IMREAD_REDUCED_COLOR_2,
+            ("RGB", 4): cv2.IMREAD_REDUCED_COLOR_4, ("RGB", 8): cv2.IMREAD_REDUCED_COLOR_8,
+            ("L", 1): cv2.IMREAD_GRAYSCALE, ("L", 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            ("L", 4): cv2.IMREAD_REDUCED_GRAYSCALE_4, ("L", 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+        }[(mode, reduction)]
+        arr = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), flags)
+        if arr is None:
+            return super().decode(image_data, max_size)
+        if arr.ndim == 3:
+            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+        img = Image.fromarray(arr)
+        return self.resize(img, fit_size(img.size, max_size)) if max_size else img
+
+    def resize(self, img, size):
+        if img.mode not in ("RGB", "L") or img.size == tuple(size):
+            return super().resize(img, size)
+        shrinking = size[0] <= img.width and size[1] <= img.height
+        arr = cv2.resize(np.asarray(img), tuple(size), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+        return Image.fromarray(arr, img.mode)
+
+    def encode(self, img, pil_format, options=None) -> bytes:
+        options = options or {}
+        extension = self.ENCODE_EXTENSIONS.get(pil_format)
+        if extension is None or img.mode not in ("RGB", "L", "RGBA") or (pil_format == "JPEG" and img.mode == "RGBA"):
+            return super().encode(img, pil_format, options)
+
+        if pil_format == "JPEG":
+            params = [
+                cv2.IMWRITE_JPEG_QUALITY, int(options.get("quality", 75)),
+                cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(options.get("optimize"))),
+                cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(options.get("progressive"))),
+            ]
+        elif pil_format == "PNG":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, int(options.get("compress_level", 6))]
+        else:
+            params = [cv2.IMWRITE_WEBP_QUALITY, max(1, min(100, int(options.get("quality", 80))))]
+
+        arr = np.asarray(img)
+        if img.mode == "RGB":
+            arr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+        elif img.mode == "RGBA":
+            arr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA)
+        ok, encoded = cv2.imencode(extension, arr, params)
+        if not ok:
+            return super().encode(img, pil_format, options)
+        return encoded.tobytes()
+
+
+@register_backend("vips")
+class VipsBackend(PillowBackend):
+    """
+    libvipsによる画像処理バックエンド
+
+    デコードは先頭から逐次読み込み、縮小が必要な場合はJPEG・WebPの縮小デコードを使うため、
+    大きな画像でも元のサイズの画像全体をメモリに置きません。
+    8ビットのsRGB・グレースケール以外の画像や、libvipsで保存しない形式はPillowで処理します。
+    """
+
+    # libvipsで保存する形式（PILの形式名 -> 拡張子）
+    ENCODE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+    # バンド数に対応するPILの画像モード
+    BAND_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return pyvips is not None
+
+    @staticmethod
+    def _to_pil(image):
+        """libvipsの画像をPIL画像に変換する"""
+        mode = VipsBackend.BAND_MODES[image.bands]
+        img = Image.frombuffer(mode, (image.width, image.height), image.write_to_memory(), "raw", mode, 0, 1)
+        return img.convert("RGBA") if mode == "LA" else img
+
+    @staticmethod
+    def _from_pil(img):
+        """PIL画像（RGB・L・RGBA）をlibvipsの画像に変換する"""
+        bands = len(img.getbands())
+        image = pyvips.Image.new_from_memory(img.tobytes(), img.width, img.height, bands, "uchar")
+        return image.copy(interpretation="b-w" if bands == 1 else "srgb")
+
+    def decode(self, image_data, max_size=None):
+        image = pyvips.Image.new_from_buffer(image_data, "", access="sequential")
+        if image.format != "uchar" or image.interpretation not in ("srgb", "b-w") or image.bands not in self.BAND_MODES:
+            return super().decode(image_data, max_size)
+        if not max_size:
+            return self._to_pil(image.autorot())
+
+        # 回転後の向きで目標サイズを求め、縮小デコード（回転も反映）でその大きさだけを読み込む
+        width, height = image.width, image.height
+        if image.get_typeof("orientation") and image.get("orientation") in (5, 6, 7, 8):
+            width, height = height, width
+        target_width, target_height = fit_size((width, height), max_size)
+        thumbnail = pyvips.Image.thumbnail_buffer(image_data, target_width, height=target_height, size="force")
+        return self._to_pil(thumbnail)
+
+    def open_sequential(self, image_data):
+        image = pyvips.Image.new_from_buffer(image_data, "", access="sequential")
+        orientation = image.get("orientation") if image.get_typeof("orientation") else 1
+        # 回転が必要な画像は先頭から順に読めないため、画像全体をデコードする
+        if (image.format != "uchar" or image.interpretation not in ("srgb", "b-w") or image.bands not in (1, 3, 4)
+                or orientation not in (0, 1)):
+            return super().open_sequential(image_data)
+
+        def open_blocks():
+            image = pyvips.Image.new_from_buffer(image_data, "", access="sequential")
+            shape = (image.width,) if image.bands == 1 else (image.width, image.bands)
+            for top in range(0, image.height, SEQUENTIAL_BLOCK_ROWS):
+                rows = min(SEQUENTIAL_BLOCK_ROWS, image.height - top)
+                data = image.crop(0, top, image.width, rows).write_to_memory()
+                yield np.frombuffer(data, dtype=np.uint8).reshape((rows,) + shape)
+
+        return SequentialImage(open_blocks, (image.width, image.height), self.BAND_MODES[image.bands])
+
+    def resize(self, img, size):
+        if img.mode not in ("RGB", "L", "RGBA") or img.size == tuple(size):
+            return super().resize(img, size)
+        image = self._from_pil(img)
+        if img.mode == "RGBA":
+            # 透明な画素の色がにじまないよう、アルファを乗算してから補間する
+            image = image.premultiply()
+        image = image.resize(size[0] / img.width, vscale=size[1] / img.height)
+        if img.mode == "RGBA":
+            image = image.unpremultiply()
+        return self._to_pil(image.cast("uchar"))
+
+    def encode(self, img, pil_format, options=None) -> bytes:
+        options = options or {}
+        extension = self.ENCODE_EXTENSIONS.get(pil_format)
+        if extension is None or img.mode not in ("RGB", "L", "RGBA") or (pil_format == "JPEG" and img.mode == "RGBA"):
+            return super().encode(img, pil_format, options)
+
+        if pil_format == "JPEG":
+            params = {
+                "Q": int(options.get("quality", 75)),
+                "optimize_coding": bool(options.get("optimize")),
+                "interlace": bool(options.get("progressive")),
+                # libvipsは画質90以上で色差の間引きをやめるため、Pillowと同じく常に4:2:0にする
+                "subsample_mode": "on",
+            }
+        elif pil_format == "PNG":
+            # libvipsの既定はフィルタなしのため、Pillow（libpng）と同じく行ごとにフィルタを選ばせる
+            params = {"compression": int(options.get("compress_level", 6)), "filter": "all"}
+        else:
+            params = {"Q": int(options.get("quality", 80)), "effort": int(options.get("method", 4))}
+        return self._from_pil(img).write_to_buffer(extension, **params)
+
+
+def available_backends() -> List[str]:
+    """
+    この環境で利用できる画像処理バックエンドを優先順に返す
+
+    Returns:
+        list: バックエンド名のリスト
+    """
+    return [name for name in BACKEND_PREFERENCE if name in BACKENDS and BACKENDS[name].is_available()]
+
+
+def create_backend(name):
+    """
+    指定した画像処理バックエンドを作成する
+
+    Args:
+        name (str): バックエンド名（"auto" の場合は利用できるものから優先順に選ぶ）
+
+    Returns:
+        PillowBackend: 画像処理バックエンド
+    """
+    if name == "auto":
+        name = available_backends()[0]
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"未知の画像処理バックエンドです: {name}")
+    if not backend_class.is_available():
+        raise ValueError(f"画像処理バックエンド {name} の依存関係がインストールされていません")
+    return backend_class()
+
+
+_backend: Optional[PillowBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_image_backend() -> PillowBackend:
+    """
+    プロセス内で共有する画像処理バックエンドを返す（初回呼び出し時に選択する）
+
+    環境変数 IMAGE_BACKEND で指定したバックエンドが利用できない場合は、自動選択に切り替えます。
+
+    Returns:
+        PillowBackend: 画像処理バックエンド
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                try:
+                    backend = create_backend(IMAGE_BACKEND)
+                except ValueError as e:
+                    logger.warning(f"{e}。利用できるバックエンドから自動で選択します")
+                    backend = create_backend("auto")
+                logger.info(f"画像処理バックエンド: {backend.name}（利用可能: {', '.join(available_backends())}）")
+                _backend = backend
+    return _backend
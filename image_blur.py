@@ -0,0 +1,157 @@
+import math
+import logging
+
+from PIL import Image, ImageChops, ImageFilter
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_blur")
+
+# 縮小画像上でぼかす半径の下限（これより小さくなるほど縮小すると拡大時に粗さが目立つ）
+PYRAMID_LEVEL_RADIUS = 4.0
+
+# ピラミッド方式で縮小する倍率の上限
+PYRAMID_MAX_FACTOR = 64
+
+# ぼかしの方式
+BLUR_METHODS = ("auto", "pil", "pyramid")
+
+
+def choose_blur_method(radius):
+    """
+    ぼかしの半径から最も速い方式を選ぶ
+
+    PILのガウスぼかしはボックスぼかしの繰り返しで、半径に関わらず1画素あたりの計算量は一定です。
+    半径が大きい場合は、画像を縮小してからぼかして拡大する方が処理する画素数が少なく済むため、
+    縮小画像上の半径が PYRAMID_LEVEL_RADIUS 以上になる範囲で最も大きく縮小します。
+
+    Args:
+        radius (float): ぼかしの半径（標準偏差）
+
+    Returns:
+        tuple: (方式名, 縮小倍率)
+    """
+    if radius < 2 * PYRAMID_LEVEL_RADIUS:
+        return "pil", 1
+    factor = 2 ** int(math.log2(radius / PYRAMID_LEVEL_RADIUS))
+    return "pyramid", min(factor, PYRAMID_MAX_FACTOR)
+
+
+def is_pil_blur(radius, method="auto"):
+    """
+    fast_blur が縮小せずにPILのガウスぼかしをそのまま使うかどうかを返す
+
+    この場合の結果は gaussian_blur オペレーションと同じになります。
+
+    Args:
+        radius (float): ぼかしの半径（標準偏差）
+        method (str): ぼかしの方式（"auto"、"pil" または "pyramid"）
+
+    Returns:
+        bool: PILのガウスぼかしをそのまま使う場合はTrue
+    """
+    return method == "pil" or (method == "auto" and choose_blur_method(radius)[0] == "pil")
+
+
+def _reduced_radius(radius, factor):
+    """
+    縮小画像上でぼかす半径を求める
+
+    縮小（平均）と拡大（線形補間）自体もぼかしとして働くため、その分の分散を差し引きます。
+    """
+    resample_variance = (factor * factor - 1) / 12.0 + factor * factor / 6.0
+    return math.sqrt(max(0.0, radius * radius - resample_variance)) / factor
+
+
+def fast_blur(img, radius, method="auto"):
+    """
+    ガウスぼかしを適用する（半径に応じて最も速い方式を使う）
+
+    Args:
+        img (PIL.Image): 入力画像
+        radius (float): ぼかしの半径（標準偏差）
+        method (str): ぼかしの方式（"auto"、"pil" または "pyramid"）
+
+    Returns:
+        PIL.Image: ぼかした画像
+    """
+    if method not in BLUR_METHODS:
+        raise ValueError(f"未対応のぼかし方式です: {method}")
+    if radius <= 0:
+        return img.copy()
+
+    if is_pil_blur(radius, method):
+        return img.filter(ImageFilter.GaussianBlur(radius))
+    _, factor = choose_blur_method(radius)
+    if method == "pyramid" and factor == 1:
+        factor = 2
+    factor = min(factor, max(1, min(img.size) // 2))
+    if factor < 2:
+        return img.filter(ImageFilter.GaussianBlur(radius))
+
+    small = img.reduce(factor).filter(ImageFilter.GaussianBlur(_reduced_radius(radius, factor)))
+    return small.resize(img.size, Image.BILINEAR)
+
+
+def _highlights(img, threshold):
+    """しきい値より明るい部分だけを残し、0〜255に引き伸ばす"""
+    scale = 255.0 / max(1, 255 - threshold)
+    table = [0 if value <= threshold else min(255, round((value - threshold) * scale)) for value in range(256)]
+    return img.point(table * len(img.getbands()))
+
+
+def glow(img, radius=24.0, strength=0.6, threshold=160, levels=3):
+    """
+    明るい部分から光がにじみ出るような効果（グロー）を加える
+
+    明るい部分を抜き出した画像を縮小しながら複数の半径でぼかし（半径は1段ごとに2倍）、
+    粗い段から順に拡大して足し合わせた光を、スクリーン合成で元の画像に重ねます。
+    各段のぼかしは縮小画像上の小さな半径で済むため、大きな半径でも処理時間はほとんど増えません。
+
+    Args:
+        img (PIL.Image): 入力画像
+        radius (float): 最も細かい段のぼかしの半径
+        strength (float): 光の強さ（0〜1）
+        threshold (int): 光らせる明るさのしきい値（0〜255）
+        levels (int): ぼかしの段数
+
+    Returns:
+        PIL.Image: 変換後の画像
+    """
+    if img.mode == "RGBA":
+        result = glow(img.convert("RGB"), radius, strength, threshold, levels)
+        result.putalpha(img.getchannel("A"))
+        return result
+    source_mode = img.mode
+    if source_mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    # 最も細かい段は半径に応じて縮小し、以降は1段ごとに半分に縮小して半径を2倍にする
+    _, factor = choose_blur_method(radius)
+    factor = min(factor, max(1, min(img.size) // 2))
+    level_image = _highlights(img, threshold)
+    if factor > 1:
+        level_image = level_image.reduce(factor)
+    level_image = level_image.filter(ImageFilter.GaussianBlur(_reduced_radius(radius, factor)))
+    blurred = [level_image]
+    sigma, scale = radius, factor
+    for _ in range(1, max(1, levels)):
+        if min(level_image.size) < 4:
+            break
+        # 半分への縮小で増える分散を差し引き、残りを縮小後の画像上でぼかす
+        level_image = level_image.reduce(2)
+        extra_variance = 3 * sigma * sigma - scale * scale / 4.0
+        sigma, scale = 2 * sigma, 2 * scale
+        level_image = level_image.filter(ImageFilter.GaussianBlur(math.sqrt(max(0.0, extra_variance)) / scale))
+        blurred.append(level_image)
+
+    # 粗い段から順に拡大し、各段を同じ重みで平均する
+    accumulated = blurred[-1]
+    for count, level_image in enumerate(reversed(blurred[:-1]), start=2):
+        accumulated = Image.blend(accumulated.resize(level_image.size, Image.BILINEAR), level_image, 1.0 / count)
+    accumulated = accumulated.resize(img.size, Image.BILINEAR)
+
+    table = [min(255, round(value * strength)) for value in range(256)]
+    light = accumulated.point(table * len(accumulated.getbands()))
+    result = ImageChops.screen(img, light)
+    return result if source_mode in ("RGB", "L") else result.convert(source_mode)
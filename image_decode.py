@@ -0,0 +1,224 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from image_backend import fit_size, get_image_backend
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_decode")
+
+# 画面表示用の画像の長辺の最大サイズ
+DISPLAY_MAX_SIZE = 1024
+
+# 正規化処理のバージョン（処理内容を変えた場合は変換画像キャッシュを無効にするため上げる）
+NORMALIZE_VERSION = 1
+
+# 画像形式を判定するためのファイル先頭のシグネチャ
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def sniff_mime_type(image_data) -> Optional[str]:
+    """
+    画像データの先頭バイトからMIMEタイプを判定する（デコードは行わない）
+
+    Args:
+        image_data (bytes): 画像データ
+
+    Returns:
+        str: MIMEタイプ（判定できない場合はNone）
+    """
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in MAGIC_NUMBERS:
+        if image_data.startswith(signature):
+            return mime_type
+    return None
+
+
+class DecodedImageCache:
+    """
+    アップロード画像ごとにデコードと正規化を1回だけ行うキャッシュ
+
+    同じ画像データとサイズの組み合わせにはデコード済みの画像を返します。
+    縮小版が必要な場合、フルサイズの画像がキャッシュにあればそこから縮小し、
+    なければ画像処理バックエンドの縮小デコード（JPEGのdraft()など）で必要なサイズだけを読み込みます。
+    返す画像は共有されるため、呼び出し側で変更しないでください。
+
+    Attributes:
+        max_bytes (int): 保持するデコード済み画像の合計サイズの上限（バイト）
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        DecodedImageCacheクラスの初期化
+
+        Args:
+            max_bytes (int): 保持するデコード済み画像の合計サイズの上限（バイト）
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._display = OrderedDict()
+        self.decodes = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+            return img
+
+    def _store(self, key, img):
+        size = img.width * img.height * len(img.getbands())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                return
+            self._images[key] = img
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def decode(self, image_data, max_size=None):
+        """
+        画像データをデコード・正規化した画像を返す
+
+        Args:
+            image_data (bytes): 画像データ
+            max_size (int, optional): 長辺の最大サイズ（省略時はフルサイズ）
+
+        Returns:
+            PIL.Image: 正規化済みの画像
+        """
+        digest = hashlib.sha1(image_data).hexdigest()
+        key = (digest, max_size)
+        img = self._lookup(key)
+        if img is not None:
+            return img
+
+        full = self._lookup((digest, None)) if max_size else None
+        backend = get_image_backend()
+        if full is not None:
+            img = backend.resize(full, fit_size(full.size, max_size))
+        else:
+            img = backend.decode(image_data, max_size)
+            self.decodes += 1
+        self._store(key, img)
+        return img
+
+    def display(self, source, max_size=DISPLAY_MAX_SIZE) -> bytes:
+        """
+        画面表示用に縮小・エンコードした画像データを返す
+
+        Streamlitに大きな画像をそのまま渡すと再実行のたびにデコードされるため、
+        表示サイズまで縮小したJPEG（透過がある場合はPNG）を一度だけ作って再利用します。
+
+        Args:
+            source (str or bytes): 画像ファイルのパス、または画像データ
+            max_size (int): 長辺の最大サイズ
+
+        Returns:
+            bytes: 表示用の画像データ
+        """
+        if isinstance(source, str):
+            stat = os.stat(source)
+            key = (source, stat.st_mtime_ns, stat.st_size, max_size)
+        else:
+            key = (hashlib.sha1(source).hexdigest(), max_size)
+
+        with self._lock:
+            data = self._display.get(key)
+            if data is not None:
+                self._display.move_to_end(key)
+                return data
+
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        img = self.decode(source, max_size)
+        if img.mode == "RGBA":
+            data = get_image_backend().encode(img, "PNG")
+        else:
+            data = get_image_backend().encode(img, "JPEG", {"quality": 90})
+
+        with self._lock:
+            self._display[key] = data
+            # 表示用データは小さいため件数で上限を設ける
+            while len(self._display) > 256:
+                self._display.popitem(last=False)
+        return data
+
+
+_cache: Optional[DecodedImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_decoded_image_cache() -> DecodedImageCache:
+    """
+    プロセス内で共有するデコード済み画像のキャッシュを返す
+
+    Returns:
+        DecodedImageCache: デコード済み画像のキャッシュ
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DecodedImageCache()
+    return _cache
+
+
+def decode_upload(image_data, max_size=None):
+    """
+    アップロード画像をデコード・正規化する（結果はプロセス内で共有）
+
+    Args:
+        image_data (bytes): 画像データ
+        max_size (int, optional): 長辺の最大サイズ（省略時はフルサイズ）
+
+    Returns:
+        PIL.Image: 正規化済みの画像
+    """
+    return get_decoded_image_cache().decode(image_data, max_size)
+
+
+def open_sequential(image_data):
+    """
+    帯状分割で処理する大きな画像を、先頭から順にデコードする形で開く
+
+    画像全体を保持しないよう、デコード済み画像のキャッシュには登録しません。
+
+    Args:
+        image_data (bytes): 画像データ
+
+    Returns:
+        PIL.Image or SequentialImage: 正規化済みの画像（cropで行範囲を切り出せる）
+    """
+    return get_image_backend().open_sequential(image_data)
+
+
+def display_image(source, max_size=DISPLAY_MAX_SIZE) -> bytes:
+    """
+    画面表示用に縮小した画像データを返す（結果はプロセス内で共有）
+
+    Args:
+        source (str or bytes): 画像ファイルのパス、または画像データ
+        max_size (int): 長辺の最大サイズ
+
+    Returns:
+        bytes: 表示用の画像データ
+    """
+    return get_decoded_image_cache().display(source, max_size)
@@ -0,0 +1,193 @@
+import os
+import logging
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from image_backend import get_image_backend
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_encoder")
+
+# 出力形式（"auto" は画像の内容から自動選択）
+FORMAT_AUTO = "auto"
+
+# 出力形式ごとのPILの形式名・拡張子・MIMEタイプ
+FORMATS = {
+    "png": {"pil_format": "PNG", "extension": ".png", "mime_type": "image/png"},
+    "jpeg": {"pil_format": "JPEG", "extension": ".jpg", "mime_type": "image/jpeg"},
+    "webp": {"pil_format": "WEBP", "extension": ".webp", "mime_type": "image/webp"},
+    "avif": {"pil_format": "AVIF", "extension": ".avif", "mime_type": "image/avif"},
+}
+
+# アニメーションの出力形式（フレームごとに変換して書き込むため、エンコード設定では選択しない）
+ANIMATION_FORMATS = {
+    "gif": {"pil_format": "GIF", "extension": ".gif", "mime_type": "image/gif"},
+}
+
+# 既定のエンコード設定
+# effort は 0（最速）〜6（最小サイズ）で、形式ごとの圧縮レベルに変換します
+DEFAULT_ENCODER_SETTINGS = {
+    "format": os.getenv("IMAGE_OUTPUT_FORMAT", FORMAT_AUTO),
+    "lossy_format": "jpeg",
+    "quality": 85,
+    "effort": 4,
+    "progressive": False,
+    "threads": os.cpu_count() or 1,
+}
+
+# 平坦な画像（イラスト・ピクセルアートなど）とみなす色数の上限
+FLAT_IMAGE_MAX_COLORS = 256
+
+# 色数を数える際の縮小画像の長辺サイズ
+FLAT_IMAGE_SAMPLE_SIZE = 256
+
+# PNGの圧縮レベル（effortごと）
+_PNG_COMPRESS_LEVELS = (1, 2, 3, 4, 6, 8, 9)
+
+
+def available_formats():
+    """
+    このPIL環境で保存できる出力形式を返す
+
+    Returns:
+        list: 出力形式のリスト
+    """
+    Image.init()
+    return [name for name, spec in FORMATS.items() if spec["pil_format"] in Image.SAVE]
+
+
+def get_encoder_settings(**overrides) -> Dict:
+    """
+    既定値に上書き設定を重ねたエンコード設定を返す
+
+    Args:
+        **overrides: 上書きする設定（Noneの値は無視）
+
+    Returns:
+        dict: エンコード設定
+    """
+    return {**DEFAULT_ENCODER_SETTINGS, **{k: v for k, v in overrides.items() if v is not None}}
+
+
+def is_flat_image(img, max_colors=FLAT_IMAGE_MAX_COLORS):
+    """
+    色数の少ない平坦な画像（イラスト・ピクセルアートなど）かどうかを判定する
+
+    新しい色を作らない最近傍法で縮小した画像の色数で判定します。
+
+    Args:
+        img (PIL.Image): 画像
+        max_colors (int): 平坦とみなす色数の上限
+
+    Returns:
+        bool: 平坦な画像の場合はTrue
+    """
+    scale = min(1.0, FLAT_IMAGE_SAMPLE_SIZE / max(img.size))
+    sample = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.NEAREST)
+    return sample.getcolors(max_colors) is not None
+
+
+def choose_format(img, settings) -> str:
+    """
+    画像とエンコード設定から出力形式を決める
+
+    自動選択の場合、平坦な画像と透過のある画像はPNG、写真のような画像は非可逆形式を選びます。
+
+    Args:
+        img (PIL.Image): 画像
+        settings (dict): エンコード設定
+
+    Returns:
+        str: 出力形式
+    """
+    available = available_formats()
+    fmt = settings["format"]
+    if fmt != FORMAT_AUTO:
+        if fmt not in available:
+            logger.warning(f"出力形式 {fmt} は利用できないためPNGで保存します")
+            return "png"
+        # JPEGは透過を扱えないため、透過のある画像はPNGで保存する
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            return "png"
+        return fmt
+
+    if img.mode not in ("RGB", "L") or is_flat_image(img):
+        return "png"
+    lossy = settings["lossy_format"]
+    return lossy if lossy in available else "jpeg"
+
+
+def save_options(fmt, settings):
+    """出力形式ごとの保存オプションを返す"""
+    effort = max(0, min(6, int(settings["effort"])))
+    quality = int(settings["quality"])
+    if fmt == "png":
+        return {"compress_level": _PNG_COMPRESS_LEVELS[effort]}
+    if fmt == "jpeg":
+        return {"quality": quality, "optimize": effort >= 5, "progressive": bool(settings["progressive"])}
+    if fmt == "webp":
+        return {"quality": quality, "method": effort}
+    # AVIFのspeedは0（最小サイズ）〜10（最速）
+    return {"quality": quality, "speed": 10 - round(effort * 10 / 6), "max_threads": int(settings["threads"])}
+
+
+def encode_image(img, settings=None) -> Tuple[bytes, str]:
+    """
+    エンコード設定に従って画像をエンコードする
+
+    Args:
+        img (PIL.Image): 画像
+        settings (dict, optional): エンコード設定（省略時は既定値）
+
+    Returns:
+        bytes: エンコード済みの画像データ
+        str: 出力形式
+    """
+    settings = settings or DEFAULT_ENCODER_SETTINGS
+    fmt = choose_format(img, settings)
+    return get_image_backend().encode(img, FORMATS[fmt]["pil_format"], save_options(fmt, settings)), fmt
+
+
+def settings_key(settings) -> str:
+    """
+    出力結果に影響するエンコード設定をキャッシュキー用の文字列にする
+
+    Args:
+        settings (dict): エンコード設定
+
+    Returns:
+        str: 設定を表す文字列
+    """
+    return "{format}-{lossy_format}-q{quality}-e{effort}-p{progressive:d}".format(**settings)
+
+
+def extension_for(fmt) -> str:
+    """
+    出力形式の拡張子を返す
+
+    Args:
+        fmt (str): 出力形式
+
+    Returns:
+        str: 拡張子（ドット付き）
+    """
+    return (FORMATS.get(fmt) or ANIMATION_FORMATS[fmt])["extension"]
+
+
+def mime_type_for_path(path) -> Optional[str]:
+    """
+    ファイルの拡張子からMIMEタイプを返す
+
+    Args:
+        path (str): ファイルパス
+
+    Returns:
+        str: MIMEタイプ（不明な場合はNone）
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for spec in (*FORMATS.values(), *ANIMATION_FORMATS.values()):
+        if spec["extension"] == extension:
+            return spec["mime_type"]
+    return None
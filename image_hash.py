@@ -0,0 +1,339 @@
+import math
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from image_decode import decode_upload
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_hash")
+
+# 候補の確認に使うdHashの一辺のサイズ（256ビット）
+STRONG_HASH_SIZE = 16
+
+
+def dhash(image, hash_size=8):
+    """
+    画像の差分ハッシュ（dHash）を計算する
+
+    縮小したグレースケール画像の隣接画素の明暗差を1ビットずつ並べたもので、
+    再エンコード・リサイズ・EXIFの有無に影響されにくい知覚ハッシュです。
+
+    Args:
+        image (PIL.Image or bytes): 画像または画像データ
+        hash_size (int): ハッシュの一辺のサイズ（ビット数は hash_size ** 2）
+
+    Returns:
+        int: 知覚ハッシュ値
+    """
+    if isinstance(image, (bytes, bytearray)):
+        # 縮小デコード・EXIFの回転の反映済みの画像を共有キャッシュから取得
+        image = decode_upload(bytes(image), hash_size * 16)
+    else:
+        # 向きの違いで別画像と判定しないようEXIFの回転を反映
+        image = ImageOps.exif_transpose(image)
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """
+    2つのハッシュ値のハミング距離を返す
+
+    Args:
+        a (int): ハッシュ値
+        b (int): ハッシュ値
+
+    Returns:
+        int: 異なるビットの数
+    """
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    ハミング距離で近傍検索を行うBK木
+
+    三角不等式を利用して探索範囲を絞り込むため、登録数が増えても
+    閾値以内のハッシュを全件比較せずに見つけられます。
+    """
+
+    def __init__(self):
+        """BKTreeクラスの初期化"""
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        """
+        ハッシュ値と値を登録する
+
+        Args:
+            key (int): ハッシュ値
+            value (Any): 関連付ける値
+        """
+        node = [key, [value], {}]
+        if self._root is None:
+            self._root = node
+            self._size += 1
+            return
+
+        current = self._root
+        while True:
+            distance = hamming_distance(key, current[0])
+            if distance == 0:
+                current[1].append(value)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                self._size += 1
+                return
+            current = child
+
+    def search(self, key, max_distance) -> List[Tuple[int, Any]]:
+        """
+        閾値以内のハッシュ値に関連付けられた値を距離の昇順で返す
+
+        Args:
+            key (int): 検索するハッシュ値
+            max_distance (int): 許容するハミング距離
+
+        Returns:
+            list: (距離, 値) のリスト
+        """
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = hamming_distance(key, node_key)
+            if distance <= max_distance:
+                results.extend((distance, value) for value in values)
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+class ImageSignature(NamedTuple):
+    """
+    知覚ハッシュインデックスで画像を照合するための特徴
+
+    Attributes:
+        dhash (int): 64ビットのdHash（BK木での候補の絞り込みに使用）
+        strong_hash (int): 256ビットのdHash（候補の確認に使用）
+        content_hash (str): 画像データのSHA-256
+        aspect (float): 縦横比（幅 / 高さ）
+        entropy (float): 縮小したグレースケール画像の輝度ヒストグラムのエントロピー（ビット）
+    """
+    dhash: int
+    strong_hash: int
+    content_hash: str
+    aspect: float
+    entropy: float
+
+
+def luminance_entropy(image):
+    """
+    グレースケール画像の輝度ヒストグラムのエントロピー（ビット）を返す
+
+    Args:
+        image (PIL.Image): グレースケール画像
+
+    Returns:
+        float: エントロピー（0〜8）
+    """
+    histogram = image.histogram()
+    total = sum(histogram)
+    return -sum(count / total * math.log2(count / total) for count in histogram if count)
+
+
+class PerceptualIndex:
+    """
+    知覚ハッシュで画像ごとの結果を再利用するためのインデックス
+
+    同じ写真の再保存・リサイズ版・EXIF削除版を同一画像とみなし、
+    (画像, 名前空間) ごとに登録された結果（変換画像のパスや説明など）を返します。
+    インデックスは全セッションで共有されるため、別の画像の結果を返さないよう
+    dHashの一致だけではヒットとせず、画像データのSHA-256が一致するか、
+    次の条件をすべて満たす場合のみ同一画像とみなします。
+
+    - 256ビットのdHashの距離が max_strong_distance 以下
+    - 縦横比の差が aspect_tolerance 以下
+    - 両方の画像の輝度のエントロピーが min_entropy 以上
+      （白地の文書のスクリーンショットのような平坦な画像は、別の画像でもハッシュが一致しやすい）
+
+    登録する画像数は max_images までとし、最も長く使われていない画像から削除します。
+
+    Attributes:
+        max_distance (int): 候補とする64ビットのdHashのハミング距離の上限
+        max_strong_distance (int): 同一画像とみなす256ビットのdHashのハミング距離の上限
+        aspect_tolerance (float): 同一画像とみなす縦横比の相対差の上限
+        min_entropy (float): 近似一致を許可する輝度のエントロピーの下限（ビット）
+        max_images (int): 保持する画像数の上限
+        hash_size (int): 候補の絞り込みに使うdHashの一辺のサイズ
+    """
+
+    def __init__(self, max_distance=4, max_strong_distance=12, aspect_tolerance=0.02, min_entropy=5.0,
+                 max_images=4096, hash_size=8):
+        """
+        PerceptualIndexクラスの初期化
+
+        Args:
+            max_distance (int): 候補とする64ビットのdHashのハミング距離の上限
+            max_strong_distance (int): 同一画像とみなす256ビットのdHashのハミング距離の上限
+            aspect_tolerance (float): 同一画像とみなす縦横比の相対差の上限
+            min_entropy (float): 近似一致を許可する輝度のエントロピーの下限（ビット）
+            max_images (int): 保持する画像数の上限
+            hash_size (int): 候補の絞り込みに使うdHashの一辺のサイズ
+        """
+        self.max_distance = max_distance
+        self.max_strong_distance = max_strong_distance
+        self.aspect_tolerance = aspect_tolerance
+        self.min_entropy = min_entropy
+        self.max_images = max_images
+        self.hash_size = hash_size
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        # SHA-256 -> {"signature": ImageSignature, "results": {名前空間: 結果}}（使用順）
+        self._images = OrderedDict()
+        self._evicted = 0
+
+    def hash_image(self, image) -> Optional[ImageSignature]:
+        """
+        画像の照合用の特徴を計算する
+
+        Args:
+            image (PIL.Image or bytes): 画像または画像データ
+
+        Returns:
+            ImageSignature: 画像の特徴（計算できない場合はNone）
+        """
+        try:
+            if isinstance(image, (bytes, bytearray)):
+                content_hash = hashlib.sha256(image).hexdigest()
+                # 縮小デコード・EXIFの回転の反映済みの画像を共有キャッシュから取得
+                image = decode_upload(bytes(image), STRONG_HASH_SIZE * 16)
+            else:
+                image = ImageOps.exif_transpose(image)
+                content_hash = hashlib.sha256(image.tobytes()).hexdigest()
+            gray = image.convert("L")
+            return ImageSignature(
+                dhash=dhash(gray, self.hash_size),
+                strong_hash=dhash(gray, STRONG_HASH_SIZE),
+                content_hash=content_hash,
+                aspect=image.width / image.height,
+                entropy=luminance_entropy(gray.resize((64, 64), Image.BILINEAR)),
+            )
+        except Exception as e:
+            logger.error(f"知覚ハッシュの計算に失敗しました: {str(e)}")
+            return None
+
+    def _is_same_image(self, a, b):
+        """2つの特徴が同一画像とみなせるかどうかを判定する"""
+        if a.content_hash == b.content_hash:
+            return True
+        if a.entropy < self.min_entropy or b.entropy < self.min_entropy:
+            return False
+        if abs(a.aspect - b.aspect) > self.aspect_tolerance * max(a.aspect, b.aspect):
+            return False
+        return hamming_distance(a.strong_hash, b.strong_hash) <= self.max_strong_distance
+
+    def _matches(self, signature):
+        """同一画像とみなせる登録済みの画像を近い順に返す（ロック取得済みの状態で呼び出す）"""
+        entry = self._images.get(signature.content_hash)
+        if entry is not None:
+            yield 0, entry
+        if signature.entropy < self.min_entropy:
+            return
+        for distance, content_hash in self._tree.search(signature.dhash, self.max_distance):
+            if content_hash == signature.content_hash:
+                continue
+            entry = self._images.get(content_hash)
+            # 削除済みの画像はBK木に残っているため読み飛ばす
+            if entry is not None and self._is_same_image(signature, entry["signature"]):
+                yield distance, entry
+
+    def lookup(self, signature, namespace) -> Optional[Any]:
+        """
+        同一画像とみなせる画像に登録された結果を検索する
+
+        Args:
+            signature (ImageSignature): 画像の特徴
+            namespace (str): 結果の種類（例: "transform:水彩画風:..."）
+
+        Returns:
+            Any: 登録された結果（見つからない場合はNone）
+        """
+        if signature is None:
+            return None
+        with self._lock:
+            for distance, entry in self._matches(signature):
+                result = entry["results"].get(namespace)
+                if result is not None:
+                    self._images.move_to_end(entry["signature"].content_hash)
+                    logger.info(f"知覚ハッシュで類似画像の結果を再利用します（距離 {distance}、{namespace}）")
+                    return result
+        return None
+
+    def store(self, signature, namespace, result):
+        """
+        画像の結果を登録する
+
+        Args:
+            signature (ImageSignature): 画像の特徴
+            namespace (str): 結果の種類
+            result (Any): 登録する結果
+        """
+        if signature is None or result is None:
+            return
+        with self._lock:
+            entry = self._images.get(signature.content_hash)
+            if entry is None:
+                entry = {"signature": signature, "results": {}}
+                self._images[signature.content_hash] = entry
+                self._tree.add(signature.dhash, signature.content_hash)
+            entry["results"][namespace] = result
+            self._images.move_to_end(signature.content_hash)
+
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+                self._evicted += 1
+            # BK木は削除に対応しないため、削除済みの画像が増えたら作り直す
+            if self._evicted > self.max_images:
+                self._tree = BKTree()
+                for content_hash, alive in self._images.items():
+                    self._tree.add(alive["signature"].dhash, content_hash)
+                self._evicted = 0
+
+    def discard(self, signature, namespace):
+        """
+        同一画像とみなせる画像に登録された結果を削除する（ファイルが削除された場合など）
+
+        Args:
+            signature (ImageSignature): 画像の特徴
+            namespace (str): 結果の種類
+        """
+        if signature is None:
+            return
+        with self._lock:
+            for _, entry in list(self._matches(signature)):
+                entry["results"].pop(namespace, None)
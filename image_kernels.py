@@ -0,0 +1,401 @@
+import math
+import logging
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from image_blur import is_pil_blur
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_kernels")
+
+# NumPyパイプラインで扱える画像モード
+SUPPORTED_MODES = ("RGB", "L")
+
+# ボックスぼかしで累積和を使わず直接足し合わせる最大半径
+DIRECT_SUM_MAX_RADIUS = 2
+
+# NumPy版オペレーションのファクトリ（オペレーション名 -> パラメータから処理関数を作る関数）
+# 処理関数は (配列, ワークスペース) を受け取り、可能な限り配列をその場で書き換えて返す
+NUMPY_OPERATIONS: Dict[str, Callable[..., Callable[[np.ndarray, "Workspace"], np.ndarray]]] = {}
+
+
+def register_numpy_operation(name):
+    """
+    NumPy版の画像処理オペレーションを登録するデコレーター
+
+    Args:
+        name (str): スタイル定義の "op" に対応する名前
+
+    Returns:
+        callable: デコレーター
+    """
+    def decorator(factory):
+        NUMPY_OPERATIONS[name] = factory
+        return factory
+    return decorator
+
+
+class Workspace:
+    """
+    パイプライン内で使い回す作業用バッファ
+
+    近傍フィルタなど元の値を参照しながら書き換える処理のために、
+    同じ形状の作業用配列を1つだけ確保して再利用します。
+    """
+
+    def __init__(self):
+        """Workspaceクラスの初期化"""
+        self._scratch = None
+
+    def scratch(self, shape):
+        """
+        指定形状の作業用配列を返す（形状が変わった場合のみ再確保）
+
+        Args:
+            shape (tuple): 配列の形状
+
+        Returns:
+            numpy.ndarray: float32の作業用配列
+        """
+        if self._scratch is None or self._scratch.shape != shape:
+            self._scratch = np.empty(shape, dtype=np.float32)
+        return self._scratch
+
+
+def image_to_array(img):
+    """
+    PIL画像をNumPyパイプライン用のfloat32配列（高さ×幅×チャンネル）に変換する
+
+    Args:
+        img (PIL.Image): RGBまたはLモードの画像
+
+    Returns:
+        numpy.ndarray: float32配列
+    """
+    arr = np.asarray(img, dtype=np.float32)
+    if arr.ndim == 2:
+        arr = arr[:, :, np.newaxis]
+    return arr
+
+
+def array_to_image(arr):
+    """
+    NumPyパイプラインのfloat32配列をPIL画像に変換する
+
+    Args:
+        arr (numpy.ndarray): 0〜255に収まったfloat32配列
+
+    Returns:
+        PIL.Image: RGBまたはLモードの画像
+    """
+    out = arr.astype(np.uint8)
+    if out.shape[2] == 1:
+        return Image.fromarray(out[:, :, 0], mode="L")
+    return Image.fromarray(out, mode="RGB")
+
+
+def luma(arr, out=None):
+    """
+    ITU-R 601-2のルマ値をPILと同じ整数演算で計算する
+
+    重みの合計が2の16乗のため、float32のままでも途中の値は整数として正確に表現できます。
+
+    Args:
+        arr (numpy.ndarray): RGBのfloat32配列
+        out (numpy.ndarray, optional): 出力先（高さ×幅×1）
+
+    Returns:
+        numpy.ndarray: ルマ値（高さ×幅×1）
+    """
+    if out is None:
+        out = np.empty(arr.shape[:2] + (1,), dtype=np.float32)
+    value = out[:, :, 0]
+    np.multiply(arr[:, :, 0], 19595, out=value)
+    value += arr[:, :, 1] * 38470
+    value += arr[:, :, 2] * 7471
+    value += 0x8000
+    value *= 1.0 / 0x10000
+    np.floor(value, out=value)
+    return out
+
+
+def blend_in_place(arr, degenerate, factor):
+    """PILのImage.blendと同じ丸め（クリップ後に切り捨て）でその場で補間する"""
+    arr -= degenerate
+    arr *= factor
+    arr += degenerate
+    np.clip(arr, 0, 255, out=arr)
+    np.floor(arr, out=arr)
+    return arr
+
+
+def _neighbour_sum(src, out):
+    """3x3近傍のうち中心を除く8画素の和を内側領域について計算する"""
+    np.add(src[:-2, :-2], src[:-2, 1:-1], out=out)
+    out += src[:-2, 2:]
+    out += src[1:-1, :-2]
+    out += src[1:-1, 2:]
+    out += src[2:, :-2]
+    out += src[2:, 1:-1]
+    out += src[2:, 2:]
+    return out
+
+
+@register_numpy_operation("color")
+def _color(factor):
+    def apply(arr, workspace):
+        if arr.shape[2] == 1:
+            return arr
+        return blend_in_place(arr, luma(arr), factor)
+    return apply
+
+
+@register_numpy_operation("contrast")
+def _contrast(factor):
+    def apply(arr, workspace):
+        gray = arr if arr.shape[2] == 1 else luma(arr)
+        mean = float(int(gray.mean(dtype=np.float64) + 0.5))
+        return blend_in_place(arr, mean, factor)
+    return apply
+
+
+@register_numpy_operation("brightness")
+def _brightness(factor):
+    def apply(arr, workspace):
+        return blend_in_place(arr, 0.0, factor)
+    return apply
+
+
+@register_numpy_operation("sharpness")
+def _sharpness(factor):
+    def apply(arr, workspace):
+        if arr.shape[0] < 3 or arr.shape[1] < 3:
+            return arr
+        # 縁の画素はPILと同様にフィルタを適用しない（SMOOTHカーネル: 周囲1・中心5・除数13）
+        smooth = workspace.scratch(arr.shape)
+        smooth[...] = arr
+        inner = smooth[1:-1, 1:-1]
+        _neighbour_sum(arr, inner)
+        inner += arr[1:-1, 1:-1] * 5
+        inner /= 13
+        inner += 0.5
+        np.floor(inner, out=inner)
+        return blend_in_place(arr, smooth, factor)
+    return apply
+
+
+@register_numpy_operation("grayscale")
+def _grayscale():
+    def apply(arr, workspace):
+        return arr if arr.shape[2] == 1 else luma(arr)
+    return apply
+
+
+@register_numpy_operation("convert")
+def _convert(mode):
+    if mode not in SUPPORTED_MODES:
+        return None
+
+    def apply(arr, workspace):
+        if mode == "L":
+            return arr if arr.shape[2] == 1 else luma(arr)
+        return arr if arr.shape[2] == 3 else np.repeat(arr, 3, axis=2)
+    return apply
+
+
+@register_numpy_operation("invert")
+def _invert():
+    def apply(arr, workspace):
+        np.subtract(255, arr, out=arr)
+        return arr
+    return apply
+
+
+@register_numpy_operation("find_edges")
+def _find_edges():
+    def apply(arr, workspace):
+        if arr.shape[0] < 3 or arr.shape[1] < 3:
+            return arr
+        # 縁の画素はPILと同様にフィルタを適用しない（カーネル: 周囲-1・中心8）
+        source = workspace.scratch(arr.shape)
+        source[...] = arr
+        inner = arr[1:-1, 1:-1]
+        _neighbour_sum(source, inner)
+        inner *= -1
+        inner += source[1:-1, 1:-1] * 8
+        np.clip(inner, 0, 255, out=inner)
+        return arr
+    return apply
+
+
+def gaussian_box_radius(radius, passes=3):
+    """
+    ガウスぼかしを近似する拡張ボックスぼかしの半径を求める（PILと同じ計算式）
+
+    Args:
+        radius (float): ガウスぼかしの半径（標準偏差）
+        passes (int): ボックスぼかしの適用回数
+
+    Returns:
+        float: 小数部を含むボックスぼかしの半径
+    """
+    # PILは単精度浮動小数点で計算するため、同じ精度で計算する
+    f = np.float32
+    sigma2 = f(radius) * f(radius) / f(passes)
+    length = f(math.sqrt(12.0 * float(sigma2) + 1.0))
+    l = f(math.floor((float(length) - 1.0) / 2.0))
+    a = (f(2) * l + f(1)) * (l * (l + f(1)) - f(3) * sigma2)
+    a /= f(6) * (sigma2 - (l + f(1)) * (l + f(1)))
+    return float(l + a)
+
+
+def _box_blur_lines(lines, whole, inner_weight, edge_weight):
+    """先頭の軸に沿って拡張ボックスぼかしをその場で適用する（box_blur_axisの下請け）"""
+    size = lines.shape[0]
+    pad = whole + 1
+    source = lines.astype(np.uint32)
+    padded = np.concatenate([
+        np.repeat(source[:1], pad, axis=0),
+        source,
+        np.repeat(source[-1:], pad, axis=0),
+    ])
+
+    # 窓 [i - whole, i + whole] の合計と、窓の両端の外側1画素
+    # （窓が小さい場合は累積和よりも直接足し合わせる方が速い）
+    if whole <= DIRECT_SUM_MAX_RADIUS:
+        window = padded[1:1 + size].copy()
+        for offset in range(2, 2 * whole + 2):
+            window += padded[offset:offset + size]
+    else:
+        cumulative = np.zeros((padded.shape[0] + 1,) + padded.shape[1:], dtype=np.uint32)
+        np.cumsum(padded, axis=0, out=cumulative[1:])
+        window = cumulative[2 * pad:2 * pad + size] - cumulative[1:1 + size]
+    window *= inner_weight
+    if edge_weight:
+        far = padded[:size] + padded[2 * pad:2 * pad + size]
+        far *= edge_weight
+        window += far
+    window += 1 << 23
+    window >>= 24
+    lines[...] = window
+
+
+def box_blur_axis(arr, radius, axis, block_size=256):
+    """
+    小数半径の拡張ボックスぼかしを1軸方向にその場で適用する
+
+    累積和で窓内の合計を求めるため、半径に関わらず1画素あたりの計算量は一定です。
+    画像の外側は端の画素を延長して扱い、重みと丸めはPILの24ビット固定小数点演算に合わせます。
+    作業用メモリを抑えるため、ぼかさない方向にblock_size単位で分割して処理します。
+
+    Args:
+        arr (numpy.ndarray): 整数値を保持するfloat32配列（その場で書き換える）
+        radius (float): ボックスぼかしの半径
+        axis (int): ぼかす軸（0: 縦、1: 横）
+        block_size (int): 一度に処理する行数または列数
+
+    Returns:
+        numpy.ndarray: ぼかした配列
+    """
+    if radius <= 0:
+        return arr
+    whole = int(radius)
+
+    # 窓内の画素の重みと、窓の両端の外側1画素の重み（小数部）
+    # （PILは単精度浮動小数点で割り算するため、同じ精度で計算する）
+    inner_weight = int(np.float32(1 << 24) / np.float32(radius * 2 + 1))
+    edge_weight = max(0, (1 << 24) - (whole * 2 + 1) * inner_weight) // 2
+
+    lines = np.moveaxis(arr, axis, 0)
+    for start in range(0, lines.shape[1], block_size):
+        _box_blur_lines(lines[:, start:start + block_size], whole, inner_weight, edge_weight)
+    return arr
+
+
+@register_numpy_operation("gaussian_blur")
+def _gaussian_blur(radius, passes=3):
+    box_radius = gaussian_box_radius(radius, passes)
+
+    def apply(arr, workspace):
+        # PILと同様に横方向→縦方向の順に適用する
+        for axis in (1, 0):
+            for _ in range(passes):
+                box_blur_axis(arr, box_radius, axis)
+        return arr
+    return apply
+
+
+@register_numpy_operation("blur")
+def _blur(radius, method="auto"):
+    # 縮小してぼかす方式はNumPy版がないため、PILのガウスぼかしをそのまま使う場合のみ対応する
+    if not is_pil_blur(radius, method):
+        return None
+    return _gaussian_blur(radius)
+
+
+def nearest_indices(src_size, dst_size):
+    """
+    PILの最近傍法のリサイズで出力の各画素が参照する入力の画素位置を求める
+
+    PILは出力の画素ごとに倍精度の刻み幅を順に足し込んで参照位置を求めるため、
+    掛け算で求めると割り切れないサイズで丸めの結果がずれる。同じ順序で累積して一致させる。
+
+    Args:
+        src_size (int): 入力の画素数
+        dst_size (int): 出力の画素数
+
+    Returns:
+        numpy.ndarray: 出力の各画素が参照する入力の画素位置
+    """
+    scale = np.float64(src_size) / dst_size
+    steps = np.full(dst_size, scale)
+    steps[0] = scale * 0.5
+    # np.cumsumは先頭から順に加算するため、PILの足し込みと同じ丸めになる
+    return np.minimum(np.cumsum(steps).astype(np.intp), src_size - 1)
+
+
+@register_numpy_operation("pixelate")
+def _pixelate(factor):
+    def apply(arr, workspace):
+        height, width = arr.shape[:2]
+        small_height, small_width = max(1, height // factor), max(1, width // factor)
+        # 最近傍法の縮小→拡大を、元画像からの1回の参照に合成する
+        rows = nearest_indices(height, small_height)[nearest_indices(small_height, height)]
+        cols = nearest_indices(width, small_width)[nearest_indices(small_width, width)]
+        return arr[rows[:, np.newaxis], cols[np.newaxis, :]]
+    return apply
+
+
+def compile_numpy_pipeline(ops) -> Optional[Callable[[Image.Image], Image.Image]]:
+    """
+    スタイル定義のオペレーション列をNumPyパイプラインにコンパイルする
+
+    Args:
+        ops (list): オペレーション定義（{"op": 名前, ...パラメータ}）のリスト
+
+    Returns:
+        callable: PIL画像（RGBまたはL）を受け取り変換後のPIL画像を返す関数
+                  （NumPy版がないオペレーションを含む場合はNone）
+    """
+    steps = []
+    for op in ops:
+        factory = NUMPY_OPERATIONS.get(op["op"])
+        if factory is None:
+            return None
+        step = factory(**{k: v for k, v in op.items() if k != "op"})
+        if step is None:
+            return None
+        steps.append(step)
+    steps = tuple(steps)
+
+    def run(img):
+        arr = image_to_array(img)
+        workspace = Workspace()
+        for step in steps:
+            arr = step(arr, workspace)
+        return array_to_image(arr)
+
+    return run
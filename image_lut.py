@@ -0,0 +1,218 @@
+import logging
+from functools import lru_cache
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from image_kernels import blend_in_place
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_lut")
+
+# チャンネルごとに独立した画素単位のオペレーション（1次元LUTに畳み込める）
+CHANNEL_OPS = ("contrast", "brightness", "invert")
+
+# 画素単位のオペレーション（色の強調はルマ値とチャンネル値の2次元LUTに畳み込める）
+POINT_OPS = CHANNEL_OPS + ("color",)
+
+# LUTで処理できる画像モード
+LUT_MODES = ("RGB", "L")
+
+# 各オペレーションのブレンド先（Noneはコントラストの平均輝度）
+_DEGENERATE = {"brightness": 0.0, "contrast": None}
+
+
+def _op_key(op):
+    """オペレーション定義をキャッシュ用のキー (名前, 係数) に変換する"""
+    return op["op"], float(op.get("factor", 0.0))
+
+
+def _apply_channel_op(values, key, mean):
+    """1チャンネル分の値の配列（float32）に画素単位のオペレーションをその場で適用する"""
+    name, factor = key
+    if name == "invert":
+        np.subtract(255, values, out=values)
+        return values
+    degenerate = _DEGENERATE[name]
+    return blend_in_place(values, float(mean) if degenerate is None else degenerate, factor)
+
+
+@lru_cache(maxsize=1024)
+def channel_lut(chain: Tuple, means: Tuple) -> np.ndarray:
+    """
+    チャンネル単位のオペレーション列を256要素のLUTに畳み込む
+
+    Args:
+        chain (tuple): (名前, 係数) のタプル
+        means (tuple): 各オペレーションで使用する平均輝度（コントラスト以外はNone）
+
+    Returns:
+        numpy.ndarray: uint8のLUT
+    """
+    values = np.arange(256, dtype=np.float32)
+    for key, mean in zip(chain, means):
+        _apply_channel_op(values, key, mean)
+    return values.astype(np.uint8)
+
+
+@lru_cache(maxsize=256)
+def color_lut(factor: float, chain: Tuple) -> np.ndarray:
+    """
+    色の強調とその後のチャンネル単位のオペレーション列を2次元LUTに畳み込む
+
+    色の強調は画素のルマ値とチャンネル値だけで決まるため、
+    [ルマ値 * 256 + チャンネル値] で引ける65536要素のLUTで正確に表現できます。
+
+    Args:
+        factor (float): 色の強調の係数
+        chain (tuple): 後続のオペレーションの (名前, 係数) のタプル（コントラストを除く）
+
+    Returns:
+        numpy.ndarray: uint8のLUT（65536要素）
+    """
+    values = np.tile(np.arange(256, dtype=np.float32), (256, 1))
+    blend_in_place(values, np.arange(256, dtype=np.float32)[:, np.newaxis], factor)
+    table = values.astype(np.uint8)
+    if chain:
+        table = channel_lut(chain, (None,) * len(chain))[table]
+    return table.ravel()
+
+
+def histogram_mean(histogram):
+    """ヒストグラムから平均輝度をPILのImageStatと同じ丸めで求める"""
+    mean = sum(value * count for value, count in enumerate(histogram)) / sum(histogram)
+    return int(mean + 0.5)
+
+
+class FusedPointStage:
+    """
+    連続する画素単位のオペレーションを1回の画素走査にまとめた処理段
+
+    色の強調の前のチャンネル単位のオペレーションは1次元LUT（Image.point）に、
+    色の強調とその後のオペレーションは2次元LUTに畳み込みます。
+    LUTはオペレーションの係数と平均輝度をキーにキャッシュされます。
+
+    コントラストの平均輝度は処理段の入力画像から求める必要があるため、
+    コントラストは処理段の先頭にのみ置けます（compile_lut_pipelineが分割します）。
+    そのためPILの逐次処理と同じ結果になります。
+
+    コントラスト→色の強調（油絵風）と色の強調→コントラスト（ポップアート）は1回の走査に融合せず、
+    それぞれ2回の走査のままとしています。前者は色の強調にコントラスト後のルマ値が、
+    後者はコントラストに色の強調後の平均輝度が必要なため、融合しても中間のルマ値の計算は残り、
+    2次元LUTをNumPyで引く方がPILの1次元LUTとブレンドの2回の走査より遅くなります。
+
+    Attributes:
+        pre (tuple): 色の強調の前のオペレーション
+        color (float): 色の強調の係数（含まない場合はNone）
+        post (tuple): 色の強調の後のオペレーション
+    """
+
+    def __init__(self, ops, fallback_steps):
+        """
+        FusedPointStageクラスの初期化
+
+        Args:
+            ops (list): 画素単位のオペレーション定義（色の強調は1つまで、コントラストは先頭のみ）
+            fallback_steps (tuple): LUTで処理できない画像モード用のPILの処理関数
+        """
+        keys = [_op_key(op) for op in ops]
+        color_index = next((i for i, key in enumerate(keys) if key[0] == "color"), None)
+        if color_index is None:
+            self.pre, self.color, self.post = tuple(keys), None, ()
+        else:
+            self.pre = tuple(keys[:color_index])
+            self.color = keys[color_index][1]
+            self.post = tuple(keys[color_index + 1:])
+        self.fallback_steps = tuple(fallback_steps)
+
+    def __call__(self, img):
+        if img.mode not in LUT_MODES:
+            for step in self.fallback_steps:
+                img = step(img)
+            return img
+        if img.mode == "L":
+            # 色の強調は恒等変換のため、すべてを1つのLUTにまとめる
+            chain = self.pre + self.post
+            return img.point(channel_lut(chain, self._means(chain, img)).tolist())
+        return self._apply_rgb(img)
+
+    @staticmethod
+    def _means(chain, img):
+        """各オペレーションで使用する平均輝度を返す（コントラスト以外はNone）"""
+        means = [None] * len(chain)
+        if chain and chain[0][0] == "contrast":
+            gray = img if img.mode == "L" else img.convert("L")
+            means[0] = histogram_mean(gray.histogram())
+        return tuple(means)
+
+    def _apply_rgb(self, img):
+        """RGBモード: 1次元LUT→2次元LUTの順に適用する"""
+        if self.pre:
+            img = img.point(channel_lut(self.pre, self._means(self.pre, img)).tolist() * 3)
+
+        if self.color is None:
+            return img
+        if not self.post:
+            # 色の強調のみの場合はPILのブレンドの方が速い
+            return ImageEnhance.Color(img).enhance(self.color)
+
+        table = color_lut(self.color, self.post)
+        index = np.asarray(img).astype(np.uint16)
+        index |= (np.asarray(img.convert("L")).astype(np.uint16) << 8)[..., np.newaxis]
+        return Image.fromarray(table[index])
+
+
+def group_point_ops(ops) -> List[List[int]]:
+    """
+    オペレーション列を処理段ごとのインデックスのリストに分割する
+
+    連続する画素単位のオペレーションは1つの処理段にまとめ、それ以外は1つずつの処理段とします。
+    コントラストは平均輝度を入力画像から求めるため、新しい処理段の先頭に置きます。
+    色の強調は1つの処理段に1つまでとします。
+
+    Args:
+        ops (list): オペレーション定義のリスト
+
+    Returns:
+        list: 処理段ごとのオペレーションのインデックスのリスト
+    """
+    groups: List[List[int]] = []
+    group: List[int] = []
+    for index, op in enumerate(ops):
+        if op["op"] not in POINT_OPS:
+            if group:
+                groups.append(group)
+                group = []
+            groups.append([index])
+            continue
+        if group and (op["op"] == "contrast" or (op["op"] == "color" and any(ops[i]["op"] == "color" for i in group))):
+            groups.append(group)
+            group = []
+        group.append(index)
+    if group:
+        groups.append(group)
+    return groups
+
+
+def compile_lut_pipeline(ops, steps) -> Tuple[Callable[[Image.Image], Image.Image], ...]:
+    """
+    オペレーション列の連続する画素単位のオペレーションをLUTの処理段にまとめる
+
+    色の強調のみの処理段は融合しても速くならないため、元の処理関数のまま残します。
+
+    Args:
+        ops (list): オペレーション定義のリスト
+        steps (tuple): opsに対応するPILの処理関数
+
+    Returns:
+        tuple: 処理関数のタプル
+    """
+    compiled = []
+    for group in group_point_ops(ops):
+        if ops[group[0]]["op"] not in POINT_OPS or (len(group) == 1 and ops[group[0]]["op"] == "color"):
+            compiled.append(steps[group[0]])
+        else:
+            compiled.append(FusedPointStage([ops[i] for i in group], [steps[i] for i in group]))
+    return tuple(compiled)
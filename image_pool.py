@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_pool")
+
+# 画像処理プールのワーカー数（0の場合はCPUコア数）
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", 0))
+
+# 実行待ちを含めて受け付ける処理数の上限（ワーカー数に対する倍率）
+IMAGE_POOL_QUEUE_FACTOR = 4
+
+# 待ち時間がこの秒数を超えた場合に警告を記録する
+QUEUE_WAIT_WARNING_SECONDS = 2.0
+
+# 待ち時間の統計に使う直近の件数
+QUEUE_WAIT_SAMPLES = 1024
+
+
+def gil_disabled() -> bool:
+    """
+    GILを無効にしたPython（free-threadedビルド）で実行中かどうかを返す
+
+    Returns:
+        bool: GILが無効の場合はTrue
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def _percentile(values, ratio):
+    """ソート済みのリストから百分位数を返す"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class ImagePool:
+    """
+    全セッションで共有する、並列数を制限した画像処理用のスレッドプール
+
+    PillowとNumPyは画素処理やエンコードの間GILを解放するため、CPUコア数のスレッドで
+    複数セッションの画像処理を並行して実行できます。GILを無効にしたPythonでは
+    Pythonコードの部分も並列に動くため、プロセスプールの代わりにも使えます。
+
+    実行待ちを含めて受け付ける処理数に上限を設け、上限に達した場合は空きが出るまで
+    投入側を待たせます（先読みなど省略できる処理は block=False で投入を諦めます）。
+    ワーカー内から投入された処理はその場で実行し、ワーカー同士の待ち合わせによる
+    デッドロックを防ぎます。
+
+    Attributes:
+        workers (int): ワーカー数
+        max_pending (int): 実行待ちを含めて受け付ける処理数の上限
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        """
+        ImagePoolクラスの初期化
+
+        Args:
+            workers (int, optional): ワーカー数（省略時はCPUコア数）
+            max_pending (int, optional): 実行待ちを含めて受け付ける処理数の上限（省略時はワーカー数の4倍）
+        """
+        self.workers = workers or IMAGE_POOL_WORKERS or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * IMAGE_POOL_QUEUE_FACTOR
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+        self._pending = 0
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, block=True, **kwargs) -> Optional[Future]:
+        """
+        画像処理を投入する
+
+        Args:
+            fn (callable): 実行する関数
+            *args: 関数の引数
+            block (bool): 受付数の上限に達している場合に空きを待つかどうか
+            **kwargs: 関数のキーワード引数
+
+        Returns:
+            Future: 実行結果のFuture（block=False で上限に達していた場合はNone）
+        """
+        if getattr(self._local, "worker", False):
+            # ワーカー内からの投入はその場で実行する
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        # 受付枠の空きを待つ時間も実行待ち時間に含める
+        queued_at = time.perf_counter()
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.rejected += 1
+            return None
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._executor.submit(self._run, queued_at, fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+
+    def _run(self, queued_at, fn, args, kwargs):
+        """ワーカーで処理を実行し、実行開始までの待ち時間を記録する"""
+        wait = time.perf_counter() - queued_at
+        with self._lock:
+            self._waits.append(wait)
+            self._running += 1
+        if wait > QUEUE_WAIT_WARNING_SECONDS:
+            logger.warning(f"画像処理の実行待ちが{wait:.1f}秒かかりました（ワーカー数: {self.workers}）")
+        self._local.worker = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._local.worker = False
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+            self._release()
+
+    def _release(self):
+        """受付枠を1つ返す"""
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """
+        プールの状態と実行待ち時間の統計を返す
+
+        Returns:
+            dict: ワーカー数・実行中・実行待ちの件数と待ち時間（秒）の中央値・95パーセンタイル・最大値
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_p50": _percentile(waits, 0.5),
+                "wait_p95": _percentile(waits, 0.95),
+                "wait_max": waits[-1] if waits else 0.0,
+                "gil_disabled": gil_disabled(),
+            }
+
+    def shutdown(self, wait=True):
+        """
+        プールを停止する
+
+        Args:
+            wait (bool): 実行中の処理の完了を待つかどうか
+        """
+        self._executor.shutdown(wait=wait)
+
+
+_pool: Optional[ImagePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_image_pool() -> ImagePool:
+    """
+    プロセス内で共有する画像処理プールを返す
+
+    Returns:
+        ImagePool: 画像処理プール
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ImagePool()
+                logger.info(
+                    f"画像処理プールを作成しました: {_pool.workers}ワーカー"
+                    + ("（GIL無効）" if gil_disabled() else "")
+                )
+    return _pool
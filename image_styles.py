@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps, ImageEnhance, ImageFilter
+
+from image_blur import fast_blur, glow
+from image_cartoon import cartoonize
+from image_kernels import SUPPORTED_MODES as NUMPY_SUPPORTED_MODES, compile_numpy_pipeline
+from image_kuwahara import kuwahara
+from image_lut import compile_lut_pipeline
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_styles")
+
+# スタイル定義ファイルのパス
+RECIPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "style_recipes.json")
+
+# 既定の画像処理エンジン（"pil"、"lut" または "numpy"）。スタイル定義の "engine" で個別に指定可能
+DEFAULT_ENGINE = os.getenv("IMAGE_KERNEL_ENGINE", "lut")
+
+# 文の区切りを判定する正規表現
+SENTENCE_SPLIT_PATTERN = re.compile(r'[。.!?]')
+
+# 画像処理オペレーションのファクトリ（オペレーション名 -> パラメータから処理関数を作る関数）
+OPERATIONS: Dict[str, Callable[..., Callable[[Image.Image], Image.Image]]] = {}
+
+
+def register_operation(name):
+    """
+    スタイル定義から参照できる画像処理オペレーションを登録するデコレーター
+
+    Args:
+        name (str): スタイル定義の "op" に指定する名前
+
+    Returns:
+        callable: デコレーター
+    """
+    def decorator(factory):
+        OPERATIONS[name] = factory
+        return factory
+    return decorator
+
+
+@register_operation("color")
+def _color(factor):
+    return lambda img: ImageEnhance.Color(img).enhance(factor)
+
+
+@register_operation("contrast")
+def _contrast(factor):
+    return lambda img: ImageEnhance.Contrast(img).enhance(factor)
+
+
+@register_operation("brightness")
+def _brightness(factor):
+    return lambda img: ImageEnhance.Brightness(img).enhance(factor)
+
+
+@register_operation("sharpness")
+def _sharpness(factor):
+    return lambda img: ImageEnhance.Sharpness(img).enhance(factor)
+
+
+@register_operation("grayscale")
+def _grayscale():
+    return ImageOps.grayscale
+
+
+@register_operation("convert")
+def _convert(mode):
+    return lambda img: img.convert(mode)
+
+
+@register_operation("invert")
+def _invert():
+    return ImageOps.invert
+
+
+@register_operation("find_edges")
+def _find_edges():
+    return lambda img: img.filter(ImageFilter.FIND_EDGES)
+
+
+@register_operation("gaussian_blur")
+def _gaussian_blur(radius):
+    image_filter = ImageFilter.GaussianBlur(radius=radius)
+    return lambda img: img.filter(image_filter)
+
+
+@register_operation("blur")
+def _blur(radius, method="auto"):
+    return lambda img: fast_blur(img, radius, method)
+
+
+@register_operation("glow")
+def _glow(**params):
+    return lambda img: glow(img, **params)
+
+
+@register_operation("kuwahara")
+def _kuwahara(**params):
+    return lambda img: kuwahara(img, **params)
+
+
+@register_operation("pixelate")
+def _pixelate(factor):
+    def apply(img):
+        # 画像サイズを縮小してからリサイズして荒くする
+        small_size = (max(1, img.width // factor), max(1, img.height // factor))
+        return img.resize(small_size, Image.NEAREST).resize((img.width, img.height), Image.NEAREST)
+    return apply
+
+
+@register_operation("cartoon")
+def _cartoon(**params):
+    return lambda img: cartoonize(img, **params)
+
+
+# 画像のサイズに比例させるパラメータ（縮小画像で処理する場合に倍率を掛ける）
+SPATIAL_PARAMS = {
+    "gaussian_blur": "radius",
+    "blur": "radius",
+    "glow": "radius",
+    "kuwahara": "radius",
+    "pixelate": "factor",
+}
+
+
+def scale_ops(ops, scale):
+    """
+    縮小画像でも元の画像と同じ見た目になるよう、サイズに比例するパラメータを倍率に合わせる
+
+    Args:
+        ops (list): オペレーション定義のリスト
+        scale (float): 元の画像に対する縮小画像の倍率
+
+    Returns:
+        list: パラメータを調整したオペレーション定義のリスト
+    """
+    scaled = []
+    for op in ops:
+        param = SPATIAL_PARAMS.get(op["op"])
+        if param is not None and param in op:
+            value = op[param] * scale
+            op = {**op, param: max(1, round(value)) if isinstance(op[param], int) else value}
+        scaled.append(op)
+    return scaled
+
+
+def canonical_op(op) -> str:
+    """
+    オペレーション定義を、同じ処理結果になるもの同士で一致する文字列キーに変換する
+
+    Args:
+        op (dict): オペレーション定義
+
+    Returns:
+        str: オペレーションのキー
+    """
+    if op["op"] == "grayscale":
+        # ImageOps.grayscale は convert("L") と同じ処理
+        op = {"op": "convert", "mode": "L"}
+    return json.dumps(op, ensure_ascii=False, sort_keys=True)
+
+
+def compile_op(op, style=None):
+    """
+    オペレーション定義をPILの処理関数に変換する
+
+    Args:
+        op (dict): オペレーション定義（{"op": 名前, ...パラメータ}）
+        style (str, optional): エラーメッセージに含めるスタイル名
+
+    Returns:
+        callable: PIL画像を受け取り変換後のPIL画像を返す関数
+    """
+    params = {k: v for k, v in op.items() if k != "op"}
+    factory = OPERATIONS.get(op["op"])
+    if factory is None:
+        raise ValueError(f"未知の画像処理オペレーションです: {op['op']}（スタイル: {style}）")
+    return factory(**params)
+
+
+def compile_pipeline(ops, engine=None) -> Tuple[Callable[[Image.Image], Image.Image], ...]:
+    """
+    オペレーション列を処理関数のタプルにコンパイルする（スタイルの一部だけを実行する場合に使用）
+
+    Args:
+        ops (list): オペレーション定義のリスト
+        engine (str, optional): 画像処理エンジン（"pil" または "lut"。省略時は既定値）
+
+    Returns:
+        tuple: 処理関数のタプル
+    """
+    steps = tuple(compile_op(op) for op in ops)
+    if (engine or DEFAULT_ENGINE) == "lut":
+        return compile_lut_pipeline(ops, steps)
+    return steps
+
+
+class StyleRecipe:
+    """
+    コンパイル済みのスタイル定義
+
+    スタイル定義（JSON）の画像処理オペレーション列を処理関数のタプルに、
+    検証用キーワードを小文字化済みのタプルに変換して保持します。
+
+    Attributes:
+        name (str): スタイル名
+        version (int): スタイル定義のバージョン
+        prompt (str): 変換プロンプトのテンプレート
+        ops (list): 画像処理オペレーションの定義
+        generation (dict): 生成プロファイル別の上書き設定
+        engine (str): このスタイルで使用する画像処理エンジン（未指定の場合はNone）
+        fingerprint (str): スタイル定義の内容から計算したハッシュ値
+    """
+
+    def __init__(self, recipe, keyword_sets, validation_defaults):
+        """
+        StyleRecipeクラスの初期化
+
+        Args:
+            recipe (dict): スタイル定義
+            keyword_sets (dict): 名前付きの検証キーワードリスト
+            validation_defaults (dict): 検証設定の既定値
+        """
+        self.name = recipe["name"]
+        self.version = recipe.get("version", 1)
+        self.prompt = recipe["prompt"]
+        self.ops = recipe.get("ops", [])
+        self.generation = recipe.get("generation", {})
+        self.engine = recipe.get("engine")
+        self.fingerprint = hashlib.sha1(
+            json.dumps(recipe, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+
+        # 画像処理パイプラインのコンパイル（NumPy版はすべてのオペレーションに実装がある場合のみ）
+        self.pipeline = tuple(compile_op(op, self.name) for op in self.ops)
+        self.lut_pipeline = compile_lut_pipeline(self.ops, self.pipeline)
+        self.numpy_pipeline = compile_numpy_pipeline(self.ops)
+
+        # 検証設定のコンパイル
+        validation = {**validation_defaults, **recipe.get("validation", {})}
+        self.min_length = validation["min_length"]
+        self.min_keywords = validation["min_keywords"]
+        self.min_sentences = validation["min_sentences"]
+        self.require_style_mention = validation["require_style_mention"]
+        self.style_keywords = tuple(k.lower() for k in validation.get("style_keywords", [self.name]))
+        keywords = validation.get("keywords") or keyword_sets[validation["keyword_set"]]
+        self.keywords = tuple(keywords)
+
+    def apply(self, img, engine=None):
+        """
+        画像にスタイルを適用する
+
+        LUTエンジンは連続する画素単位のオペレーションを1回のLUT適用にまとめて処理します。
+        NumPyエンジンは単一の配列をその場で書き換えて処理します。
+        NumPy版がない場合や画像モードが対象外の場合はPILで処理します。
+
+        Args:
+            img (PIL.Image): 入力画像
+            engine (str, optional): 画像処理エンジン（"pil"、"lut" または "numpy"）
+
+        Returns:
+            PIL.Image: 変換後の画像
+        """
+        engine = engine or self.engine or DEFAULT_ENGINE
+        if engine == "numpy" and self.numpy_pipeline is not None and img.mode in NUMPY_SUPPORTED_MODES:
+            return self.numpy_pipeline(img)
+
+        for step in (self.lut_pipeline if engine == "lut" else self.pipeline):
+            img = step(img)
+        return img
+
+    def build_prompt(self, custom_instruction=None):
+        """
+        変換プロンプトを生成する
+
+        Args:
+            custom_instruction (str, optional): カスタム指示
+
+        Returns:
+            str: 画像変換のためのプロンプト
+        """
+        if custom_instruction:
+            return f"{self.prompt} 追加指示: {custom_instruction}"
+        return self.prompt
+
+    def validate(self, response, style_keywords=None):
+        """
+        Geminiの応答が適切な画像変換の説明を含んでいるかを確認する
+
+        Args:
+            response (str): Geminiからの応答テキスト
+            style_keywords (tuple, optional): スタイル名として扱うキーワード（省略時は定義の値）
+
+        Returns:
+            bool: 応答が適切な画像変換の説明を含んでいる場合はTrue
+        """
+        # 応答がない場合は無効
+        if not response or len(response) < self.min_length:
+            return False
+
+        # スタイル名が含まれているか確認
+        if self.require_style_mention:
+            lowered = response.lower()
+            if not any(keyword in lowered for keyword in (style_keywords or self.style_keywords)):
+                return False
+
+        # 説明に関するキーワードが一定数含まれているか確認
+        keyword_count = sum(1 for keyword in self.keywords if keyword in response)
+        if keyword_count < self.min_keywords:
+            return False
+
+        # 詳細な説明が含まれているか（文の数で判断）
+        return len(SENTENCE_SPLIT_PATTERN.split(response)) >= self.min_sentences
+
+
+class StyleRegistry:
+    """
+    スタイル定義を読み込み、コンパイル済みのスタイルを提供するクラス
+
+    スタイルの追加はスタイル定義ファイル（style_recipes.json）の編集のみで行えます。
+
+    Attributes:
+        path (str): スタイル定義ファイルのパス
+    """
+
+    def __init__(self, path=RECIPES_PATH):
+        """
+        StyleRegistryクラスの初期化
+
+        Args:
+            path (str): スタイル定義ファイルのパス
+        """
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        keyword_sets = data.get("keyword_sets", {})
+        validation_defaults = data["validation_defaults"]
+        self._styles = {}
+        for recipe in data["styles"]:
+            self._styles[recipe["name"]] = StyleRecipe(recipe, keyword_sets, validation_defaults)
+        self.fallback = StyleRecipe(data["fallback"], keyword_sets, validation_defaults)
+        logger.info(f"スタイル定義を読み込みました: {len(self._styles)}件")
+
+    def style_names(self) -> List[str]:
+        """
+        定義されているスタイル名を定義順に返す
+
+        Returns:
+            list: スタイル名のリスト
+        """
+        return list(self._styles)
+
+    def get(self, style) -> StyleRecipe:
+        """
+        スタイル名に対応するコンパイル済みのスタイルを返す
+
+        Args:
+            style (str): スタイル名
+
+        Returns:
+            StyleRecipe: スタイル（未定義の場合はフォールバック）
+        """
+        return self._styles.get(style, self.fallback)
+
+    def validate(self, response, style):
+        """
+        Geminiの応答がスタイルの検証条件を満たすかを確認する
+
+        Args:
+            response (str): Geminiからの応答テキスト
+            style (str): スタイル名
+
+        Returns:
+            bool: 応答が適切な画像変換の説明を含んでいる場合はTrue
+        """
+        recipe = self._styles.get(style)
+        if recipe is None:
+            return self.fallback.validate(response, style_keywords=(style.lower(),))
+        return recipe.validate(response)
+
+    def generation_overrides(self) -> Dict[str, Dict]:
+        """
+        スタイル・生成プロファイル別の上書き設定を返す
+
+        Returns:
+            dict: {スタイル名: {プロファイル名: 設定}}
+        """
+        return {name: recipe.generation for name, recipe in self._styles.items() if recipe.generation}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_style_registry() -> StyleRegistry:
+    """
+    プロセス内で共有するスタイルレジストリを返す（初回呼び出し時に一度だけコンパイル）
+
+    Returns:
+        StyleRegistry: スタイルレジストリ
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = StyleRegistry()
+    return _registry
@@ -0,0 +1,638 @@
+import io
+import os
+import math
+import zlib
+import struct
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from image_blur import is_pil_blur
+from image_encoder import choose_format, extension_for, get_encoder_settings, save_options
+from image_kuwahara import DEFAULT_KUWAHARA_RADIUS
+from image_lut import channel_lut, histogram_mean
+from image_styles import compile_op, compile_pipeline
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("image_tiling")
+
+# 帯状分割で処理する画像の最小画素数（これより小さい画像は一括で処理する）
+TILE_MIN_PIXELS = int(os.getenv("IMAGE_TILE_MIN_PIXELS", 16 * 1000 * 1000))
+
+# 1つの帯の高さ（出力の行数）
+STRIP_HEIGHT = int(os.getenv("IMAGE_TILE_STRIP_HEIGHT", 256))
+
+# 帯状分割の処理オペレーションのファクトリ（オペレーション名 -> (オペレーション定義, 画像サイズ) から TileOp を作る関数）
+TILE_OPERATIONS: Dict[str, Callable[[dict, Tuple[int, int]], "TileOp"]] = {}
+
+# パラメータによっては帯状分割で処理できないオペレーションの判定関数（オペレーション名 -> オペレーション定義から可否を返す関数）
+TILE_CONDITIONS: Dict[str, Callable[[dict], bool]] = {}
+
+# PNGのカラータイプ（画像モードごと）
+_PNG_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}
+
+
+def register_tile_operation(name, condition=None):
+    """
+    帯状分割で処理できるオペレーションを登録するデコレーター
+
+    Args:
+        name (str): スタイル定義の "op" に対応する名前
+        condition (callable, optional): オペレーション定義を受け取り、帯状分割で処理できるかを返す関数
+                                        （省略時はパラメータに関わらず処理できる）
+
+    Returns:
+        callable: デコレーター
+    """
+    def decorator(factory):
+        TILE_OPERATIONS[name] = factory
+        if condition is not None:
+            TILE_CONDITIONS[name] = condition
+        return factory
+    return decorator
+
+
+class TileOp:
+    """
+    帯（全幅・一部の行）単位で実行するオペレーション
+
+    近傍を参照するオペレーションは上下に halo 行の余白を付けた帯で処理し、
+    余白を切り落とすことで一括処理と同じ結果になります。
+
+    Attributes:
+        step (callable): PIL画像を受け取り変換後のPIL画像を返す関数
+        halo (int): 上下に必要な余白の行数
+        height (int): 画像全体の高さ
+    """
+
+    def __init__(self, step, halo, height):
+        """
+        TileOpクラスの初期化
+
+        Args:
+            step (callable): PIL画像を受け取り変換後のPIL画像を返す関数
+            halo (int): 上下に必要な余白の行数
+            height (int): 画像全体の高さ
+        """
+        self.step = step
+        self.halo = halo
+        self.height = height
+
+    def input_rows(self, y0, y1) -> Tuple[int, int]:
+        """
+        出力の行範囲 [y0, y1) の計算に必要な入力の行範囲を返す
+
+        Args:
+            y0 (int): 出力の開始行
+            y1 (int): 出力の終了行（この行を含まない）
+
+        Returns:
+            tuple: 入力の (開始行, 終了行)
+        """
+        return max(0, y0 - self.halo), min(self.height, y1 + self.halo)
+
+    def apply(self, strip, top, y0, y1):
+        """
+        入力の帯を処理し、出力の行範囲 [y0, y1) を返す
+
+        Args:
+            strip (PIL.Image): input_rows(y0, y1) の範囲の入力の帯
+            top (int): 入力の帯の開始行
+            y0 (int): 出力の開始行
+            y1 (int): 出力の終了行
+
+        Returns:
+            PIL.Image: 出力の帯
+        """
+        result = self.step(strip)
+        if y0 == top and y1 - y0 == result.height:
+            return result
+        return result.crop((0, y0 - top, result.width, y1 - top))
+
+
+class RemapTileOp(TileOp):
+    """
+    画素の並べ替えだけで表せるオペレーション（最近傍法による拡大縮小など）
+
+    出力の各行・各列がどの入力の行・列から来るかを対応表として持ち、帯ごとに並べ替えます。
+
+    Attributes:
+        rows (numpy.ndarray): 出力の行ごとの入力の行
+        columns (numpy.ndarray): 出力の列ごとの入力の列
+    """
+
+    def __init__(self, rows, columns):
+        """
+        RemapTileOpクラスの初期化
+
+        Args:
+            rows (numpy.ndarray): 出力の行ごとの入力の行
+            columns (numpy.ndarray): 出力の列ごとの入力の列
+        """
+        super().__init__(None, 0, len(rows))
+        self.rows = rows
+        self.columns = columns
+
+    def input_rows(self, y0, y1):
+        return int(self.rows[y0:y1].min()), int(self.rows[y0:y1].max()) + 1
+
+    def apply(self, strip, top, y0, y1):
+        pixels = np.asarray(strip)
+        return Image.fromarray(pixels[self.rows[y0:y1] - top][:, self.columns], strip.mode)
+
+
+class ContrastTileOp(TileOp):
+    """
+    コントラストの調整（平均輝度は画像全体から求めるため、実行前に resolve で設定する）
+
+    Attributes:
+        factor (float): コントラストの係数
+        mean (int): 入力画像全体の平均輝度（未設定の場合はNone）
+    """
+
+    def __init__(self, factor, height):
+        """
+        ContrastTileOpクラスの初期化
+
+        Args:
+            factor (float): コントラストの係数
+            height (int): 画像全体の高さ
+        """
+        super().__init__(None, 0, height)
+        self.factor = float(factor)
+        self.mean = None
+
+    def resolve(self, histogram):
+        """
+        入力画像全体の輝度ヒストグラムから平均輝度を設定する
+
+        Args:
+            histogram (numpy.ndarray): 輝度ヒストグラム（256要素）
+        """
+        self.mean = histogram_mean(histogram.tolist())
+
+    def apply(self, strip, top, y0, y1):
+        # ImageEnhance.Contrastと同じ丸めのLUTで処理する
+        lut = channel_lut((("contrast", self.factor),), (self.mean,)).tolist()
+        return strip.point(lut * len(strip.getbands()))
+
+
+def _point_op(op, size):
+    return TileOp(compile_pipeline([op])[0], 0, size[1])
+
+
+for _name in ("color", "brightness", "invert", "grayscale", "convert"):
+    register_tile_operation(_name)(_point_op)
+
+
+@register_tile_operation("contrast")
+def _contrast_tile(op, size):
+    return ContrastTileOp(op["factor"], size[1])
+
+
+@register_tile_operation("find_edges")
+@register_tile_operation("sharpness")
+def _kernel3x3_tile(op, size):
+    # 3x3の畳み込み（ImageEnhance.Sharpnessも内部で3x3の平滑化を使う）
+    return TileOp(compile_op(op), 1, size[1])
+
+
+def gaussian_blur_halo(radius, passes=3):
+    """
+    PILのガウスぼかし（ボックスぼかしの繰り返し）が参照する上下の行数を求める
+
+    Args:
+        radius (float): ぼかしの半径
+        passes (int): ボックスぼかしの回数
+
+    Returns:
+        int: 必要な余白の行数
+    """
+    sigma2 = radius * radius / passes
+    length = math.sqrt(12.0 * sigma2 + 1.0)
+    box = math.floor((length - 1.0) / 2.0)
+    box += (2 * box + 1) * (box * (box + 1) - 3 * sigma2) / (6 * (sigma2 - (box + 1) * (box + 1)))
+    return passes * (int(box) + 1)
+
+
+@register_tile_operation("gaussian_blur")
+def _gaussian_blur_tile(op, size):
+    return TileOp(compile_op(op), gaussian_blur_halo(op["radius"]), size[1])
+
+
+# 縮小してぼかす方式は画像全体の縮小・拡大の格子に依存するため、PILのガウスぼかしをそのまま使う場合のみ対応する
+# （glow は画像全体の縮小ピラミッドで光を作り、cartoon は画像全体の作業用画像からパレットと輪郭線を作るため
+#   帯状分割に対応しない。これらを含むスタイル（ネオン風・アニメ風）は大きな画像も一括で処理する）
+@register_tile_operation("blur", condition=lambda op: is_pil_blur(op["radius"], op.get("method", "auto")))
+def _blur_tile(op, size):
+    return TileOp(compile_op(op), gaussian_blur_halo(op["radius"]), size[1])
+
+
+@register_tile_operation("kuwahara")
+def _kuwahara_tile(op, size):
+    # 出力の各画素は上下 radius 行以内の入力だけから決まる
+    return TileOp(compile_op(op), max(1, int(op.get("radius", DEFAULT_KUWAHARA_RADIUS))), size[1])
+
+
+@register_tile_operation("pixelate")
+def _pixelate_tile(op, size):
+    # 縦横それぞれに座標を値に持つ画像を同じ処理にかけ、画素の対応表を作る
+    step = compile_op(op)
+    width, height = size
+    factor = int(op["factor"])
+    rows = np.asarray(step(Image.fromarray(np.repeat(np.arange(height, dtype=np.int32)[:, None], factor, 1))))
+    columns = np.asarray(step(Image.fromarray(np.repeat(np.arange(width, dtype=np.int32)[None, :], factor, 0))))
+    return RemapTileOp(rows[:, 0].astype(np.intp), columns[0].astype(np.intp))
+
+
+def is_tileable(ops) -> bool:
+    """
+    オペレーション列を帯状分割で処理できるかどうかを返す
+
+    Args:
+        ops (list): オペレーション定義のリスト
+
+    Returns:
+        bool: すべてのオペレーションが帯状分割に対応している場合はTrue
+    """
+    return all(op["op"] in TILE_OPERATIONS and TILE_CONDITIONS.get(op["op"], lambda op: True)(op) for op in ops)
+
+
+def should_tile(image_data, ops, min_pixels=TILE_MIN_PIXELS) -> bool:
+    """
+    画像のヘッダーだけを読み、帯状分割で処理すべきかどうかを返す
+
+    Args:
+        image_data (bytes): 画像データ
+        ops (list): オペレーション定義のリスト
+        min_pixels (int): 帯状分割で処理する最小画素数
+
+    Returns:
+        bool: 帯状分割で処理すべき場合はTrue
+    """
+    with Image.open(io.BytesIO(image_data)) as header:
+        width, height = header.size
+    if width * height < min_pixels:
+        return False
+    if not is_tileable(ops):
+        names = sorted({op["op"] for op in ops if not is_tileable([op])})
+        logger.info(f"帯状分割に対応しないオペレーション（{', '.join(names)}）を含むため一括で処理します: {width}x{height}")
+        return False
+    return True
+
+
+class TiledPipeline:
+    """
+    スタイルのパイプラインを帯単位で実行するクラス
+
+    出力を高さ strip_height の帯に分け、帯ごとに必要な入力の行（近傍フィルタの余白を含む）だけを
+    切り出してパイプライン全体を通します。画像全体の中間画像を作らないため、
+    作業用メモリは画像サイズによらず帯の大きさで決まります。
+    コントラストの平均輝度のように画像全体の統計が必要な場合は、
+    その手前までを帯単位で実行してヒストグラムを集計する前処理を行います。
+
+    Attributes:
+        ops (list): オペレーション定義のリスト
+        size (tuple): 画像サイズ (幅, 高さ)
+        strip_height (int): 1つの帯の高さ
+    """
+
+    def __init__(self, ops, size, strip_height=STRIP_HEIGHT):
+        """
+        TiledPipelineクラスの初期化
+
+        Args:
+            ops (list): オペレーション定義のリスト
+            size (tuple): 画像サイズ (幅, 高さ)
+            strip_height (int): 1つの帯の高さ
+        """
+        self.ops = ops
+        self.size = size
+        self.strip_height = strip_height
+        self.tile_ops: List[TileOp] = [TILE_OPERATIONS[op["op"]](op, size) for op in ops]
+        self._resolved = False
+
+    def bands(self) -> List[Tuple[int, int]]:
+        """
+        出力の帯の行範囲のリストを返す
+
+        Returns:
+            list: (開始行, 終了行) のリスト
+        """
+        height = self.size[1]
+        return [(y, min(height, y + self.strip_height)) for y in range(0, height, self.strip_height)]
+
+    def input_rows(self, y0, y1, count=None) -> Tuple[int, int]:
+        """
+        出力の行範囲 [y0, y1) の計算に必要な入力の行範囲を返す
+
+        Args:
+            y0 (int): 出力の開始行
+            y1 (int): 出力の終了行
+            count (int, optional): 先頭から実行するオペレーションの数（省略時はすべて）
+
+        Returns:
+            tuple: 入力の (開始行, 終了行)
+        """
+        return self._ranges(y0, y1, count)[0]
+
+    def _ranges(self, y0, y1, count):
+        """各オペレーションへの入力の行範囲と、最終的な出力の行範囲のリストを返す"""
+        ranges = [(y0, y1)]
+        for tile_op in reversed(self.tile_ops[:count]):
+            ranges.append(tile_op.input_rows(*ranges[-1]))
+        ranges.reverse()
+        return ranges
+
+    def render_band(self, source, y0, y1, count=None, offset=0):
+        """
+        出力の行範囲 [y0, y1) を計算する
+
+        Args:
+            source (PIL.Image or numpy.ndarray): 入力画像
+            y0 (int): 出力の開始行
+            y1 (int): 出力の終了行
+            count (int, optional): 先頭から実行するオペレーションの数（省略時はすべて）
+            offset (int): sourceの先頭行の入力画像での行番号（入力画像の一部の行だけを渡す場合）
+
+        Returns:
+            PIL.Image: 出力の帯
+        """
+        ranges = self._ranges(y0, y1, count)
+        top, bottom = ranges[0]
+        if isinstance(source, np.ndarray):
+            # 共有メモリ上の配列などから帯の範囲だけを画像にする
+            strip = Image.fromarray(source[top - offset:bottom - offset])
+        else:
+            strip = source.crop((0, top - offset, source.width, bottom - offset))
+        for tile_op, (out0, out1) in zip(self.tile_ops[:count], ranges[1:]):
+            strip = tile_op.apply(strip, top, out0, out1)
+            top = out0
+        return strip
+
+    def resolve(self, source):
+        """
+        画像全体の統計が必要なオペレーション（コントラスト）の平均輝度を求める
+
+        Args:
+            source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+        """
+        if self._resolved:
+            return
+        for index in self.contrast_indices():
+            histogram = np.zeros(256, dtype=np.int64)
+            for y0, y1 in self.bands():
+                histogram += self.band_histogram(source, y0, y1, index)
+            self.tile_ops[index].resolve(histogram)
+        self._resolved = True
+
+    def contrast_indices(self) -> List[int]:
+        """
+        画像全体の平均輝度が必要なオペレーション（コントラスト）の位置を返す
+
+        Returns:
+            list: オペレーションのインデックスのリスト
+        """
+        return [index for index, tile_op in enumerate(self.tile_ops) if isinstance(tile_op, ContrastTileOp)]
+
+    def band_histogram(self, source, y0, y1, index, offset=0):
+        """
+        index 番目のオペレーションへの入力のうち、行範囲 [y0, y1) の輝度ヒストグラムを求める
+
+        Args:
+            source (PIL.Image or numpy.ndarray): 入力画像
+            y0 (int): 開始行
+            y1 (int): 終了行
+            index (int): オペレーションのインデックス（これより前の平均輝度は設定済みであること）
+            offset (int): sourceの先頭行の入力画像での行番号
+
+        Returns:
+            numpy.ndarray: 輝度ヒストグラム（256要素）
+        """
+        strip = self.render_band(source, y0, y1, index, offset)
+        gray = strip if strip.mode == "L" else strip.convert("L")
+        return np.asarray(gray.histogram(), dtype=np.int64)
+
+    @property
+    def means(self) -> List:
+        """コントラストの平均輝度のリスト（未設定の場合はNone）"""
+        return [self.tile_ops[index].mean for index in self.contrast_indices()]
+
+    @means.setter
+    def means(self, means):
+        for index, mean in zip(self.contrast_indices(), means):
+            self.tile_ops[index].mean = mean
+        self._resolved = all(mean is not None for mean in means)
+
+    def strips(self, source) -> Iterator[Tuple[int, Image.Image]]:
+        """
+        出力の帯を上から順に返す
+
+        Args:
+            source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+
+        Yields:
+            tuple: (開始行, 出力の帯)
+        """
+        self.resolve(source)
+        for y0, y1 in self.bands():
+            yield y0, self.render_band(source, y0, y1)
+
+    def render(self, source):
+        """
+        出力の帯を1枚の出力画像に書き込んで返す（中間画像は帯の大きさのみ）
+
+        Args:
+            source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+
+        Returns:
+            PIL.Image: 変換後の画像
+        """
+        output = None
+        for y0, strip in self.strips(source):
+            if output is None:
+                output = Image.new(strip.mode, self.size)
+            output.paste(strip, (0, y0))
+        return output
+
+
+class PngStreamWriter:
+    """
+    帯ごとに書き込めるPNGエンコーダー
+
+    各行にPaethフィルタを掛けてzlibで逐次圧縮し、帯ごとにIDATチャンクとして書き出します。
+    画像全体をメモリに持たずにPNGを作成できます。
+
+    Attributes:
+        size (tuple): 画像サイズ (幅, 高さ)
+        mode (str): 画像モード（"L"、"RGB" または "RGBA"）
+    """
+
+    def __init__(self, file, size, mode, compress_level=6):
+        """
+        PngStreamWriterクラスの初期化（PNGのシグネチャとヘッダーを書き込む）
+
+        Args:
+            file (file): 書き込み先のバイナリファイル
+            size (tuple): 画像サイズ (幅, 高さ)
+            mode (str): 画像モード
+            compress_level (int): zlibの圧縮レベル
+        """
+        if mode not in _PNG_COLOR_TYPES:
+            raise ValueError(f"PNGの逐次書き込みに対応していない画像モードです: {mode}")
+        self.file = file
+        self.size = size
+        self.mode = mode
+        self._channels = _PNG_COLOR_TYPES[mode][1]
+        self._compressor = zlib.compressobj(compress_level)
+        self._previous = np.zeros(size[0] * self._channels, dtype=np.int16)
+        self._rows = 0
+
+        file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, _PNG_COLOR_TYPES[mode][0], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def write(self, strip):
+        """
+        次の帯を書き込む
+
+        Args:
+            strip (PIL.Image or numpy.ndarray): 帯（画像と同じ幅・モード）
+        """
+        pixels = np.asarray(strip, dtype=np.uint8)
+        height = pixels.shape[0]
+        rows = pixels.reshape(height, -1).astype(np.int16)
+        channels = self._channels
+        above = np.vstack([self._previous[np.newaxis], rows[:-1]])
+        left = np.zeros_like(rows)
+        left[:, channels:] = rows[:, :-channels]
+        upper_left = np.zeros_like(rows)
+        upper_left[:, channels:] = above[:, :-channels]
+
+        # Paethフィルタ: 左・上・左上のうち、左+上-左上 に最も近い値で予測する
+        pa = np.abs(above - upper_left)
+        pb = np.abs(left - upper_left)
+        pc = np.abs(left + above - 2 * upper_left)
+        predicted = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, above, upper_left))
+        filtered = ((rows - predicted) & 0xFF).astype(np.uint8)
+
+        lines = np.empty((height, filtered.shape[1] + 1), dtype=np.uint8)
+        lines[:, 0] = 4
+        lines[:, 1:] = filtered
+        compressed = self._compressor.compress(lines.tobytes())
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+        self._previous = rows[-1]
+        self._rows += height
+
+    def close(self):
+        """残りの圧縮データと終端チャンクを書き込む"""
+        if self._rows != self.size[1]:
+            raise ValueError(f"PNGの行数が一致しません: {self._rows} / {self.size[1]}")
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+def _save_jpeg_strips(strips, size, mode, output_path, encoder_settings):
+    """
+    上から順に並んだ出力の帯をJPEGで保存する
+
+    帯は画素を並べただけの一時ファイルに書き出し、そのファイルをメモリマップした画像を
+    エンコーダーに渡すため、出力画像全体をプロセスのメモリに持ちません（読み込んだ部分は
+    ページキャッシュとしてOSが回収できる）。ハフマン符号の最適化とプログレッシブは
+    libjpegが画像全体の係数をメモリに保持するため使いません。
+
+    Args:
+        strips (iterable): (開始行, 帯) の反復（帯はPIL画像またはNumPy配列）
+        size (tuple): 画像サイズ (幅, 高さ)
+        mode (str): 出力の画像モード（Noneの場合は最初の帯から決める）
+        output_path (str): 保存先のパス
+        encoder_settings (dict): エンコード設定
+    """
+    spool_path = output_path + ".raw"
+    try:
+        with open(spool_path, "wb") as f:
+            for _, strip in strips:
+                if isinstance(strip, np.ndarray):
+                    strip = Image.fromarray(strip, mode)
+                mode = strip.mode
+                # Pillowは1バイトまたは4バイトの画素のみメモリマップできるため、RGBはRGBXで書き出す
+                f.write(strip.tobytes() if mode == "L" else strip.convert("RGBX").tobytes())
+
+        spool_mode = "L" if mode == "L" else "RGBX"
+        pixels = np.memmap(spool_path, dtype=np.uint8, mode="r+")
+        img = Image.frombuffer(spool_mode, size, pixels, "raw", spool_mode, 0, 1)
+        # frombufferの画像は保存時に複製されるため、書き込み可能なマップとして扱わせる
+        img.readonly = 0
+        options = {**save_options("jpeg", encoder_settings), "optimize": False, "progressive": False}
+        with open(output_path, "wb") as f:
+            img.save(f, format="JPEG", **options)
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def save_strips(strips, size, mode, output_base, fmt, encoder_settings) -> str:
+    """
+    上から順に並んだ出力の帯をエンコードして保存する
+
+    PNGは帯をそのままエンコーダーに流し、JPEGはメモリマップした一時ファイルからエンコードするため、
+    出力画像全体をメモリに持ちません。画像全体を必要とするエンコーダー（WebP・AVIF）の形式はPNGで保存します。
+
+    Args:
+        strips (iterable): (開始行, 帯) の反復（帯はPIL画像またはNumPy配列）
+        size (tuple): 画像サイズ (幅, 高さ)
+        mode (str): 出力の画像モード（Noneの場合は最初の帯から決める）
+        output_base (str): 保存先のパス（拡張子は出力形式から決める）
+        fmt (str): 出力形式
+        encoder_settings (dict): エンコード設定
+
+    Returns:
+        str: 保存先のパス
+    """
+    if fmt not in ("png", "jpeg"):
+        logger.info(f"{fmt} は帯ごとにエンコードできないため、帯状分割の出力はPNGで保存します")
+        fmt = "png"
+    output_path = output_base + extension_for(fmt)
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if fmt == "png":
+        writer = None
+        with open(temp_path, "wb") as f:
+            for _, strip in strips:
+                if writer is None:
+                    writer = PngStreamWriter(f, size, mode or strip.mode, **save_options("png", encoder_settings))
+                writer.write(strip)
+            writer.close()
+    else:
+        _save_jpeg_strips(strips, size, mode, temp_path, encoder_settings)
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def render_tiled_to_file(source, ops, output_base, encoder_settings=None, format_hint=None) -> str:
+    """
+    帯状分割でスタイルを適用し、エンコードして保存する
+
+    Args:
+        source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+        ops (list): オペレーション定義のリスト
+        output_base (str): 保存先のパス（拡張子は出力形式から決める）
+        encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+        format_hint (PIL.Image, optional): 出力形式の自動選択に使う縮小版の変換画像（省略時は入力画像で判定するため、入力がSequentialImageの場合は必須）
+
+    Returns:
+        str: 保存先のパス
+    """
+    settings = encoder_settings or get_encoder_settings()
+    pipeline = TiledPipeline(ops, source.size)
+    fmt = choose_format(format_hint if format_hint is not None else source, settings)
+    output_path = save_strips(pipeline.strips(source), source.size, None, output_base, fmt, settings)
+    logger.info(f"帯状分割で変換しました: {source.size[0]}x{source.size[1]}（{len(pipeline.bands())}帯）")
+    return output_path
@@ -0,0 +1,182 @@
+import io
+import os
+import base64
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from image_encoder import encode_image
+from image_styles import compile_pipeline
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("pixel_art")
+
+# 拡大後のサイズを記録するPNGのテキストチャンクのキー
+PIXEL_ART_SIZE_KEY = "pixel_art_size"
+
+# 表示時の拡大を画面側に任せるオペレーション（最後の処理段の場合のみ）
+DEFERRED_UPSCALE_OPS = ("pixelate",)
+
+
+def split_deferred_upscale(ops) -> Tuple[List[dict], Optional[int]]:
+    """
+    オペレーション列の最後のピクセル化を、拡大を除いた縮小だけの処理に置き換えられるか判定する
+
+    Args:
+        ops (list): オペレーション定義のリスト
+
+    Returns:
+        list: ピクセル化より前のオペレーション定義のリスト
+        int: ピクセル化の倍率（最後がピクセル化でない場合はNone）
+    """
+    if not ops or ops[-1]["op"] not in DEFERRED_UPSCALE_OPS:
+        return list(ops), None
+    return list(ops[:-1]), int(ops[-1]["factor"])
+
+
+def pixelate_small(img, factor):
+    """
+    ピクセル化の縮小側だけを行う（pixelateと同じ画素を最近傍法で選ぶ）
+
+    Args:
+        img (PIL.Image): 入力画像
+        factor (int): ピクセル化の倍率
+
+    Returns:
+        PIL.Image: 1ドットを1画素とした縮小画像
+    """
+    return img.resize((max(1, img.width // factor), max(1, img.height // factor)), Image.NEAREST)
+
+
+def encode_pixel_art(small, full_size) -> bytes:
+    """
+    縮小したピクセルアートを、拡大後のサイズを記録したPNGにエンコードする
+
+    Args:
+        small (PIL.Image): 1ドットを1画素とした縮小画像
+        full_size (tuple): 拡大後の (幅, 高さ)
+
+    Returns:
+        bytes: PNGの画像データ
+    """
+    info = PngInfo()
+    info.add_text(PIXEL_ART_SIZE_KEY, f"{full_size[0]}x{full_size[1]}")
+    buffer = io.BytesIO()
+    small.save(buffer, format="PNG", pnginfo=info, optimize=True)
+    return buffer.getvalue()
+
+
+def save_pixel_art(img, factor, output_base) -> str:
+    """
+    ピクセル化した画像を縮小したまま保存する（拡大は表示・ダウンロード時に行う）
+
+    Args:
+        img (PIL.Image): ピクセル化する前の画像
+        factor (int): ピクセル化の倍率
+        output_base (str): 保存先のパス（拡張子なし）
+
+    Returns:
+        str: 保存先のパス
+    """
+    data = encode_pixel_art(pixelate_small(img, factor), img.size)
+    output_path = output_base + ".png"
+    # 書き込み途中のファイルを読まれないよう一時ファイルに保存してから置き換える
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+    logger.info(f"ピクセルアートを縮小したまま保存しました: {img.width}x{img.height} → {len(data)}バイト")
+    return output_path
+
+
+def render_pixel_art(img, ops, output_base) -> Optional[str]:
+    """
+    最後がピクセル化のオペレーション列を実行し、縮小したまま保存する
+
+    Args:
+        img (PIL.Image): 入力画像
+        ops (list): オペレーション定義のリスト
+        output_base (str): 保存先のパス（拡張子なし）
+
+    Returns:
+        str: 保存先のパス（最後がピクセル化でない場合はNone）
+    """
+    head, factor = split_deferred_upscale(ops)
+    if factor is None:
+        return None
+    for step in compile_pipeline(head):
+        img = step(img)
+    return save_pixel_art(img, factor, output_base)
+
+
+def pixel_art_size(source) -> Optional[Tuple[int, int]]:
+    """
+    縮小して保存したピクセルアートの拡大後のサイズを返す（画素はデコードしない）
+
+    Args:
+        source (str or bytes): 画像ファイルのパス、または画像データ
+
+    Returns:
+        tuple: 拡大後の (幅, 高さ)（ピクセルアートでない場合はNone）
+    """
+    if isinstance(source, str) and not source.lower().endswith(".png"):
+        return None
+    try:
+        with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as img:
+            value = img.info.get(PIXEL_ART_SIZE_KEY)
+    except (OSError, ValueError):
+        return None
+    if not value:
+        return None
+    width, height = (int(part) for part in value.split("x"))
+    return width, height
+
+
+def materialize_pixel_art(data, encoder_settings=None) -> Tuple[bytes, str]:
+    """
+    縮小して保存したピクセルアートを元のサイズに拡大してエンコードする（ダウンロード用）
+
+    Args:
+        data (bytes): 縮小したピクセルアートのPNGデータ
+        encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+
+    Returns:
+        bytes: エンコード済みの画像データ
+        str: 出力形式
+    """
+    full_size = pixel_art_size(data)
+    with Image.open(io.BytesIO(data)) as small:
+        small.load()
+        full = small.resize(full_size, Image.NEAREST) if full_size else small.copy()
+    return encode_image(full, encoder_settings)
+
+
+def pixel_art_html(data, caption=None, max_size=None) -> Optional[str]:
+    """
+    縮小したピクセルアートをブラウザ側でドットを保ったまま拡大表示するHTMLを返す
+
+    Args:
+        data (bytes): 縮小したピクセルアートのPNGデータ
+        caption (str, optional): 画像の下に表示する説明
+        max_size (int, optional): そのまま送る画像の長辺の上限（超える場合は通常の縮小表示に任せる）
+
+    Returns:
+        str: imgタグを含むHTML（縮小画像が max_size より大きい場合はNone）
+    """
+    with Image.open(io.BytesIO(data)) as small:
+        small_size = small.size
+        full_size = pixel_art_size(data) or small_size
+    if max_size and max(small_size) > max_size:
+        return None
+    encoded = base64.b64encode(data).decode("ascii")
+    html = (
+        f'<img src="data:image/png;base64,{encoded}" '
+        f'style="width:100%;aspect-ratio:{full_size[0]}/{full_size[1]};image-rendering:pixelated;">'
+    )
+    if caption:
+        html += f'<div class="thumbnail-caption">{caption}</div>'
+    return html
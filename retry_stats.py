@@ -0,0 +1,231 @@
+import os
+import json
+import math
+import time
+import atexit
+import random
+import threading
+import logging
+from typing import List, Optional
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("retry_stats")
+
+# プロンプトのバリアント名
+PROMPT_VARIANT_BASE = "base"
+PROMPT_VARIANT_ENHANCED = "enhanced"
+PROMPT_VARIANTS = [PROMPT_VARIANT_BASE, PROMPT_VARIANT_ENHANCED]
+
+
+def build_prompt_variant(prompt, style, variant):
+    """
+    指定されたバリアントのプロンプトを生成する
+
+    Args:
+        prompt (str): 元の変換プロンプト
+        style (str): 変換スタイル
+        variant (str): プロンプトのバリアント名
+
+    Returns:
+        str: バリアントに応じたプロンプト
+    """
+    if variant == PROMPT_VARIANT_ENHANCED:
+        return f"{prompt}\n\n重要: この画像の{style}への変換について、具体的かつ詳細に説明してください。画像の特徴、色彩、構図、質感などの変化を詳しく述べてください。少なくとも3段落、200文字以上の詳細な説明を提供してください。"
+    return prompt
+
+
+class RetryStats:
+    """
+    スタイル・プロンプトバリアント別の検証成功率を記録するクラス
+
+    バリアントごとに初回試行とリトライの成功率をJSONファイルに永続化し、
+    アプリの再起動後も学習結果を引き継ぎます。開始バリアントは初回試行の成功率だけで比較し
+    （リトライは失敗した後の試行のため、成功率に偏りがある）、統計が不足している
+    バリアントや一定の確率で他のバリアントも試して学習を続けます。
+
+    Attributes:
+        path (str): 統計を保存するJSONファイルのパス
+        min_samples (int): 統計を信頼するために必要な最小試行回数
+        target_success (float): リトライ予算を決める際の目標成功確率
+        exploration_rate (float): 最も成功率の高いバリアント以外を試す確率
+        save_interval (float): 統計をファイルに書き出す最短の間隔（秒）
+    """
+
+    def __init__(self, path="data/retry_stats.json", min_samples=5, target_success=0.95,
+                 exploration_rate=0.1, save_interval=10.0):
+        """
+        RetryStatsクラスの初期化
+
+        Args:
+            path (str): 統計を保存するJSONファイルのパス
+            min_samples (int): 統計を信頼するために必要な最小試行回数
+            target_success (float): リトライ予算を決める際の目標成功確率
+            exploration_rate (float): 最も成功率の高いバリアント以外を試す確率
+            save_interval (float): 統計をファイルに書き出す最短の間隔（秒）
+        """
+        self.path = path
+        self.min_samples = min_samples
+        self.target_success = target_success
+        self.exploration_rate = exploration_rate
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._stats = self._load()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # 書き出し間隔内の記録が失われないよう、終了時にも書き出す
+        atexit.register(self.flush)
+
+    def _load(self):
+        """保存済みの統計を読み込む"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            logger.error(f"リトライ統計の読み込みに失敗しました: {str(e)}")
+            return {}
+
+    def _save(self):
+        """統計をファイルに書き出す（ロック取得済みの状態で呼び出す）"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        except Exception as e:
+            logger.error(f"リトライ統計の保存に失敗しました: {str(e)}")
+
+    def flush(self):
+        """未保存の記録があればファイルに書き出す"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _variant_entry(self, style, variant):
+        """バリアントの統計エントリを取得（存在しなければ作成）する"""
+        variants = self._stats.setdefault(style, {}).setdefault("variants", {})
+        entry = variants.setdefault(variant, {})
+        for key in ("attempts", "successes", "first_attempts", "first_successes"):
+            entry.setdefault(key, 0)
+        return entry
+
+    def record(self, style, variant, valid, first_attempt=False):
+        """
+        1回の試行結果を記録する（ファイルへの書き出しは save_interval 秒ごとにまとめて行う）
+
+        Args:
+            style (str): 変換スタイル
+            variant (str): 使用したプロンプトのバリアント名
+            valid (bool): 応答が検証を通過したかどうか
+            first_attempt (bool): リクエストの初回試行かどうか
+        """
+        with self._lock:
+            entry = self._variant_entry(style, variant)
+            entry["attempts"] += 1
+            if valid:
+                entry["successes"] += 1
+            if first_attempt:
+                entry["first_attempts"] += 1
+                if valid:
+                    entry["first_successes"] += 1
+            self._dirty = True
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self._save()
+
+    def _counts(self, style, variant, first_attempt):
+        """試行回数と成功回数を返す（first_attempt がNoneの場合は全試行、Falseの場合はリトライのみ）"""
+        entry = self._stats.get(style, {}).get("variants", {}).get(variant)
+        if not entry:
+            return 0, 0
+        attempts, successes = entry.get("attempts", 0), entry.get("successes", 0)
+        first_attempts, first_successes = entry.get("first_attempts", 0), entry.get("first_successes", 0)
+        if first_attempt is None:
+            return attempts, successes
+        if first_attempt:
+            return first_attempts, first_successes
+        return attempts - first_attempts, successes - first_successes
+
+    def variant_rate(self, style, variant, first_attempt=None) -> Optional[float]:
+        """
+        バリアントの成功率を返す
+
+        Args:
+            style (str): 変換スタイル
+            variant (str): プロンプトのバリアント名
+            first_attempt (bool, optional): Trueの場合は初回試行のみ、Falseの場合はリトライのみ（省略時は全試行）
+
+        Returns:
+            float: 成功率（試行回数が不足している場合はNone）
+        """
+        with self._lock:
+            attempts, successes = self._counts(style, variant, first_attempt)
+        if attempts < self.min_samples:
+            return None
+        return successes / attempts
+
+    def best_variant(self, style, variants: Optional[List[str]] = None) -> str:
+        """
+        初回試行で使うプロンプトバリアントを返す
+
+        初回試行の回数が min_samples に満たないバリアントがあればそれを優先して試し、
+        それ以外は exploration_rate の確率で他のバリアントを、残りは初回成功率が
+        最も高いバリアントを返します（ε-greedy）。
+
+        Args:
+            style (str): 変換スタイル
+            variants (list, optional): 候補となるバリアント名のリスト
+
+        Returns:
+            str: 開始に使用するバリアント名
+        """
+        variants = variants or PROMPT_VARIANTS
+        rates = {variant: self.variant_rate(style, variant, first_attempt=True) for variant in variants}
+        unexplored = [variant for variant, rate in rates.items() if rate is None]
+        if unexplored:
+            return unexplored[0]
+        best = max(variants, key=lambda variant: rates[variant])
+        if len(variants) > 1 and random.random() < self.exploration_rate:
+            return random.choice([variant for variant in variants if variant != best])
+        return best
+
+    def retry_budget(self, style, variant, retry_variant=PROMPT_VARIANT_ENHANCED, max_retries=5, min_retries=2) -> int:
+        """
+        成功率から必要十分な試行回数を計算する
+
+        初回試行は variant、2回目以降は retry_variant で試行するものとして、
+        初回の成功率p0とリトライの成功率prから、目標成功確率に到達する試行回数
+        n = 1 + log((1 - target) / (1 - p0)) / log(1 - pr) を求め、上下限で丸めます。
+
+        Args:
+            style (str): 変換スタイル
+            variant (str): 初回試行に使用するプロンプトのバリアント名
+            retry_variant (str): リトライに使用するプロンプトのバリアント名
+            max_retries (int): 試行回数の上限
+            min_retries (int): 試行回数の下限
+
+        Returns:
+            int: このリクエストで許可する試行回数
+        """
+        first_rate = self.variant_rate(style, variant, first_attempt=True)
+        retry_rate = self.variant_rate(style, retry_variant, first_attempt=False)
+        if retry_rate is None:
+            retry_rate = self.variant_rate(style, retry_variant)
+        if first_rate is None or retry_rate is None:
+            return max_retries
+        first_failure = 1.0 - first_rate
+        if first_failure <= 1.0 - self.target_success:
+            return min_retries
+        if retry_rate >= 1.0:
+            return max(min_retries, min(max_retries, 2))
+        if retry_rate <= 0.0:
+            return max_retries
+        budget = 1 + math.ceil(math.log((1 - self.target_success) / first_failure) / math.log(1 - retry_rate))
+        return max(min_retries, min(max_retries, budget))
@@ -0,0 +1,203 @@
+import re
+import time
+import zlib
+import threading
+import unicodedata
+import logging
+from typing import Optional
+
+import numpy as np
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("semantic_cache")
+
+
+# 一致を必須とする内容語（数字・英単語・漢字の連続・カタカナの連続）
+SALIENT_TOKEN_PATTERN = re.compile(r"[0-9]+|[a-z]+(?:'[a-z]+)?|[\u4e00-\u9fff々]+|[\u30a0-\u30ff]+")
+
+# 否定を表す語（質問の意味を反転させるため、有無の一致を必須とする）
+NEGATION_MARKERS = ("ない", "なく", "ません", "ず", "ぬ", "not", "no", "never", "without", "none", "nor")
+
+
+def salient_signature(text):
+    """
+    キャッシュヒットの条件として完全一致を求める、質問の重要な要素を取り出す
+
+    文字n-gramの類似度は「昇順/降順」「2023/2024」「Austria/Australia」のように
+    一部だけが異なる質問を区別できないため、数字・内容語・否定の有無を別に比較します。
+
+    Args:
+        text (str): 質問テキスト
+
+    Returns:
+        tuple: (内容語の集合, 否定を表す語の集合)
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = frozenset(SALIENT_TOKEN_PATTERN.findall(text))
+    words = set(re.findall(r"[a-z]+(?:'[a-z]+)?", text))
+    negations = frozenset(
+        marker for marker in NEGATION_MARKERS
+        if (marker in words if marker.isascii() else marker in text)
+    ) | frozenset(word for word in words if word.endswith("n't"))
+    return tokens, negations
+
+
+class SemanticCache:
+    """
+    ほぼ同一の質問に対して過去の回答を返すローカルキャッシュ
+
+    文字n-gramをハッシュしたベクトル（hashing trick）で質問を表現し、
+    コサイン類似度が閾値以上の登録済みの質問があればその回答を返します。
+    文字n-gramの類似度だけでは一部の語が異なる別の質問も一致するため、数字・内容語
+    （英単語・漢字やカタカナの連続）・否定の有無が完全に一致する場合のみヒットとします。
+    外部サービスやモデルを使用せず、すべてプロセス内で計算します。
+
+    Attributes:
+        threshold (float): キャッシュヒットとみなすコサイン類似度の閾値
+        ttl (float): エントリの既定の有効期間（秒）
+        max_entries (int): 保持する最大エントリ数
+        dim (int): 特徴ベクトルの次元数
+        ngram_sizes (tuple): 使用する文字n-gramの長さ
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000, dim=2048, ngram_sizes=(2, 3)):
+        """
+        SemanticCacheクラスの初期化
+
+        Args:
+            threshold (float): キャッシュヒットとみなすコサイン類似度の閾値
+            ttl (float): エントリの既定の有効期間（秒）
+            max_entries (int): 保持する最大エントリ数
+            dim (int): 特徴ベクトルの次元数
+            ngram_sizes (tuple): 使用する文字n-gramの長さ
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        """
+        表記ゆれを吸収するためにテキストを正規化する
+
+        Args:
+            text (str): 入力テキスト
+
+        Returns:
+            str: 全角半角・大文字小文字・記号・空白を揃えたテキスト
+        """
+        text = unicodedata.normalize("NFKC", text).lower()
+        return re.sub(r"[\s\W_]+", "", text)
+
+    def embed(self, text):
+        """
+        テキストを正規化済みの特徴ベクトルに変換する
+
+        Args:
+            text (str): 入力テキスト
+
+        Returns:
+            numpy.ndarray: L2正規化された特徴ベクトル（特徴がない場合はNone）
+        """
+        normalized = self.normalize(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in self.ngram_sizes:
+            # n-gramが作れない短いテキストは全体を1つの特徴とする
+            grams = [normalized[i:i + n] for i in range(len(normalized) - n + 1)] or [normalized]
+            for gram in grams:
+                if not gram:
+                    continue
+                h = zlib.crc32(gram.encode("utf-8"))
+                # 符号付きハッシュで衝突による偏りを打ち消す
+                vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def _purge_expired(self, now):
+        """有効期限切れのエントリを削除する（ロック取得済みの状態で呼び出す）"""
+        alive = [i for i, entry in enumerate(self._entries) if entry["expires_at"] > now]
+        if len(alive) != len(self._entries):
+            self._entries = [self._entries[i] for i in alive]
+            self._vectors = self._vectors[alive]
+
+    def get(self, text) -> Optional[str]:
+        """
+        類似する質問の回答を検索する
+
+        Args:
+            text (str): 質問テキスト
+
+        Returns:
+            str: キャッシュされた回答（見つからない場合はNone）
+        """
+        vector = self.embed(text)
+        if vector is None:
+            return None
+
+        with self._lock:
+            self._purge_expired(time.time())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            # 類似度が閾値以上の候補のうち、重要な要素が完全に一致するものだけを採用する
+            similarities = self._vectors @ vector
+            signature = salient_signature(text)
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    break
+                entry = self._entries[index]
+                if entry["signature"] == signature:
+                    self.hits += 1
+                    logger.info(f"類似質問のキャッシュにヒットしました（類似度 {similarities[index]:.2f}）")
+                    return entry["answer"]
+
+            self.misses += 1
+            return None
+
+    def put(self, text, answer, ttl=None):
+        """
+        質問と回答を登録する
+
+        Args:
+            text (str): 質問テキスト
+            answer (str): 回答テキスト
+            ttl (float, optional): このエントリの有効期間（秒）。省略時は既定値
+        """
+        vector = self.embed(text)
+        if vector is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+
+            # 上限を超える場合は最も古いエントリから削除
+            overflow = len(self._entries) + 1 - self.max_entries
+            if overflow > 0:
+                self._entries = self._entries[overflow:]
+                self._vectors = self._vectors[overflow:]
+
+            self._entries.append({
+                "text": text,
+                "signature": salient_signature(text),
+                "answer": answer,
+                "expires_at": now + (self.ttl if ttl is None else ttl),
+            })
+            self._vectors = np.vstack([self._vectors, vector[np.newaxis, :]])
+
+    def clear(self):
+        """すべてのエントリを削除する"""
+        with self._lock:
+            self._entries = []
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
@@ -0,0 +1,247 @@
+import os
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from image_encoder import choose_format, get_encoder_settings
+from image_lut import histogram_mean
+from image_tiling import STRIP_HEIGHT, TiledPipeline, render_tiled_to_file, save_strips
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("strip_parallel")
+
+
+def create_process_pool(max_workers=None) -> ProcessPoolExecutor:
+    """
+    共有メモリを受け渡すワーカー用のプロセスプールを作成する
+
+    ワーカーが起動する前に共有メモリの管理プロセス（resource_tracker）を起動しておき、
+    親プロセスと共有させます。ワーカーごとに管理プロセスが起動すると、
+    ワーカーが開いた共有メモリを終了時に「解放漏れ」として二重に解放しようとするためです。
+
+    Args:
+        max_workers (int, optional): ワーカー数（省略時はCPUコア数）
+
+    Returns:
+        ProcessPoolExecutor: プロセスプール
+    """
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+class SharedArray:
+    """
+    共有メモリ上のuint8配列（作成したプロセスが with を抜けるとき、またはcloseで解放する）
+
+    Attributes:
+        name (str): 共有メモリの名前（ワーカーはこの名前で同じ配列を開く）
+        shape (tuple): 配列の形状
+        array (numpy.ndarray): 共有メモリを参照する配列
+    """
+
+    def __init__(self, shape):
+        """
+        SharedArrayクラスの初期化（共有メモリを確保する）
+
+        Args:
+            shape (tuple): 配列の形状
+        """
+        self.shape = tuple(shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(self.shape))))
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """共有メモリを解放する"""
+        # 配列の参照を外してから解放する（参照が残っているとcloseできない）
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+@contextmanager
+def _attach(name, shape):
+    """ワーカー側で共有メモリ上の配列を開く（コピーせずに参照する）"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        yield np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    finally:
+        shm.close()
+
+
+@lru_cache(maxsize=16)
+def _worker_pipeline(ops_json, size, strip_height, means):
+    """ワーカーごとにパイプラインを一度だけ組み立てる（画素の対応表などを再利用）"""
+    pipeline = TiledPipeline(json.loads(ops_json), size, strip_height)
+    pipeline.means = list(means)
+    return pipeline
+
+
+def _band_histogram_task(spec, means, window_name, window_shape, offset, y0, y1, index):
+    """ワーカーで帯の輝度ヒストグラムを求める（コントラストの平均輝度の集計用）"""
+    ops_json, size, strip_height = spec
+    pipeline = _worker_pipeline(ops_json, size, strip_height, tuple(means))
+    with _attach(window_name, window_shape) as window:
+        return pipeline.band_histogram(window, y0, y1, index, offset)
+
+
+def _render_band_task(spec, means, window_name, window_shape, offset, y0, y1, output_name, output_shape):
+    """ワーカーで帯を処理し、共有メモリ上の帯の出力配列に直接書き込む"""
+    ops_json, size, strip_height = spec
+    pipeline = _worker_pipeline(ops_json, size, strip_height, tuple(means))
+    with _attach(window_name, window_shape) as window, _attach(output_name, output_shape) as output:
+        output[...] = np.asarray(pipeline.render_band(window, y0, y1, offset=offset))
+    return y1 - y0
+
+
+def _rows_shape(width, rows, channels):
+    """行数 rows の帯の配列の形状を返す"""
+    return (rows, width) if channels == 1 else (rows, width, channels)
+
+
+def _map_bands(source, pipeline, count, submit, max_pending) -> Iterator[Tuple[int, int, object, List[SharedArray]]]:
+    """
+    帯ごとに必要な入力の行だけを共有メモリの窓に書き込んでワーカーに渡し、結果を帯の順に返す
+
+    入力画像は上から順に読み、処理中の帯は max_pending 個までに抑えます。
+    返した帯の窓と出力先の共有メモリは、呼び出し側が次の帯を要求したときに解放します。
+
+    Args:
+        source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+        pipeline (TiledPipeline): 帯状分割のパイプライン
+        count (int): 先頭から実行するオペレーションの数（Noneはすべて）
+        submit (callable): (窓, 窓の先頭行, y0, y1) を受け取り (Future, ワーカーの出力先の共有メモリのリスト) を返す関数
+        max_pending (int): 同時に処理する帯の数の上限
+
+    Yields:
+        tuple: (開始行, 終了行, ワーカーの結果, ワーカーの出力先の共有メモリのリスト)
+    """
+    channels = len(source.getbands())
+    bands = iter(pipeline.bands())
+    pending = deque()
+    returned: List[SharedArray] = []
+    try:
+        while True:
+            for y0, y1 in bands:
+                top, bottom = pipeline.input_rows(y0, y1, count)
+                window = SharedArray(_rows_shape(source.width, bottom - top, channels))
+                window.array[...] = np.asarray(source.crop((0, top, source.width, bottom)))
+                future, outputs = submit(window, top, y0, y1)
+                pending.append((y0, y1, future, [window] + outputs))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            y0, y1, future, resources = pending.popleft()
+            _release(returned)
+            returned = resources
+            yield y0, y1, future.result(), resources[1:]
+    finally:
+        _release(returned)
+        # 途中で終了した場合も、ワーカーの処理を待ってから共有メモリを解放する
+        for _, _, future, resources in pending:
+            future.cancel()
+            wait([future])
+            _release(resources)
+
+
+def _release(resources):
+    """共有メモリをまとめて解放する"""
+    for resource in resources:
+        resource.close()
+
+
+def render_parallel(source, ops, executor, strip_height=STRIP_HEIGHT, max_pending=None) -> Tuple[str, Iterator[Tuple[int, np.ndarray]]]:
+    """
+    帯を複数のプロセスで並列に処理し、出力の帯を上から順に返す
+
+    入力画像は帯ごとに必要な行（近傍フィルタの余白を含む）だけを共有メモリの窓に書き込み、
+    ワーカーには共有メモリの名前と行範囲だけを渡します（画素データをpickleしません）。
+    各ワーカーは処理した帯を帯ごとの共有メモリの出力配列に直接書き込み、
+    呼び出し側がその帯を使い終えると窓と出力配列を解放します。
+    そのため画像全体の入力・出力を共有メモリに置かず、使用メモリは処理中の帯の数で決まります。
+
+    Args:
+        source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+        ops (list): オペレーション定義のリスト
+        executor (ProcessPoolExecutor): ワーカーのプロセスプール
+        strip_height (int): 1つの帯の高さ
+        max_pending (int, optional): 同時に処理する帯の数の上限（省略時はCPUコア数の2倍）
+
+    Returns:
+        str: 出力の画像モード
+        iterator: (開始行, 出力の帯の配列) の反復（帯の配列は次の帯を要求するまでに使い切ること）
+    """
+    pipeline = TiledPipeline(ops, source.size, strip_height)
+    spec = (json.dumps(ops), source.size, strip_height)
+    max_pending = max_pending or 2 * (os.cpu_count() or 1)
+
+    # コントラストの平均輝度は帯ごとのヒストグラムを並列に集計して求める
+    means = []
+    for index in pipeline.contrast_indices():
+        def submit_histogram(window, offset, y0, y1, index=index, means=list(means)):
+            future = executor.submit(_band_histogram_task, spec, means, window.name, window.shape, offset, y0, y1, index)
+            return future, []
+
+        histogram = np.zeros(256, dtype=np.int64)
+        for _, _, band_histogram, _ in _map_bands(source, pipeline, index, submit_histogram, max_pending):
+            histogram += band_histogram
+        means.append(histogram_mean(histogram.tolist()))
+    pipeline.means = means
+
+    # 出力の画像モードは1行だけ処理して決める
+    probe = pipeline.render_band(source, 0, 1)
+    output_channels = len(probe.getbands())
+
+    def submit_render(window, offset, y0, y1):
+        output = SharedArray(_rows_shape(source.width, y1 - y0, output_channels))
+        future = executor.submit(
+            _render_band_task, spec, means, window.name, window.shape, offset, y0, y1, output.name, output.shape
+        )
+        return future, [output]
+
+    def strips():
+        for y0, _, _, (output,) in _map_bands(source, pipeline, None, submit_render, max_pending):
+            yield y0, output.array
+        logger.info(f"帯を並列に処理しました: {source.width}x{source.height}（{len(pipeline.bands())}帯）")
+
+    return probe.mode, strips()
+
+
+def render_parallel_to_file(source, ops, output_base, executor=None, encoder_settings=None, format_hint=None) -> str:
+    """
+    帯を複数のプロセスで並列に処理してスタイルを適用し、エンコードして保存する
+
+    Args:
+        source (PIL.Image or SequentialImage): 入力画像（cropで行範囲を切り出せるもの）
+        ops (list): オペレーション定義のリスト
+        output_base (str): 保存先のパス（拡張子は出力形式から決める）
+        executor (ProcessPoolExecutor, optional): ワーカーのプロセスプール（省略時は帯を逐次処理）
+        encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+        format_hint (PIL.Image, optional): 出力形式の自動選択に使う縮小版の変換画像（省略時は入力画像で判定するため、入力がSequentialImageの場合は必須）
+
+    Returns:
+        str: 保存先のパス
+    """
+    if executor is None:
+        return render_tiled_to_file(source, ops, output_base, encoder_settings, format_hint)
+
+    settings = encoder_settings or get_encoder_settings()
+    fmt = choose_format(format_hint if format_hint is not None else source, settings)
+    # 共有メモリ上の帯の出力配列をそのままエンコーダーへ渡す
+    mode, strips = render_parallel(source, ops, executor)
+    return save_strips(strips, source.size, mode, output_base, fmt, settings)
@@ -0,0 +1,214 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from functools import partial
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from image_decode import decode_upload, open_sequential
+from image_encoder import FLAT_IMAGE_SAMPLE_SIZE, encode_image, extension_for
+from image_styles import compile_pipeline, get_style_registry, scale_ops
+from image_tiling import render_tiled_to_file, should_tile
+from pixel_art import render_pixel_art, split_deferred_upscale
+from style_graph import get_style_graph, image_key, node_key
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("style_fanout")
+
+# 比較グリッドの列数
+GRID_COLUMNS = 5
+
+
+def load_source_image(image_data, max_size=None):
+    """
+    画像データを一度だけデコードする（EXIFの向きと画像モードを正規化し、結果はプロセス内で共有）
+
+    Args:
+        image_data (bytes): 画像データ
+        max_size (int, optional): 長辺の最大サイズ（指定時は縮小した代理画像を返す）
+
+    Returns:
+        PIL.Image: デコード済みの画像
+    """
+    return decode_upload(image_data, max_size)
+
+
+def _render_branch(img, stages, output_base, encoder_settings=None):
+    """
+    残りの処理段を適用してエンコード・保存する（画像処理プールのワーカーで実行）
+
+    Args:
+        img (PIL.Image): 共有された中間画像
+        stages (list): 残りの処理段のオペレーション定義
+        output_base (str): 保存先のパス（拡張子は出力形式から決める）
+        encoder_settings (dict, optional): エンコード設定
+
+    Returns:
+        str: 保存先のパス
+    """
+    # 最後がピクセル化の場合は縮小画像のまま保存する
+    pixel_art_path = render_pixel_art(img, [op for stage in stages for op in stage], output_base)
+    if pixel_art_path is not None:
+        return pixel_art_path
+
+    for stage in stages:
+        for step in compile_pipeline(stage):
+            img = step(img)
+    data, fmt = encode_image(img, encoder_settings)
+    output_path = output_base + extension_for(fmt)
+    # 書き込み途中のファイルを読まれないよう一時ファイルに保存してから置き換える
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def _render_tiled(image_data, ops, output_base, encoder_settings=None):
+    """
+    大きな画像を帯状分割で変換して保存する（画像処理プールのワーカーで実行）
+
+    入力は先頭から順にデコードし、画像全体の入力・中間画像を作りません。
+
+    Args:
+        image_data (bytes): 画像データ
+        ops (list): オペレーション定義のリスト
+        output_base (str): 保存先のパス（拡張子は出力形式から決める）
+        encoder_settings (dict, optional): エンコード設定
+
+    Returns:
+        str: 保存先のパス
+    """
+    # 出力形式の自動選択には縮小画像の変換結果を使う
+    format_hint = load_source_image(image_data, FLAT_IMAGE_SAMPLE_SIZE)
+    with Image.open(io.BytesIO(image_data)) as original:
+        scale = max(format_hint.size) / max(original.size)
+    for step in compile_pipeline(scale_ops(ops, scale)):
+        format_hint = step(format_hint)
+    return render_tiled_to_file(open_sequential(image_data), ops, output_base, encoder_settings, format_hint)
+
+
+def fan_out_styles(image_data, styles=None, executor=None, output_dir="temp_images", max_size=None, graph=None,
+                   cache=None, encoder_settings=None) -> Dict[str, Optional[str]]:
+    """
+    1枚の画像を複数のスタイルに一括で変換する
+
+    画像のデコードは1回だけ行い、スタイル間で共通する処理段の中間画像（グレースケールなど）は
+    スタイルグラフのノードとして一度だけ計算して共有します。以前の変換で計算済みのノードがあれば
+    そこから再開します。分岐後の処理と保存は executor で並列に実行します。
+    中間画像はそのまま渡すため、pickleせずに参照できる画像処理プール（スレッド）を使います。
+    大きな画像を元のサイズで変換する場合、帯状分割に対応するスタイルは中間画像を共有せず、
+    スタイルごとに帯状分割で処理します。
+
+    Args:
+        image_data (bytes): 画像データ
+        styles (list, optional): 変換するスタイル名（省略時はすべてのスタイル）
+        executor (Executor, optional): 並列実行に使うExecutor（画像処理プールなど。省略時は逐次実行）
+        output_dir (str): 変換画像の保存先ディレクトリ
+        max_size (int, optional): 長辺の最大サイズ（指定時は縮小した代理画像で変換）
+        graph (StyleGraph, optional): 中間画像を共有するスタイルグラフ（省略時はプロセス共有のもの）
+        cache (TransformCache, optional): 変換画像キャッシュ（指定時は変換済みのスタイルを再利用し、結果を登録）
+        encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+
+    Returns:
+        dict: {スタイル名: 変換後の画像パス（失敗した場合はNone）}
+    """
+    registry = get_style_registry()
+    graph = graph or get_style_graph()
+    styles = list(styles or registry.style_names())
+    source_key = image_key(image_data) + (f":{max_size}" if max_size else "")
+
+    pending = {}
+    if cache is not None:
+        variant = f"proxy{max_size}" if max_size else ""
+        cache_keys = {
+            style: cache.make_key(image_data, registry.get(style), variant, encoder_settings) for style in styles
+        }
+        paths = {style: cache.base_path(key) for style, key in cache_keys.items()}
+        for style, key in cache_keys.items():
+            cached_path = cache.get(key)
+            if cached_path is not None:
+                pending[style] = Future()
+                pending[style].set_result(cached_path)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        filename_hash = hashlib.md5(image_data).hexdigest()[:8]
+        paths = {style: os.path.join(output_dir, f"{timestamp}_{filename_hash}_{style}") for style in styles}
+
+    def submit(style, fn, *args):
+        if executor is not None:
+            pending[style] = executor.submit(fn, *args)
+            return
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        pending[style] = future
+
+    def expand(branches):
+        # 次の処理段の出力ノードごとにスタイルをまとめる（定義順を維持）
+        groups: Dict[str, List] = {}
+        for style, key, img, stages in branches:
+            if not stages:
+                submit(style, _render_branch, img, stages, paths[style], encoder_settings)
+                continue
+            groups.setdefault(node_key(key, stages[0]), []).append((style, key, img, stages))
+
+        shared = []
+        for members in groups.values():
+            if len(members) == 1:
+                style, _, img, stages = members[0]
+                submit(style, _render_branch, img, stages, paths[style], encoder_settings)
+            else:
+                shared.append(members)
+
+        # 複数のスタイルに共通する処理段は一度だけ計算してノードとして登録する
+        for members in shared:
+            _, key, img, stages = members[0]
+            child_key, child = graph.step(key, img, stages[0])
+            logger.info(f"中間画像を共有します: {len(members)}スタイル")
+            expand([(style, child_key, child, rest[1:]) for style, _, _, rest in members])
+
+    # 縮小画像で変換する場合は、ぼかしの半径などを縮小率に合わせる
+    scale = 1.0
+    if max_size:
+        with Image.open(io.BytesIO(image_data)) as original:
+            scale = min(1.0, max_size / max(original.size))
+
+    computed = [style for style in styles if style not in pending]
+    # 元のサイズの大きな画像は、帯状分割に対応するスタイルを帯ごとに処理する
+    # （最後がピクセル化のスタイルは縮小画像のまま保存するため対象外）
+    tiled = []
+    if scale == 1.0:
+        tiled = [
+            style for style in computed
+            if split_deferred_upscale(registry.get(style).ops)[1] is None
+            and should_tile(image_data, registry.get(style).ops)
+        ]
+    for style in tiled:
+        submit(style, _render_tiled, image_data, registry.get(style).ops, paths[style], encoder_settings)
+
+    load = partial(load_source_image, image_data, max_size)
+    expand([
+        (style, *graph.resume(source_key, load, scale_ops(registry.get(style).ops, scale)))
+        for style in computed if style not in tiled
+    ])
+
+    results = {}
+    for style in styles:
+        try:
+            results[style] = pending[style].result()
+            if cache is not None and style in computed:
+                cache.add_file(cache_keys[style])
+        except Exception as e:
+            logger.error(f"スタイル {style} の変換に失敗しました: {str(e)}")
+            results[style] = None
+    return results
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from image_lut import group_point_ops
+from image_styles import canonical_op, compile_pipeline
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("style_graph")
+
+# 中間画像キャッシュの既定の上限（バイト）
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def image_key(image_data):
+    """
+    画像データからグラフの起点ノードのキーを求める
+
+    Args:
+        image_data (bytes): 画像データ
+
+    Returns:
+        str: 画像データのハッシュ値
+    """
+    return hashlib.sha1(image_data).hexdigest()
+
+
+def node_key(parent_key, ops):
+    """
+    親ノードにオペレーション列を適用したノードのキーを求める
+
+    キーは (画像のハッシュ値, オペレーション, パラメータ) の連鎖から決まるため、
+    別のスタイルでも同じ処理をたどった中間画像は同じキーになります。
+
+    Args:
+        parent_key (str): 親ノードのキー
+        ops (list): この処理段のオペレーション定義
+
+    Returns:
+        str: ノードのキー
+    """
+    payload = parent_key + "|" + "|".join(canonical_op(op) for op in ops)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class StyleGraph:
+    """
+    スタイルのパイプラインを中間画像を共有するDAGとして実行するクラス
+
+    パイプラインを処理段（連続する画素単位のオペレーションはまとめて1段）に分け、
+    各処理段の出力をノードとしてメモ化します。スタイルの組み合わせを変えたり
+    後半のパラメータだけを変えた場合は、キャッシュ済みの最も深いノードから再開します。
+    ノードはバイト数の上限を超えると最も長く使われていないものから破棄されます。
+
+    Attributes:
+        max_bytes (int): 保持する中間画像の合計サイズの上限（バイト）
+        engine (str): 画像処理エンジン（省略時は既定値）
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, engine=None):
+        """
+        StyleGraphクラスの初期化
+
+        Args:
+            max_bytes (int): 保持する中間画像の合計サイズの上限（バイト）
+            engine (str, optional): 画像処理エンジン（"pil" または "lut"）
+        """
+        self.max_bytes = max_bytes
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._nodes = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def plan(ops) -> List[List[dict]]:
+        """
+        オペレーション列を処理段（ノード）の列に分割する
+
+        Args:
+            ops (list): オペレーション定義のリスト
+
+        Returns:
+            list: 処理段ごとのオペレーション定義のリスト
+        """
+        return [[ops[i] for i in group] for group in group_point_ops(ops)]
+
+    def get(self, key):
+        """
+        キャッシュ済みのノードの画像を返す
+
+        Args:
+            key (str): ノードのキー
+
+        Returns:
+            PIL.Image: 中間画像（キャッシュにない場合はNone）
+        """
+        with self._lock:
+            img = self._nodes.get(key)
+            if img is not None:
+                self._nodes.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        """
+        ノードの画像を登録する（登録後の画像は変更しないこと）
+
+        Args:
+            key (str): ノードのキー
+            img (PIL.Image): 中間画像
+        """
+        size = img.width * img.height * len(img.getbands())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._nodes.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.width * previous.height * len(previous.getbands())
+            self._nodes[key] = img
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._nodes.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def resume(self, source_key, source, ops) -> Tuple[str, object, List[List[dict]]]:
+        """
+        オペレーション列のうちキャッシュ済みの最も深いノードを探す
+
+        Args:
+            source_key (str): 起点ノードのキー（image_keyの値）
+            source (PIL.Image or callable): 起点の画像、または画像を返す関数（デコードが必要な場合のみ呼び出す）
+            ops (list): オペレーション定義のリスト
+
+        Returns:
+            str: 再開するノードのキー
+            PIL.Image: 再開するノードの画像
+            list: 残りの処理段
+        """
+        stages = self.plan(ops)
+        keys = []
+        key = source_key
+        for stage in stages:
+            key = node_key(key, stage)
+            keys.append(key)
+
+        for depth in range(len(stages), 0, -1):
+            img = self.get(keys[depth - 1])
+            if img is not None:
+                self.hits += 1
+                return keys[depth - 1], img, stages[depth:]
+        if stages:
+            self.misses += 1
+        return source_key, self.source(source_key, source), stages
+
+    def source(self, source_key, source):
+        """
+        起点ノードの画像を返す（デコード済みの画像があれば再利用）
+
+        Args:
+            source_key (str): 起点ノードのキー
+            source (PIL.Image or callable): 起点の画像、または画像を返す関数
+
+        Returns:
+            PIL.Image: 起点の画像
+        """
+        img = self.get(source_key)
+        if img is None:
+            img = source() if callable(source) else source
+            self.put(source_key, img)
+        return img
+
+    def step(self, key, img, stage):
+        """
+        1つの処理段を実行し、結果をノードとして登録する
+
+        Args:
+            key (str): 親ノードのキー
+            img (PIL.Image): 親ノードの画像
+            stage (list): 処理段のオペレーション定義
+
+        Returns:
+            str: 子ノードのキー
+            PIL.Image: 子ノードの画像
+        """
+        child_key = node_key(key, stage)
+        child = self.get(child_key)
+        if child is None:
+            child = img
+            for step in compile_pipeline(stage, self.engine):
+                child = step(child)
+            self.put(child_key, child)
+        return child_key, child
+
+    def run(self, source_key, source, ops):
+        """
+        オペレーション列を実行する（キャッシュ済みのノードから再開し、新しい処理段のみ計算）
+
+        Args:
+            source_key (str): 起点ノードのキー（image_keyの値）
+            source (PIL.Image or callable): 起点の画像、または画像を返す関数（デコードが必要な場合のみ呼び出す）
+            ops (list): オペレーション定義のリスト
+
+        Returns:
+            PIL.Image: 変換後の画像
+        """
+        key, img, stages = self.resume(source_key, source, ops)
+        for stage in stages:
+            key, img = self.step(key, img, stage)
+        return img
+
+    def stats(self) -> dict:
+        """
+        キャッシュの状態を返す
+
+        Returns:
+            dict: ノード数・合計バイト数・ヒット数・ミス数
+        """
+        with self._lock:
+            return {"nodes": len(self._nodes), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """すべてのノードを破棄する"""
+        with self._lock:
+            self._nodes.clear()
+            self._bytes = 0
+
+
+_graph: Optional[StyleGraph] = None
+_graph_lock = threading.Lock()
+
+
+def get_style_graph() -> StyleGraph:
+    """
+    プロセス内で共有するスタイルグラフを返す
+
+    Returns:
+        StyleGraph: スタイルグラフ
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = StyleGraph()
+    return _graph
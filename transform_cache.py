@@ -0,0 +1,287 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from image_backend import get_image_backend
+from image_decode import NORMALIZE_VERSION
+from image_encoder import ANIMATION_FORMATS, FORMATS, encode_image, extension_for, settings_key, DEFAULT_ENCODER_SETTINGS
+
+# ロギング設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("transform_cache")
+
+# 変換画像キャッシュの保存先
+CACHE_DIR = os.path.join("data", "transform_cache")
+
+# 変換画像の拡張子（出力形式ごと）
+CACHE_EXTENSIONS = tuple(spec["extension"] for spec in (*FORMATS.values(), *ANIMATION_FORMATS.values()))
+
+
+class TransformCache:
+    """
+    変換画像を (画像データのハッシュ値, スタイル定義のバージョン, パラメータ) で再利用するキャッシュ
+
+    エンコード済みの画像をメモリ上のLRU（前段）とディスク（後段）の2段で保持します。
+    メモリは合計バイト数、ディスクは合計バイト数の上限を超えると
+    最も長く使われていないものから削除します。
+
+    Attributes:
+        directory (str): ディスクキャッシュのディレクトリ
+        max_memory_bytes (int): メモリ上に保持するエンコード済み画像の合計サイズの上限
+        max_disk_bytes (int): ディスクに保持する画像の合計サイズの上限
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_memory_bytes=128 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024):
+        """
+        TransformCacheクラスの初期化
+
+        Args:
+            directory (str): ディスクキャッシュのディレクトリ
+            max_memory_bytes (int): メモリ上に保持するエンコード済み画像の合計サイズの上限
+            max_disk_bytes (int): ディスクに保持する画像の合計サイズの上限
+        """
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def params_key(recipe, variant="", encoder_settings=None):
+        """
+        画像データを除いた変換条件のキーを求める
+
+        スタイル定義の版・処理内容、正規化処理の版、エンコード設定、画像処理バックエンドを含むため、
+        知覚ハッシュインデックスの名前空間にも使用できます。
+
+        Args:
+            recipe (StyleRecipe): スタイル定義
+            variant (str, optional): 同じスタイルの別の出力を区別する文字列（縮小画像など）
+            encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+
+        Returns:
+            str: 変換条件のキー
+        """
+        # デコード・エンコードの結果は画像処理バックエンドによって僅かに異なるため、キーに含める
+        params = [
+            recipe.ops, variant, NORMALIZE_VERSION, settings_key(encoder_settings or DEFAULT_ENCODER_SETTINGS),
+            get_image_backend().name
+        ]
+        params_hash = hashlib.sha1(json.dumps(params, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        return f"v{recipe.version}_{params_hash}"
+
+    @staticmethod
+    def make_key(image_data, recipe, variant="", encoder_settings=None):
+        """
+        キャッシュキーを求める
+
+        Args:
+            image_data (bytes): 元の画像データ（全体をハッシュする）
+            recipe (StyleRecipe): スタイル定義
+            variant (str, optional): 同じスタイルの別の出力を区別する文字列（縮小画像など）
+            encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+
+        Returns:
+            str: キャッシュキー
+        """
+        content_hash = hashlib.sha256(image_data).hexdigest()
+        return f"{content_hash}_{TransformCache.params_key(recipe, variant, encoder_settings)}"
+
+    def base_path(self, key):
+        """
+        キャッシュキーに対応するディスク上のパス（拡張子なし）を返す
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            str: 拡張子を除いたファイルパス
+        """
+        return os.path.join(self.directory, key)
+
+    def find(self, key) -> Optional[str]:
+        """
+        キャッシュキーに対応する保存済みのファイルを探す
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            str: ファイルパス（ない場合はNone）
+        """
+        base = self.base_path(key)
+        for extension in CACHE_EXTENSIONS:
+            if os.path.exists(base + extension):
+                return base + extension
+        return None
+
+    def _entries(self):
+        """ディスク上のキャッシュファイルを列挙する"""
+        return [
+            entry for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(CACHE_EXTENSIONS)
+        ]
+
+    def get(self, key) -> Optional[str]:
+        """
+        キャッシュ済みの変換画像のパスを返す
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            str: 変換画像のパス（キャッシュにない場合はNone）
+        """
+        path = self.find(key)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+        if path is None:
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        # ディスク側のLRUのために最終利用時刻を更新
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def read(self, path) -> bytes:
+        """
+        変換画像のデータを返す（キャッシュ内のファイルはメモリ上のデータを優先）
+
+        Args:
+            path (str): 変換画像のパス
+
+        Returns:
+            bytes: 画像データ
+        """
+        key = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        with open(path, "rb") as f:
+            data = f.read()
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.directory):
+            with self._lock:
+                self._remember(key, data)
+        return data
+
+    def put(self, key, img, encoder_settings=None) -> Optional[str]:
+        """
+        変換画像をエンコードしてキャッシュに登録する
+
+        Args:
+            key (str): キャッシュキー
+            img (PIL.Image): 変換画像
+            encoder_settings (dict, optional): エンコード設定（省略時は既定値）
+
+        Returns:
+            str: 保存した画像のパス（保存に失敗した場合はNone）
+        """
+        data, fmt = encode_image(img, encoder_settings)
+        path = self.base_path(key) + extension_for(fmt)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"変換画像のキャッシュへの保存に失敗しました: {str(e)}")
+            return None
+
+        with self._lock:
+            self._remember(key, data)
+            self._disk_bytes += len(data) - replaced
+        self._evict_disk()
+        return path
+
+    def add_file(self, key):
+        """
+        base_path(key) に拡張子を付けて直接書き込まれたファイルをキャッシュに登録する
+
+        Args:
+            key (str): キャッシュキー
+        """
+        path = self.find(key)
+        if path is None:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _remember(self, key, data):
+        """メモリ上のLRUに登録する（ロック取得済みの状態で呼び出す）"""
+        if len(data) > self.max_memory_bytes:
+            return
+        self._forget(key)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget(self, key):
+        """メモリ上のLRUから削除する（ロック取得済みの状態で呼び出す）"""
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+
+    def _evict_disk(self):
+        """ディスクの合計サイズが上限を超えた場合、最終利用時刻の古い順に削除する"""
+        with self._lock:
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.unlink(entry.path)
+                    total -= size
+                    self._forget(os.path.splitext(entry.name)[0])
+                    logger.info(f"変換画像のキャッシュを削除しました: {entry.name}")
+                except OSError as e:
+                    logger.error(f"変換画像のキャッシュの削除に失敗しました: {str(e)}")
+            self._disk_bytes = total
+
+    def stats(self) -> dict:
+        """
+        キャッシュの状態を返す
+
+        Returns:
+            dict: メモリ・ディスクの使用量とヒット数・ミス数
+        """
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -21,7 +21,8 @@ def create_static_directories():
         "static/js",
         "static/images",
         "temp",
-        "temp_images"
+        "temp_images",
+        "data"
     ]
     
     for directory in directories: